@@ -0,0 +1,210 @@
+"""
+End-to-end benchmark of :func:`pynoaa.get_year` and :func:`pynoaa.get_interval`.
+
+A synthetic NOAA tree is served by a local :class:`benchmarks.ftpserver.FTPServer`
+(with optional bandwidth limit, latency and dropped transfers), pynoaa is
+pointed to it and to a scratch data directory, and the wall time and the
+throughput of each stage (download, decompress, merge, convert) are reported
+and saved as JSON, so results can be compared between commits.
+
+Run from the repository root::
+
+    python -m benchmarks.e2e --years 1990 1991 --stations 20 --lines 5000 -o e2e.json
+"""
+import argparse
+import functools
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+from pynoaa import data
+
+from .ftpserver import FTPServer, FaultInjection
+from .synthetic import build_tree
+
+STAGES = ("download", "decompress", "merge", "convert")
+STAGE_METHODS = dict(fetch="download", decompress="decompress", merge="merge", stream_merge="merge",
+                     convert_ish="convert")
+
+
+class StageTimer(object):
+    """Records the wall time spent by each year in each stage, wrapping the
+    stage methods of :class:`pynoaa.data.YearData`.
+    """
+
+    def __init__(self):
+        self.times = dict()
+        self.lock = threading.Lock()
+        self.originals = dict()
+
+    def install(self):
+        for method, stage in STAGE_METHODS.items():
+            original = getattr(data.YearData, method)
+            self.originals[method] = original
+            setattr(data.YearData, method, self.wrap(original, stage))
+
+    def uninstall(self):
+        for method, original in self.originals.items():
+            setattr(data.YearData, method, original)
+        self.originals = dict()
+
+    def wrap(self, method, stage):
+        timer = self
+
+        @functools.wraps(method)
+        def timed(year_data, *args, **kwargs):
+            start = time.time()
+            try:
+                return method(year_data, *args, **kwargs)
+            finally:
+                with timer.lock:
+                    key = (year_data.year, stage)
+                    timer.times[key] = timer.times.get(key, 0.0) + time.time() - start
+        return timed
+
+
+def set_local_dirs(work_dir):
+    data.LOCAL_DATA = os.path.join(work_dir, "data")
+    data.LOCAL_DATA_RAW_DIR = os.path.join(data.LOCAL_DATA, "raw")
+    data.LOCAL_DATA_DECOMPRESS = os.path.join(data.LOCAL_DATA, "decompress")
+    data.LOCAL_DATA_MANIFEST = os.path.join(data.LOCAL_DATA, "manifest")
+    data.LOCAL_DATA_CATALOG = os.path.join(data.LOCAL_DATA, "catalog.sqlite")
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def throughput(num_bytes, seconds):
+    return round(num_bytes / seconds / 1e6, 3) if seconds else None
+
+
+def run(years, num_stations, lines_per_station, seed=0, bandwidth=None, latency=0.0, drop_rate=0.0,
+        work_dir=None, **kwargs):
+    """
+    Runs the benchmark.
+
+    Args:
+       years (list): years to retrieve, a single year runs :func:`get_year`
+          and several ones :func:`get_interval` (they must be consecutive).
+       num_stations (int): station files per year.
+       lines_per_station (int): records per station file.
+       seed (int): seed of the synthetic data.
+       bandwidth (int): bytes per second of each transfer, None for no limit.
+       latency (float): seconds each ftp reply is delayed.
+       drop_rate (float): probability of dropping a transfer halfway.
+       work_dir (str): directory for the served tree, the data and the
+          output. A temporary directory is used and removed if None.
+
+    Extra keyword arguments are passed to :class:`pynoaa.data.YearData`.
+
+    Returns:
+       A dict with the results.
+    """
+    tmp_dir = None
+    if work_dir is None:
+        work_dir = tmp_dir = tempfile.mkdtemp(prefix="pynoaa-bench-")
+    try:
+        ftp_root = os.path.join(work_dir, "ftp")
+        out_dir = os.path.join(work_dir, "out")
+        build_tree(ftp_root, years, num_stations, lines_per_station, seed)
+        set_local_dirs(work_dir)
+
+        timer = StageTimer()
+        timer.install()
+        faults = FaultInjection(drop_rate, seed=seed) if drop_rate else None
+        try:
+            with FTPServer(ftp_root, bandwidth=bandwidth, latency=latency, faults=faults) as server:
+                data.SERVER_URL = "127.0.0.1"
+                data.SERVER_PORT = server.port
+                start = time.time()
+                if len(years) == 1:
+                    data.get_year(years[0], out_dir, **kwargs)
+                else:
+                    data.get_interval(min(years), max(years), out_dir, **kwargs)
+                wall_time = time.time() - start
+        finally:
+            timer.uninstall()
+
+        # compressed bytes are downloaded, the merged (uncompressed) bytes go through the other stages
+        stage_bytes = dict((stage, 0) for stage in STAGES)
+        result_years = dict()
+        for year in years:
+            raw_dir = os.path.join(data.LOCAL_DATA_RAW_DIR, str(year))
+            merged_file = os.path.join(out_dir, "plain_format", str(year))
+            raw_size = sum(os.path.getsize(os.path.join(raw_dir, f)) for f in os.listdir(raw_dir) if f.endswith(".gz"))
+            merged_size = os.path.getsize(merged_file) if os.path.exists(merged_file) else 0
+            sizes = dict(download=raw_size, decompress=merged_size, merge=merged_size, convert=merged_size)
+            result_years[str(year)] = dict()
+            for stage in STAGES:
+                seconds = timer.times.get((year, stage))
+                if seconds is None:
+                    continue
+                stage_bytes[stage] += sizes[stage]
+                result_years[str(year)][stage] = dict(seconds=round(seconds, 4), bytes=sizes[stage],
+                                                      mb_per_s=throughput(sizes[stage], seconds))
+
+        stages = dict()
+        for stage in STAGES:
+            seconds = sum(t for (_, s), t in timer.times.items() if s == stage)
+            if seconds:
+                stages[stage] = dict(seconds=round(seconds, 4), bytes=stage_bytes[stage],
+                                     mb_per_s=throughput(stage_bytes[stage], seconds))
+
+        return dict(commit=get_commit(),
+                    timestamp=time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    python=platform.python_version(),
+                    config=dict(years=years, stations=num_stations, lines_per_station=lines_per_station, seed=seed,
+                                bandwidth=bandwidth, latency=latency, drop_rate=drop_rate,
+                                options=dict(kwargs)),
+                    wall_time=round(wall_time, 4),
+                    mb_per_s=throughput(stage_bytes["download"], wall_time),
+                    dropped_transfers=faults.drops if faults else 0,
+                    stages=stages,
+                    years=result_years)
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end pynoaa benchmark against a local FTP server.')
+    parser.add_argument('-y', '--years', nargs='+', type=int, default=[1990], help='years to retrieve.')
+    parser.add_argument('--stations', type=int, default=20, help='station files per year.')
+    parser.add_argument('--lines', type=int, default=5000, help='records per station file.')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic data.')
+    parser.add_argument('--bandwidth', type=int, default=None, help='bytes per second of each transfer.')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds each ftp reply is delayed.')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='probability of dropping a transfer.')
+    parser.add_argument('-s', '--stream', action='store_true', help='use the streaming merge.')
+    parser.add_argument('-e', '--engine', choices=['python', 'numpy', 'bytes'], default='python', help='ish engine.')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='ish processes per year, 0 for one per cpu.')
+    parser.add_argument('--work-dir', default=None, help='keep the data in this directory.')
+    parser.add_argument('-o', '--output', default=None, help='save the results to this JSON file.')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show the pynoaa log.')
+    args = parser.parse_args()
+
+    if not args.verbose:
+        data.package_logger.setLevel(logging.WARNING)
+
+    result = run(sorted(args.years), args.stations, args.lines, seed=args.seed, bandwidth=args.bandwidth,
+                 latency=args.latency, drop_rate=args.drop_rate, work_dir=args.work_dir, stream=args.stream,
+                 engine=args.engine, workers=args.workers or None)
+    text = json.dumps(result, indent=2, sort_keys=True)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
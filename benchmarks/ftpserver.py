@@ -0,0 +1,246 @@
+"""
+Minimal in-process FTP server used by the benchmarks as a stand-in for
+ftp.ncdc.noaa.gov.
+
+It serves a local directory read-only and implements the commands used by
+:mod:`ftplib` and pynoaa: USER, PASS, TYPE, CWD, PWD, PORT, EPRT, PASV, EPSV,
+MLSD, SIZE, REST, RETR, NOOP and QUIT. Transfers can be throttled, replies
+delayed and data connections dropped to reproduce a slow or flaky link.
+"""
+import os
+import random
+import socket
+import socketserver
+import threading
+import time
+from datetime import datetime
+
+
+class FaultInjection(object):
+    """Drops data connections in the middle of RETR transfers.
+
+    Args:
+       drop_rate (float): probability of dropping a transfer.
+       drop_after (float): fraction of the file sent before the drop.
+       seed (int): seed of the random generator.
+    """
+
+    def __init__(self, drop_rate=0.0, drop_after=0.5, seed=None):
+        self.drop_rate = drop_rate
+        self.drop_after = drop_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.drops = 0
+
+    def drop_point(self, size):
+        """
+        Returns the number of bytes to send before dropping the transfer, or
+        None to send the whole file.
+        """
+        with self.lock:
+            if self.random.random() < self.drop_rate:
+                self.drops += 1
+                return int(size * self.drop_after)
+        return None
+
+
+class FTPHandler(socketserver.StreamRequestHandler):
+
+    def setup(self):
+        super(FTPHandler, self).setup()
+        self.cwd = "/"
+        self.data_address = None
+        self.passive_socket = None
+        self.rest = 0
+
+    def reply(self, text):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.wfile.write((text + "\r\n").encode())
+
+    def handle(self):
+        self.reply("220 pynoaa benchmark ftp server")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            cmd, _, arg = line.decode().rstrip("\r\n").partition(" ")
+            method = getattr(self, "ftp_" + cmd.upper(), None)
+            if method is None:
+                self.reply("502 Command not implemented")
+                continue
+            try:
+                if method(arg) is False:
+                    break
+            except OSError:
+                break
+        if self.passive_socket is not None:
+            self.passive_socket.close()
+
+    def local_path(self, path):
+        path = os.path.normpath(os.path.join(self.cwd, path or "."))
+        return os.path.join(self.server.root, path.lstrip("/"))
+
+    def open_data_connection(self):
+        if self.passive_socket is not None:
+            conn, _ = self.passive_socket.accept()
+            self.passive_socket.close()
+            self.passive_socket = None
+            return conn
+        return socket.create_connection(self.data_address)
+
+    def ftp_USER(self, arg):
+        self.reply("331 Password required")
+
+    def ftp_PASS(self, arg):
+        self.reply("230 Logged in")
+
+    def ftp_TYPE(self, arg):
+        self.reply("200 Type set to " + arg)
+
+    def ftp_NOOP(self, arg):
+        self.reply("200 OK")
+
+    def ftp_PWD(self, arg):
+        self.reply('257 "{0}"'.format(self.cwd))
+
+    def ftp_CWD(self, arg):
+        path = os.path.normpath(os.path.join(self.cwd, arg))
+        if not os.path.isdir(os.path.join(self.server.root, path.lstrip("/"))):
+            self.reply("550 No such directory")
+        else:
+            self.cwd = path
+            self.reply("250 OK")
+
+    def ftp_PORT(self, arg):
+        parts = arg.split(",")
+        self.data_address = (".".join(parts[:4]), int(parts[4]) * 256 + int(parts[5]))
+        self.reply("200 PORT command successful")
+
+    def ftp_EPRT(self, arg):
+        _, _, host, port, _ = arg.split(arg[0])
+        self.data_address = (host, int(port))
+        self.reply("200 EPRT command successful")
+
+    def ftp_PASV(self, arg):
+        self.passive_socket = socket.socket()
+        self.passive_socket.bind((self.server.server_address[0], 0))
+        self.passive_socket.listen(1)
+        host, port = self.passive_socket.getsockname()
+        self.reply("227 Entering Passive Mode ({0},{1},{2})".format(host.replace(".", ","), port // 256, port % 256))
+
+    def ftp_EPSV(self, arg):
+        self.passive_socket = socket.socket()
+        self.passive_socket.bind((self.server.server_address[0], 0))
+        self.passive_socket.listen(1)
+        self.reply("229 Entering Extended Passive Mode (|||{0}|)".format(self.passive_socket.getsockname()[1]))
+
+    def ftp_SIZE(self, arg):
+        path = self.local_path(arg)
+        if os.path.isfile(path):
+            self.reply("213 {0}".format(os.path.getsize(path)))
+        else:
+            self.reply("550 No such file")
+
+    def ftp_REST(self, arg):
+        self.rest = int(arg)
+        self.reply("350 Restarting at {0}".format(self.rest))
+
+    def ftp_MLSD(self, arg):
+        path = self.local_path(arg)
+        if not os.path.isdir(path):
+            self.reply("550 No such directory")
+            return
+        lines = []
+        for name in sorted(os.listdir(path)):
+            st = os.stat(os.path.join(path, name))
+            kind = "dir" if os.path.isdir(os.path.join(path, name)) else "file"
+            modify = datetime.utcfromtimestamp(st.st_mtime).strftime("%Y%m%d%H%M%S")
+            lines.append("type={0};size={1};modify={2}; {3}\r\n".format(kind, st.st_size, modify, name))
+        self.reply("150 Opening data connection")
+        with self.open_data_connection() as conn:
+            conn.sendall("".join(lines).encode())
+        self.reply("226 Transfer complete")
+
+    def ftp_RETR(self, arg):
+        path = self.local_path(arg)
+        rest, self.rest = self.rest, 0
+        if not os.path.isfile(path):
+            self.reply("550 No such file")
+            return
+        size = os.path.getsize(path)
+        drop_at = self.server.faults.drop_point(size - rest) if self.server.faults else None
+        self.reply("150 Opening data connection")
+        conn = self.open_data_connection()
+        sent = 0
+        with open(path, "rb") as f:
+            f.seek(rest)
+            start = time.time()
+            while True:
+                block = f.read(self.server.block_size)
+                if not block:
+                    break
+                if drop_at is not None and sent + len(block) > drop_at:
+                    conn.sendall(block[:drop_at - sent])
+                    conn.close()
+                    self.reply("426 Connection closed; transfer aborted")
+                    return
+                conn.sendall(block)
+                sent += len(block)
+                if self.server.bandwidth:
+                    delay = start + sent / float(self.server.bandwidth) - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+        conn.close()
+        self.server.bytes_sent += sent
+        self.reply("226 Transfer complete")
+
+    def ftp_QUIT(self, arg):
+        self.reply("221 Bye")
+        return False
+
+
+class FTPServer(socketserver.ThreadingTCPServer):
+    """Read-only FTP server running in a background thread.
+
+    Args:
+       root (str): directory served as "/".
+       host (str): address to listen on.
+       port (int): port to listen on, 0 for any free port.
+       bandwidth (int): maximum bytes per second of each transfer, None for
+          no limit.
+       latency (float): seconds each reply is delayed.
+       faults (FaultInjection): drops transfers, None for no faults.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, root, host="127.0.0.1", port=0, bandwidth=None, latency=0.0, faults=None,
+                 block_size=64 * 1024):
+        socketserver.ThreadingTCPServer.__init__(self, (host, port), FTPHandler)
+        self.root = root
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.faults = faults
+        self.block_size = block_size
+        self.bytes_sent = 0
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name="ftp-server", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
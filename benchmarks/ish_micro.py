@@ -0,0 +1,188 @@
+"""
+Micro-benchmarks of the ish converter on synthetic records (see
+:mod:`benchmarks.synthetic`).
+
+Each extractor of :mod:`pynoaa.ish` is timed on its own over the same lines,
+and the whole :func:`pynoaa.ish.convert` is timed for every available engine
+in a fresh process, which also reports its peak RSS. Results are given in
+lines per second and can be saved as JSON.
+
+Run from the repository root::
+
+    python -m benchmarks.ish_micro --lines 100000 --share AW=0.5 -o ish.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from pynoaa import ish
+
+from .e2e import get_commit
+from .synthetic import SENTINEL_SHARE, generate_lines
+
+
+def extractors():
+    """
+    Returns the extractors to time, as (name, function) pairs. Each function
+    takes a line and its tokenized additional data section.
+    """
+    pcp = ish.Pcp()
+    return [
+        ("tokenize", lambda line, index: ish.tokenize(line)),
+        ("get_control_data_section", lambda line, index: ish.get_control_data_section(line)),
+        ("format_control_data", lambda line, index: ish.format_control_data(ish.get_control_data_section(line))),
+        ("get_mandatory_data_section", lambda line, index: ish.get_mandatory_data_section(line)),
+        ("get_oc1", ish.get_oc1),
+        ("get_gf1", ish.get_gf1),
+        ("get_xw", lambda line, index: [ish.get_xw(line, index, name, ish.mw_slicer) for name in ish.MW_NAMES]),
+        ("get_ay1", ish.get_ay1),
+        ("get_ma1", ish.get_ma1),
+        ("get_ka1", ish.get_ka1),
+        ("get_aax", lambda line, index: [ish.get_aax(line, index, name, pcp) for name in ish.AA_NAMES]),
+        ("get_aj1", ish.get_aj1),
+    ]
+
+
+def time_extractors(lines, repeat=3):
+    """
+    Times each extractor over all the lines, keeping the best of repeat runs.
+
+    Returns:
+       A dict mapping each extractor to its seconds and lines per second.
+    """
+    indexes = [ish.tokenize(line) for line in lines]
+    results = dict()
+    for name, function in extractors():
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for line, index in zip(lines, indexes):
+                function(line, index)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = dict(seconds=round(best, 4), lines_per_s=round(len(lines) / best))
+    return results
+
+
+def convert_file(input_filename, output_filename, engine, workers):
+    """
+    Converts a file, meant to run in a fresh process.
+
+    Returns:
+       The seconds taken, the peak RSS in KB of the process before the
+       conversion and the peak RSS after it.
+    """
+    ish.get_engine(engine)  # import the engine first, so its memory is part of the baseline
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    ish.convert(input_filename, output_filename, engine=engine, workers=workers)
+    elapsed = time.perf_counter() - start
+    return elapsed, rss_before, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def time_convert(input_filename, num_lines, engine, workers=1, repeat=3):
+    """
+    Times :func:`pynoaa.ish.convert`, keeping the best of repeat runs, each
+    one in a new process so its peak RSS is not affected by the others.
+    Child processes of a parallel conversion are not included in the RSS.
+    """
+    output_filename = input_filename + "." + engine
+    best = None
+    for _ in range(repeat):
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            result = executor.submit(convert_file, input_filename, output_filename, engine, workers).result()
+        if best is None or result[0] < best[0]:
+            best = result
+    os.remove(output_filename)
+    elapsed, rss_before, rss_peak = best
+    return dict(seconds=round(elapsed, 4), lines_per_s=round(num_lines / elapsed), rss_before_kb=rss_before,
+                peak_rss_kb=rss_peak)
+
+
+def available_engines():
+    engines = list()
+    for engine in ("python", "numpy", "bytes"):
+        try:
+            ish.get_engine(engine)
+            engines.append(engine)
+        except ImportError:
+            pass
+    return engines
+
+
+def run(num_lines, seed=0, shares=None, sentinel_share=SENTINEL_SHARE, repeat=3, workers=1, engines=None):
+    """
+    Runs the benchmarks.
+
+    Args:
+       num_lines (int): number of synthetic lines.
+       seed (int): seed of the synthetic lines.
+       shares (dict): share of the lines having each section, see
+          :class:`benchmarks.synthetic.LineGenerator`.
+       sentinel_share (float): share of missing values.
+       repeat (int): runs of each benchmark, the best one is kept.
+       workers (int): processes of the conversion, see
+          :func:`pynoaa.ish.convert`.
+       engines (list): engines to time, all available if None.
+
+    Returns:
+       A dict with the results.
+    """
+    lines = list(generate_lines(num_lines, seed=seed, shares=shares, sentinel_share=sentinel_share))
+    tmp_dir = tempfile.mkdtemp(prefix="pynoaa-ish-")
+    try:
+        input_filename = os.path.join(tmp_dir, "input")
+        with open(input_filename, "w") as f:
+            f.writelines(lines)
+        convert = dict((engine, time_convert(input_filename, num_lines, engine, workers, repeat))
+                       for engine in engines or available_engines())
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return dict(commit=get_commit(),
+                timestamp=time.strftime("%Y-%m-%dT%H:%M:%S"),
+                python=platform.python_version(),
+                config=dict(lines=num_lines, seed=seed, shares=shares or dict(), sentinel_share=sentinel_share,
+                            repeat=repeat, workers=workers),
+                extractors=time_extractors(lines, repeat),
+                convert=convert)
+
+
+def parse_share(text):
+    section, _, share = text.partition("=")
+    return section.upper(), float(share)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of the pynoaa ish converter.')
+    parser.add_argument('-n', '--lines', type=int, default=50000, help='number of synthetic lines.')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic lines.')
+    parser.add_argument('--share', type=parse_share, action='append', default=[], metavar='SECTION=SHARE',
+                        help='share of lines having a section (OC1, GF1, MW, AW, AY1, MA1, KA1, AA, AJ1, REM, '
+                             'OTHER), can be repeated.')
+    parser.add_argument('--sentinel-share', type=float, default=SENTINEL_SHARE, help='share of missing values.')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='runs of each benchmark.')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='conversion processes, 0 for one per cpu.')
+    parser.add_argument('-e', '--engine', action='append', choices=['python', 'numpy', 'bytes'], default=None,
+                        help='engine to time, can be repeated (all available by default).')
+    parser.add_argument('-o', '--output', default=None, help='save the results to this JSON file.')
+    args = parser.parse_args()
+
+    result = run(args.lines, seed=args.seed, shares=dict(args.share), sentinel_share=args.sentinel_share,
+                 repeat=args.repeat, workers=args.workers or None, engines=args.engine)
+    text = json.dumps(result, indent=2, sort_keys=True)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
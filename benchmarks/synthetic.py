@@ -0,0 +1,182 @@
+"""
+Seeded generator of synthetic ISH records and of a NOAA like directory tree
+of gzipped station files, ``<root>/pub/data/noaa/<year>/USAF-WBAN-YEAR.gz``,
+used as the workload of the benchmarks.
+"""
+import gzip
+import os
+import random
+from datetime import datetime, timedelta
+
+NOAA_BASE_DIR = "pub/data/noaa/"
+REM_SECTION = "REMMET069METAR EDDM 010050Z 24006KT 9999 FEW030 OC1 GF1 MW1 08/06 Q1018 NOSIG"
+
+# share of the records having each section, MW, AW and AA have from 1 to 4 of them
+SECTION_SHARES = dict(OC1=.3, GF1=.3, MW=.4, AW=.2, AY1=.3, MA1=.5, KA1=.3, AA=.4, AJ1=.3, REM=.4, OTHER=.3)
+SENTINEL_SHARE = .1  # share of the values that are missing (9999 like)
+
+
+def signed(value, width):
+    return ("-" if value < 0 else "+") + str(abs(value)).zfill(width)
+
+
+class LineGenerator(object):
+    """Generates ISH records with the given share of each section and of
+    missing values, so every branch of the converter is exercised.
+    """
+
+    def __init__(self, rnd, shares=None, sentinel_share=SENTINEL_SHARE):
+        """
+        Args:
+           rnd (random.Random): random generator.
+           shares (dict): share of the records having each section, updating
+              :data:`SECTION_SHARES`.
+           sentinel_share (float): share of the values that are missing.
+        """
+        self.rnd = rnd
+        self.shares = dict(SECTION_SHARES)
+        self.shares.update(shares or dict())
+        self.sentinel_share = sentinel_share
+
+    def has(self, section):
+        return self.rnd.random() < self.shares[section]
+
+    def value(self, sentinel, low, high, width):
+        """
+        Returns sentinel with a probability of sentinel_share, or a number
+        between low and high padded with zeros to width.
+        """
+        if self.rnd.random() < self.sentinel_share:
+            return sentinel
+        return "{0:0{1}d}".format(self.rnd.randint(low, high), width)
+
+    def signed_value(self, low, high, width):
+        if self.rnd.random() < self.sentinel_share:
+            return "+" + "9" * width
+        return signed(self.rnd.randint(low, high), width)
+
+    def line(self, usaf, wban, when):
+        """
+        Generates one record of a station.
+
+        Args:
+           usaf (str): station USAF id.
+           wban (str): station WBAN id.
+           when (datetime): date of the observation.
+
+        Returns:
+           The record, ending with a new line.
+        """
+        rnd = self.rnd
+        control = "0000" + usaf + wban + when.strftime("%Y%m%d%H%M") + "4+51317+028783FM-12+0039" + "99999V020"
+        mandatory = (self.value("999", 0, 360, 3) + "1" + rnd.choice("NV9") +
+                     self.value("9999", 0, 200, 4) + "1" +
+                     self.value("99999", 0, 22000, 5) + "1" + "9N" +
+                     self.value("999999", 0, 20000, 6) + "1" + "9" + "9" +
+                     self.signed_value(-400, 400, 4) + "1" +
+                     self.signed_value(-450, 300, 4) + "1" +
+                     self.value("99999", 9600, 10500, 5) + "1")
+
+        additional = list()
+        if self.has("OC1"):
+            additional.append("OC1" + self.value("9999", 0, 400, 4) + "1")
+        if self.has("GF1"):
+            additional.append("GF1" + self.value("99", 0, 10, 2) + "99" + "1" + self.value("99", 0, 9, 2) + "1" +
+                              "99" + "1" + "99999" + "9" + self.value("99", 0, 9, 2) + "1" +
+                              self.value("99", 0, 9, 2) + "1")
+        if self.has("MW"):
+            for i in range(1, rnd.randint(1, 4) + 1):
+                additional.append("MW{0}{1:02d}1".format(i, rnd.randint(0, 99)))
+        if self.has("AW"):
+            for i in range(1, rnd.randint(1, 4) + 1):
+                additional.append("AW{0}{1:02d}1".format(i, rnd.randint(0, 99)))
+        if self.has("AY1"):
+            additional.append("AY1" + str(rnd.randint(0, 9)) + "1" + "06" + "1")
+        if self.has("MA1"):
+            additional.append("MA1" + self.value("99999", 9800, 10400, 5) + "1" +
+                              self.value("99999", 9000, 10400, 5) + "1")
+        if self.has("KA1"):
+            additional.append("KA1" + "120" + rnd.choice("MN") + self.signed_value(-300, 400, 4) + "1")
+        if self.has("AA"):
+            for i in range(1, rnd.randint(1, 4) + 1):
+                additional.append("AA{0}".format(i) + rnd.choice(["01", "06", "12", "24"]) +
+                                  self.value("9999", 0, 600, 4) + rnd.choice("129") + "1")
+        if self.has("AJ1"):
+            additional.append("AJ1" + self.value("9999", 0, 300, 4) + "11" + "999999" + "99")
+        if self.has("OTHER"):
+            # sections not converted, which the parser has to skip
+            additional.append("GA1" + "07" + "1" + "+00300" + "1" + "99" + "9")
+            additional.append("MD1" + "1" + "1" + "{0:03d}".format(rnd.randint(0, 100)) + "1" +
+                              signed(rnd.randint(-100, 100), 3) + "1")
+        rnd.shuffle(additional)
+
+        line = control + mandatory
+        if additional:
+            line += "ADD" + "".join(additional)
+        if self.has("REM"):
+            line += REM_SECTION
+        return line + "\n"
+
+
+def generate_station(generator, year, usaf, wban, num_lines):
+    """
+    Generates the records of a station, in chronological order.
+    """
+    when = datetime(year, 1, 1)
+    step = timedelta(minutes=max(1, 365 * 24 * 60 // max(num_lines, 1)))
+    for _ in range(num_lines):
+        yield generator.line(usaf, wban, when)
+        when += step
+
+
+def generate_lines(num_lines, seed=0, year=1990, lines_per_station=1000, **kwargs):
+    """
+    Generates num_lines records of consecutive stations, as found in a merged
+    year file. Extra keyword arguments are passed to :class:`LineGenerator`.
+    """
+    generator = LineGenerator(random.Random(seed), **kwargs)
+    station = 0
+    while num_lines > 0:
+        usaf = "{0:06d}".format(10000 + station * 10)
+        for line in generate_station(generator, year, usaf, "99999", min(num_lines, lines_per_station)):
+            yield line
+        num_lines -= lines_per_station
+        station += 1
+
+
+def build_tree(root, years, num_stations, lines_per_station, seed=0, **kwargs):
+    """
+    Writes the gzipped station files of each year under root. Existing files
+    are kept, so a tree can be reused between runs without changing its
+    modification times.
+
+    Args:
+       root (str): directory served as the ftp root.
+       years (list): years to generate.
+       num_stations (int): station files per year.
+       lines_per_station (int): records per station file.
+       seed (int): seed of the random generator, the same seed always
+          generates the same tree.
+
+    Extra keyword arguments are passed to :class:`LineGenerator`.
+
+    Returns:
+       A dict mapping each year to the total size of its files in bytes.
+    """
+    sizes = dict()
+    for year in years:
+        generator = LineGenerator(random.Random("{0}:{1}".format(seed, year)), **kwargs)
+        year_dir = os.path.join(root, NOAA_BASE_DIR, str(year))
+        os.makedirs(year_dir, exist_ok=True)
+        sizes[year] = 0
+        for i in range(num_stations):
+            usaf = "{0:06d}".format(10000 + i * 10)
+            wban = "99999"
+            filename = os.path.join(year_dir, "{0}-{1}-{2}.gz".format(usaf, wban, year))
+            lines = "".join(generate_station(generator, year, usaf, wban, lines_per_station))
+            if not os.path.exists(filename):
+                # a fixed mtime keeps the gzip header, and so the files, reproducible
+                with open(filename, "wb") as f, gzip.GzipFile(fileobj=f, mode="wb", mtime=0) as fw:
+                    fw.write(lines.encode())
+            sizes[year] += os.path.getsize(filename)
+    return sizes
@@ -1 +1 @@
-from .data import get_interval, get_year
+from .data import aggregate_interval, get_interval, get_station, get_year, iter_records
@@ -0,0 +1,170 @@
+"""
+MapReduce like aggregations over the merged year files, e.g. the maximum
+temperature of each year, or the daily minimum, maximum and mean temperature
+of each station.
+
+Each year file is split into line aligned ranges which are mapped in a pool
+of processes into partial aggregates (count, sum, min and max of each field
+for each group), and the partial aggregates of all the ranges and years are
+combined into the result. Compressed year files are mapped by the blocks of
+their block index instead (see :mod:`pynoaa.compress`). Fields are parsed with
+:class:`pynoaa.records.RecordParser`, so they have the same values and units
+as the ish output, and missing values are ignored.
+"""
+import bz2
+import gzip
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .compress import BLOCK_INDEX_SUFFIX, load_block_index, read_block
+from .ish import PARALLEL_CHUNK_SIZE, iter_range, split_file
+from .records import RecordParser
+
+# slices of a raw record used for each kind of group
+GROUP_KEYS = dict(year=slice(15, 19), month=slice(15, 21), day=slice(15, 23), hour=slice(15, 25))
+STATION_GROUP = "station"
+
+# numeric fields that can be aggregated
+AGGREGATE_FIELDS = ("dir", "spd", "gus", "clg", "vsb", "temp", "dewp", "slp", "alt", "stp", "max", "min", "pcp01",
+                    "pcp06", "pcp24", "pcpxx", "sd")
+
+
+def aggregate(filenames, fields, group_by=(STATION_GROUP, "day"), workers=None, chunk_size=PARALLEL_CHUNK_SIZE):
+    """
+    Aggregates fields of merged year files.
+
+    Args:
+       filenames (list): merged year files, or their gzip or bz2 versions
+          (as named by :func:`pynoaa.compress.get_extension`).
+       fields (list): fields to aggregate, see :data:`AGGREGATE_FIELDS`.
+       group_by (tuple): keys the records are grouped by, "station" (the
+          "USAF-WBAN" id) and any of :data:`GROUP_KEYS` ("year", "month"
+          (YYYYMM), "day" (YYYYMMDD) or "hour" (YYYYMMDDHH)). An empty tuple
+          aggregates all the records together.
+       workers (int): processes mapping the ranges, None for one per cpu.
+       chunk_size (int): approximate bytes of each range.
+
+    Returns:
+       A dict mapping each group, a tuple with the values of the group_by
+       keys, to a dict mapping each field to a dict with its count, sum, min,
+       max and mean. Fields without values in a group are not included.
+
+    Raises:
+       ValueError if a field or a group key is unknown.
+    """
+    check_arguments(fields, group_by)
+    workers = workers or os.cpu_count() or 1
+    result = dict()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = list()
+        for filename in filenames:
+            compression = get_compression(filename)
+            if compression is None:
+                num_chunks = max(workers, -(-os.path.getsize(filename) // chunk_size))
+                futures.extend(executor.submit(map_range, filename, start, end, fields, group_by)
+                               for start, end in split_file(filename, num_chunks))
+            elif os.path.exists(filename + BLOCK_INDEX_SUFFIX):
+                futures.extend(executor.submit(map_block, filename, block, compression, fields, group_by)
+                               for block in load_block_index(filename)["blocks"])
+            else:
+                futures.append(executor.submit(map_block, filename, None, compression, fields, group_by))
+        for future in as_completed(futures):
+            combine(result, future.result())
+    return finalize(result)
+
+
+def check_arguments(fields, group_by):
+    unknown = [name for name in fields if name not in AGGREGATE_FIELDS]
+    if unknown:
+        raise ValueError("Unknown fields: {0}".format(", ".join(unknown)))
+    unknown = [key for key in group_by if key != STATION_GROUP and key not in GROUP_KEYS]
+    if unknown:
+        raise ValueError("Unknown group keys: {0}".format(", ".join(unknown)))
+
+
+def get_compression(filename):
+    if filename.endswith(".gz"):
+        return "gzip"
+    if filename.endswith(".bz2"):
+        return "bz2"
+    return None
+
+
+def get_group(line, group_by):
+    return tuple(line[4:10] + "-" + line[10:15] if key == STATION_GROUP else line[GROUP_KEYS[key]]
+                 for key in group_by)
+
+
+def map_range(filename, start, end, fields, group_by):
+    """
+    Aggregates the lines of a file between byte offsets start and end.
+
+    Returns:
+       A dict mapping each group to a dict mapping each field to a
+       [count, sum, min, max] list.
+    """
+    return map_lines(iter_range(filename, start, end), fields, group_by)
+
+
+def map_block(filename, block, compression, fields, group_by):
+    """
+    Aggregates the lines of a block of a compressed file, see
+    :func:`map_range`. The whole file is read if block is None.
+    """
+    if block is not None:
+        return map_lines(io.StringIO(read_block(filename, block, compression).decode()), fields, group_by)
+    module = gzip if compression == "gzip" else bz2
+    with module.open(filename, "rt") as f:
+        return map_lines(f, fields, group_by)
+
+
+def map_lines(lines, fields, group_by):
+    parser = RecordParser(fields)
+    partial = dict()
+    for line in lines:
+        record = parser.parse(line)
+        stats = None
+        for name in fields:
+            value = record[name]
+            if value is None:
+                continue
+            if stats is None:
+                stats = partial.setdefault(get_group(line, group_by), dict())
+            field_stats = stats.get(name)
+            if field_stats is None:
+                stats[name] = [1, value, value, value]
+            else:
+                field_stats[0] += 1
+                field_stats[1] += value
+                if value < field_stats[2]:
+                    field_stats[2] = value
+                if value > field_stats[3]:
+                    field_stats[3] = value
+    return partial
+
+
+def combine(result, partial):
+    """
+    Combines a partial aggregate into result.
+    """
+    for group, stats in partial.items():
+        result_stats = result.get(group)
+        if result_stats is None:
+            result[group] = stats
+            continue
+        for name, field_stats in stats.items():
+            result_field_stats = result_stats.get(name)
+            if result_field_stats is None:
+                result_stats[name] = field_stats
+            else:
+                result_field_stats[0] += field_stats[0]
+                result_field_stats[1] += field_stats[1]
+                result_field_stats[2] = min(result_field_stats[2], field_stats[2])
+                result_field_stats[3] = max(result_field_stats[3], field_stats[3])
+
+
+def finalize(result):
+    return dict((group, dict((name, dict(count=count, sum=total, min=minimum, max=maximum, mean=total / count))
+                             for name, (count, total, minimum, maximum) in stats.items()))
+                for group, stats in result.items())
@@ -0,0 +1,110 @@
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from datetime import date
+
+CATALOG_TTL = 24 * 3600                  # seconds a listing of a recent year is considered fresh
+CATALOG_HISTORICAL_TTL = 30 * 24 * 3600  # seconds a listing of a historical year is considered fresh
+RECENT_YEARS = 2                         # years, counting the current one, that are still being updated
+
+_catalogs = dict()
+_catalogs_lock = threading.Lock()
+
+
+class Catalog(object):
+    """Persistent catalog of the remote year listings (the MLSD output), stored
+    in a sqlite database.
+
+    Listings are considered fresh for :data:`CATALOG_TTL` seconds if the year
+    is one of the :data:`RECENT_YEARS` most recent ones, and for
+    :data:`CATALOG_HISTORICAL_TTL` seconds otherwise, as historical years
+    almost never change.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+           path (str): path of the sqlite database, created if it doesn't exist.
+        """
+        self.path = path
+        with closing(self.connect()) as conn, conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS years (year INTEGER PRIMARY KEY, listed_at REAL NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS files (year INTEGER NOT NULL, filename TEXT NOT NULL, "
+                         "size INTEGER NOT NULL, modify TEXT, PRIMARY KEY (year, filename))")
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    @staticmethod
+    def ttl(year):
+        """
+        Returns the number of seconds a listing of the given year is fresh.
+        """
+        if year > date.today().year - RECENT_YEARS:
+            return CATALOG_TTL
+        else:
+            return CATALOG_HISTORICAL_TTL
+
+    def get(self, year, fresh=True):
+        """
+        Gets the listing of a year.
+
+        Args:
+           year (int): the year.
+           fresh (bool): if True, stale listings are ignored.
+
+        Returns:
+           A dict mapping each file name to its metadata, in the same format
+           returned by MLSD, or None if the year is not in the catalog or its
+           listing is stale.
+        """
+        with closing(self.connect()) as conn:
+            row = conn.execute("SELECT listed_at FROM years WHERE year = ?", (year,)).fetchone()
+            if row is None or (fresh and time.time() - row[0] >= self.ttl(year)):
+                return None
+            files = conn.execute("SELECT filename, size, modify FROM files WHERE year = ? ORDER BY filename",
+                                 (year,)).fetchall()
+        return dict((filename, dict(type="file", size=str(size), modify=modify)) for filename, size, modify in files)
+
+    def put(self, year, files):
+        """
+        Replaces the listing of a year.
+
+        Args:
+           year (int): the year.
+           files (dict): file names and their MLSD metadata.
+        """
+        with closing(self.connect()) as conn, conn:
+            conn.execute("DELETE FROM files WHERE year = ?", (year,))
+            conn.executemany("INSERT INTO files (year, filename, size, modify) VALUES (?, ?, ?, ?)",
+                             [(year, filename, int(metadata["size"]), metadata.get("modify"))
+                              for filename, metadata in files.items()])
+            conn.execute("INSERT OR REPLACE INTO years (year, listed_at) VALUES (?, ?)", (year, time.time()))
+
+    def total_size(self, year):
+        """
+        Returns the total size in bytes of the files of a year, even if its
+        listing is stale, or None if the year is not in the catalog.
+        """
+        with closing(self.connect()) as conn:
+            if conn.execute("SELECT 1 FROM years WHERE year = ?", (year,)).fetchone() is None:
+                return None
+            return conn.execute("SELECT COALESCE(SUM(size), 0) FROM files WHERE year = ?", (year,)).fetchone()[0]
+
+    def invalidate(self, year):
+        """
+        Marks the listing of a year as stale.
+        """
+        with closing(self.connect()) as conn, conn:
+            conn.execute("UPDATE years SET listed_at = 0 WHERE year = ?", (year,))
+
+
+def get_catalog(path):
+    """
+    Returns the catalog stored at path, shared by all the threads.
+    """
+    with _catalogs_lock:
+        if path not in _catalogs:
+            _catalogs[path] = Catalog(path)
+        return _catalogs[path]
@@ -0,0 +1,155 @@
+"""
+Columnar output format built on numpy.
+
+A merged year file is converted into a directory with one ``.npy`` file per
+column (see :data:`COLUMNS`), so a column of a whole year can be opened with
+``np.load(mmap_mode="r")`` and scanned without reading or parsing anything
+else. The numeric fields hold the same values, in the same units, as the ish
+output, with NaN where the ish output has ``*``, except max and min, which
+the ish output always leaves missing (see
+:func:`pynoaa.ish.get_extreme_temperatures`).
+"""
+import os
+import shutil
+from itertools import islice
+
+import numpy as np
+
+from . import ish
+from .ish_numpy import convert_block
+
+BLOCK_SIZE = 65536  # lines converted per block
+
+# (name, dtype) of each column, in the same order as the ish output
+COLUMNS = [("usaf", "S6"), ("wban", "S5"), ("time", "datetime64[m]"), ("dir", "f4"), ("spd", "f4"), ("gus", "f4"),
+           ("clg", "f4"), ("vsb", "f4"), ("temp", "f4"), ("dewp", "f4"), ("slp", "f4"), ("alt", "f4"),
+           ("stp", "f4"), ("max", "f4"), ("min", "f4"), ("pcp01", "f4"), ("pcp06", "f4"), ("pcp24", "f4"),
+           ("pcpxx", "f4"), ("sd", "f4")]
+
+_cds = dict(ish.cds_format)
+
+
+def convert(input_filename, output_dir, block_size=BLOCK_SIZE):
+    """
+    Converts a merged year file into a directory of column files. The
+    directory is replaced once all the columns are written.
+
+    Args:
+       input_filename (str): merged year file.
+       output_dir (str): directory of the column files.
+       block_size (int): lines converted at a time.
+    """
+    tmp_dir = output_dir.rstrip("/") + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    # blocks are appended to raw files, which are turned into .npy files once the number of rows is known
+    raw_files = dict((name, open(os.path.join(tmp_dir, name + ".raw"), "wb")) for name, _ in COLUMNS)
+    num_rows = 0
+    try:
+        with open(input_filename) as fin:
+            block = list(islice(fin, block_size))
+            while block:
+                for name, values in convert_lines(block).items():
+                    raw_files[name].write(values.tobytes())
+                num_rows += len(block)
+                block = list(islice(fin, block_size))
+    finally:
+        for f in raw_files.values():
+            f.close()
+
+    for name, dtype in COLUMNS:
+        raw_filename = os.path.join(tmp_dir, name + ".raw")
+        column = np.lib.format.open_memmap(os.path.join(tmp_dir, name + ".npy"), mode="w+", dtype=dtype,
+                                           shape=(num_rows,))
+        if num_rows:
+            column[:] = np.memmap(raw_filename, dtype=dtype, mode="r", shape=(num_rows,))
+        column.flush()
+        del column
+        os.remove(raw_filename)
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.rename(tmp_dir, output_dir)
+
+
+def convert_lines(lines):
+    """
+    Converts a non empty list of raw lines.
+
+    Returns:
+       A dict mapping each column name to an array with its values.
+    """
+    _, mandatory = convert_block(lines)
+
+    id_start, id_end = _cds["id"]
+    wban_start, wban_end = _cds["wban"]
+    columns = dict(usaf=np.array([line[id_start:id_end] for line in lines], dtype="S6"),
+                   wban=np.array([line[wban_start:wban_end] for line in lines], dtype="S5"),
+                   time=np.array([get_time(line) for line in lines], dtype="datetime64[m]"))
+
+    rows = [get_fields(line) for line in lines]
+    values = [m[:2] + r[:1] + m[2:] + r[1:] for m, r in zip(mandatory, rows)]
+    for (name, dtype), column in zip(COLUMNS[3:], zip(*values)):
+        columns[name] = to_float(column, dtype)
+    return columns
+
+
+def get_time(line):
+    year, month, day, hour, minute = [line[start:end] for start, end in
+                                      (_cds["year"], _cds["month"], _cds["day"], _cds["hour"], _cds["minute"])]
+    return "{0}-{1}-{2}T{3}:{4}".format(year, month, day, hour, minute)
+
+
+def get_fields(line):
+    """
+    Extracts the numeric fields of the additional data section, formatted as
+    in the ish output, with the max and min values too.
+
+    Returns:
+       A (gus, alt, stp, max, min, pcp01, pcp06, pcp24, pcpxx, sd) tuple.
+    """
+    index = ish.tokenize(line)
+    pcp = ish.Pcp()
+    for name in ish.AA_NAMES:
+        ish.get_aax(line, index, name, pcp)
+    return (ish.get_oc1(line, index) + ish.get_ma1(line, index) + ish.get_extreme_temperatures(line, index) +
+            (pcp.pcp01, pcp.pcp06, pcp.pcp24, pcp.pcp12) + ish.get_aj1(line, index))
+
+
+def to_float(values, dtype):
+    """
+    Converts formatted values to numbers, NaN for missing ones, converting
+    each distinct value only once.
+    """
+    cache = dict()
+    for value in set(values):
+        try:
+            cache[value] = float(value)
+        except ValueError:
+            cache[value] = np.nan
+    return np.array([cache[value] for value in values], dtype=dtype)
+
+
+def load(output_dir, columns=None, mmap_mode="r"):
+    """
+    Opens the column files of a year.
+
+    Args:
+       output_dir (str): directory of the column files.
+       columns (list): names of the columns to open, all if None.
+       mmap_mode (str): see :func:`numpy.load`, None reads the columns into
+          memory.
+
+    Returns:
+       A dict mapping each column name to its array.
+    """
+    names = columns or [name for name, _ in COLUMNS]
+    arrays = dict()
+    for name in names:
+        filename = os.path.join(output_dir, name + ".npy")
+        try:
+            arrays[name] = np.load(filename, mmap_mode=mmap_mode)
+        except ValueError:
+            # empty arrays can't be memory mapped
+            arrays[name] = np.load(filename)
+    return arrays
@@ -0,0 +1,335 @@
+"""
+Parallel compression of the output files.
+
+The data is cut into line aligned blocks of about
+:data:`COMPRESSION_BLOCK_SIZE` bytes, which are compressed independently by a
+pool of threads (zlib and bz2 release the GIL while compressing) and written
+in order as the members of a multi-member gzip or bz2 file, which gzip,
+bzip2, Python and Hadoop read as a single stream.
+
+As every member holds whole lines, the files are splittable: a block index
+sidecar (the file name plus :data:`BLOCK_INDEX_SUFFIX`) records the position
+of each member along with its number of records and its station and time
+ranges, so readers can decompress blocks in parallel and skip the blocks
+outside the stations or dates they look for.
+"""
+import bz2
+import gzip
+import json
+import os
+import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+COMPRESSION_LEVEL = 6                      # 1 (fastest) to 9 (smallest)
+COMPRESSION_BLOCK_SIZE = 16 * 1024 * 1024  # bytes of input compressed by each task
+COMPRESSION_THREADS = None                 # threads compressing blocks (None for one per cpu)
+
+EXTENSIONS = dict(gzip=".gz", bz2=".bz2")
+BLOCK_INDEX_SUFFIX = ".blocks.json"
+
+
+def compress_block(data, compression, level, get_key=None):
+    """
+    Compresses a block into a member.
+
+    Returns:
+       The member, and the information of the block given by
+       :func:`get_block_info` if get_key is not None.
+    """
+    info = None if get_key is None else get_block_info(data, get_key)
+    if compression == "gzip":
+        return gzip.compress(data, compresslevel=level, mtime=0), info
+    else:
+        return bz2.compress(data, compresslevel=level), info
+
+
+def get_block_info(data, get_key):
+    """
+    Finds the number of records of a block and the ranges of their station
+    ids and dates.
+
+    Args:
+       data (bytes): lines of the block.
+       get_key (callable): returns the (station, time) of a line, or None if
+          the line is not a record (e.g. a header).
+    """
+    keys = [key for key in map(get_key, data.splitlines()) if key is not None]
+    if not keys:
+        return dict(records=0, first_station=None, last_station=None, first_time=None, last_time=None)
+    stations, times = zip(*keys)
+    return dict(records=len(keys), first_station=min(stations), last_station=max(stations), first_time=min(times),
+                last_time=max(times))
+
+
+def get_raw_key(line):
+    """
+    Returns the station id ("USAF-WBAN") and the date (YYYYMMDDHHMM) of a raw
+    record.
+    """
+    if len(line) < 27:
+        return None
+    return (line[4:10] + b"-" + line[10:15]).decode(), line[15:27].decode()
+
+
+def get_ish_key(line):
+    """
+    Returns the station id ("USAF-WBAN") and the date (YYYYMMDDHHMM) of an
+    ish row, None for the header.
+    """
+    date = line[13:25]
+    if not date.isdigit():
+        return None
+    wban = line[7:12]
+    return (line[0:6] + b"-" + (b"99999" if wban == b"*****" else wban)).decode(), date.decode()
+
+
+def get_extension(compression):
+    """
+    Returns the extension of the files compressed with compression, "gzip" or
+    "bz2".
+
+    Raises:
+       ValueError if the compression is unknown.
+    """
+    try:
+        return EXTENSIONS[compression]
+    except KeyError:
+        raise ValueError("Unknown compression: {0}".format(compression))
+
+
+class ParallelCompressedWriter(object):
+    """Binary file-like object compressing what is written to it in parallel.
+
+    Blocks end at a line boundary, unless a single line is larger than the
+    block size, so each member of the output holds whole lines.
+    """
+
+    def __init__(self, fileobj, compression="gzip", level=COMPRESSION_LEVEL, block_size=COMPRESSION_BLOCK_SIZE,
+                 threads=COMPRESSION_THREADS, get_key=None):
+        """
+        Args:
+           fileobj: binary file the compressed members are written to.
+           compression (str): "gzip" or "bz2".
+           level (int): compression level, from 1 to 9.
+           block_size (int): approximate bytes of input of each member.
+           threads (int): threads compressing blocks, None for one per cpu.
+           get_key (callable): if given, the blocks are indexed in
+              :attr:`blocks`, see :func:`get_block_info`.
+        """
+        get_extension(compression)
+        self.fileobj = fileobj
+        self.compression = compression
+        self.level = level
+        self.block_size = block_size
+        threads = threads or os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.max_pending = 2 * threads
+        self.pending = deque()
+        self.buffer = list()
+        self.buffered = 0
+        self.num_blocks = 0
+        self.get_key = get_key
+        self.blocks = list()
+        self.offset = 0
+        self.raw_offset = 0
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.block_size:
+            self.submit_block()
+        return len(data)
+
+    def submit_block(self, final=False):
+        data = b"".join(self.buffer)
+        end = len(data) if final else data.rfind(b"\n") + 1
+        if end == 0:
+            end = len(data)  # a line longer than the block size
+        self.buffer = [data[end:]]
+        self.buffered = len(data) - end
+        self.pending.append((end, self.executor.submit(compress_block, data[:end], self.compression, self.level,
+                                                       self.get_key)))
+        self.num_blocks += 1
+        # bound the memory held by blocks being compressed
+        while len(self.pending) > self.max_pending:
+            self.write_block()
+
+    def write_block(self):
+        raw_length, future = self.pending.popleft()
+        member, info = future.result()
+        self.fileobj.write(member)
+        if info is not None:
+            self.blocks.append(dict(info, offset=self.offset, length=len(member), raw_offset=self.raw_offset,
+                                    raw_length=raw_length))
+        self.offset += len(member)
+        self.raw_offset += raw_length
+
+    def close(self):
+        if self.buffered or self.num_blocks == 0:
+            self.submit_block(final=True)
+        while self.pending:
+            self.write_block()
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            for _, future in self.pending:
+                future.cancel()
+            self.executor.shutdown()
+
+
+def compress_file(input_filename, output_filename, compression="gzip", **kwargs):
+    """
+    Compresses a file with a :class:`ParallelCompressedWriter`. The output is
+    written to a temporary file and renamed when complete, or removed if
+    compressing fails. If a get_key keyword argument is given, the block
+    index of the output is also saved. Extra keyword arguments are passed to
+    the writer.
+    """
+    try:
+        with open(input_filename, "rb") as fr, open(output_filename + ".tmp", "wb") as fw, \
+                ParallelCompressedWriter(fw, compression, **kwargs) as writer:
+            shutil.copyfileobj(fr, writer, writer.block_size)
+    except BaseException:
+        remove_temporary(output_filename)
+        raise
+    if writer.get_key is not None:
+        save_block_index(output_filename, compression, writer.blocks)
+    elif os.path.exists(output_filename + BLOCK_INDEX_SUFFIX):
+        os.remove(output_filename + BLOCK_INDEX_SUFFIX)  # it describes a previous file
+    os.replace(output_filename + ".tmp", output_filename)
+
+
+def save_block_index(filename, compression, blocks):
+    index_filename = filename + BLOCK_INDEX_SUFFIX
+    with open(index_filename + ".tmp", "w") as f:
+        json.dump(dict(compression=compression, blocks=blocks), f, sort_keys=True)
+    os.replace(index_filename + ".tmp", index_filename)
+
+
+def load_block_index(filename):
+    """
+    Loads the block index of a compressed file.
+
+    Returns:
+       A dict with the compression and the list of blocks. Each block has
+       the offset and length of its member in the file, the offset and
+       length of its content in the uncompressed file, its number of records,
+       its lowest and highest station ids and its first and last dates
+       (YYYYMMDDHHMM).
+    """
+    with open(filename + BLOCK_INDEX_SUFFIX) as f:
+        return json.load(f)
+
+
+def select_blocks(blocks, stations=None, start=None, end=None):
+    """
+    Selects the blocks that may hold records of some stations within a time
+    range.
+
+    Args:
+       blocks (list): blocks of a block index.
+       stations (iterable): station ids, "USAF-WBAN". All if None.
+       start (str): first date, a prefix of YYYYMMDDHHMM, e.g. "199003".
+       end (str): last date (inclusive), a prefix of YYYYMMDDHHMM.
+
+    Returns:
+       The selected blocks.
+    """
+    stations = None if stations is None else sorted(stations)
+    selected = list()
+    for block in blocks:
+        if not block["records"]:
+            continue
+        if start is not None and block["last_time"][:len(start)] < start:
+            continue
+        if end is not None and block["first_time"][:len(end)] > end:
+            continue
+        if stations is not None and not any(block["first_station"] <= station <= block["last_station"]
+                                            for station in stations):
+            continue
+        selected.append(block)
+    return selected
+
+
+def read_block(filename, block, compression="gzip"):
+    """
+    Reads and decompresses a single block of a compressed file.
+
+    Returns:
+       The uncompressed lines of the block, as bytes.
+    """
+    with open(filename, "rb") as f:
+        f.seek(block["offset"])
+        member = f.read(block["length"])
+    return gzip.decompress(member) if compression == "gzip" else bz2.decompress(member)
+
+
+def find_compressed(filename):
+    """
+    Finds the compressed version of a file whose uncompressed version was
+    removed, e.g. by :func:`pynoaa.data.YearData.compress_outputs`.
+
+    Returns:
+       The name of the compressed file and its compression, or None if
+       there is none.
+    """
+    for compression, extension in sorted(EXTENSIONS.items()):
+        if os.path.exists(filename + extension):
+            return filename + extension, compression
+    return None
+
+
+def read_range(filename, offset, length, compression="gzip"):
+    """
+    Reads a byte range of the uncompressed content of a compressed file.
+    Only the blocks holding the range are decompressed if the file has a
+    block index, otherwise the file is decompressed up to the range.
+
+    Args:
+       filename (str): compressed file.
+       offset (int): offset of the range in the uncompressed content.
+       length (int): length of the range.
+       compression (str): "gzip" or "bz2".
+
+    Returns:
+       The bytes of the range.
+    """
+    if not os.path.exists(filename + BLOCK_INDEX_SUFFIX):
+        module = gzip if compression == "gzip" else bz2
+        with module.open(filename, "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+    blocks = [block for block in load_block_index(filename)["blocks"]
+              if block["raw_offset"] < offset + length and block["raw_offset"] + block["raw_length"] > offset]
+    if not blocks:
+        return b""
+    data = b"".join(read_block(filename, block, compression) for block in blocks)
+    start = offset - blocks[0]["raw_offset"]
+    return data[start:start + length]
+
+
+def decompress_file(input_filename, output_filename, compression="gzip"):
+    """
+    Decompresses a (multi-member) gzip or bz2 file, through a temporary file
+    that is removed if decompressing fails.
+    """
+    module = gzip if compression == "gzip" else bz2
+    try:
+        with module.open(input_filename, "rb") as fr, open(output_filename + ".tmp", "wb") as fw:
+            shutil.copyfileobj(fr, fw, COMPRESSION_BLOCK_SIZE)
+    except BaseException:
+        remove_temporary(output_filename)
+        raise
+    os.replace(output_filename + ".tmp", output_filename)
+
+
+def remove_temporary(filename):
+    if os.path.exists(filename + ".tmp"):
+        os.remove(filename + ".tmp")
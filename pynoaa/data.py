@@ -2,13 +2,26 @@ import os
 import logging
 import threading
 import gzip
+import io
+import json
 import shutil
-import socket
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import date
-from ftplib import FTP
-from ftplib import error_perm, error_reply
+from ftplib import all_errors, error_perm
 
-from .ish import convert
+from .aggregate import aggregate
+from .catalog import get_catalog
+from .compress import COMPRESSION_BLOCK_SIZE, COMPRESSION_LEVEL, compress_file, decompress_file, find_compressed, \
+    get_extension, get_ish_key, get_raw_key
+from .download import PARTIAL_SUFFIX, DownloadError, DownloadManager
+from .index import IndexBuilder, add_segment, build_ish_index, get_segments, get_timestamps, has_index, load_index, \
+    read_station, save_index, station_id
+from .ish import compile_projection, convert, get_engine, get_header
+from .metrics import NULL_METRICS, Metrics, timed
+from .pipeline import Pipeline
+from .records import RecordParser
 
 SERVER_URL = "ftp.ncdc.noaa.gov"
 SERVER_PORT = 21
@@ -20,13 +33,19 @@ BASE_DIR = os.path.dirname(os.path.realpath(__file__))
 LOCAL_DATA = os.path.realpath(os.path.join(BASE_DIR, "data/"))
 LOCAL_DATA_RAW_DIR = os.path.realpath(os.path.join(LOCAL_DATA, "raw/"))
 LOCAL_DATA_DECOMPRESS = os.path.realpath(os.path.join(LOCAL_DATA, "decompress/"))
+LOCAL_DATA_MANIFEST = os.path.realpath(os.path.join(LOCAL_DATA, "manifest/"))
+LOCAL_DATA_CATALOG = os.path.realpath(os.path.join(LOCAL_DATA, "catalog.sqlite"))
 LOCAL_DATA_OUTPUT = os.path.realpath(os.path.join(BASE_DIR, "output/"))
 LOCAL_DATA_OUTPUT_ISH = os.path.realpath(os.path.join(BASE_DIR, "output-ish/"))
+LOCAL_DATA_OUTPUT_COLUMNAR = os.path.realpath(os.path.join(BASE_DIR, "output-columnar/"))
 
 MAX_NUM_JOBS = 4             # number of parallel tasks (this is not the number of concurrent downloads)
 MAX_NUM_FTP_CONNECTIONS = 1  # limited by NOAA server to only 1
 NUM_RETRIES = 3              # retries for trying to retrieve all data from a given year
 FTP_CONN_TIMEOUT = 30        # ftp connection timeout in seconds
+CHUNK_SIZE = 1024 * 1024     # bytes inflated per read when streaming station files
+CONVERT_WORKERS = 1          # processes converting each year to ish (None for one per cpu)
+DECOMPRESS_WORKERS = 4       # threads decompressing the station files of each year (None for one per cpu)
 
 pool_semaphore = threading.BoundedSemaphore(value=MAX_NUM_JOBS)
 ftp_semaphore = threading.BoundedSemaphore(value=MAX_NUM_FTP_CONNECTIONS)
@@ -34,11 +53,13 @@ ftp_semaphore = threading.BoundedSemaphore(value=MAX_NUM_FTP_CONNECTIONS)
 logger = logging.getLogger(__name__)
 formatter = logging.Formatter('%(asctime)s - %(threadName)s - %(levelname)s - %(message)s')
 
-logger.setLevel(logging.DEBUG)
+# the handler is set on the package logger so messages from all modules are shown
+package_logger = logging.getLogger(__package__)
+package_logger.setLevel(logging.DEBUG)
 ch = logging.StreamHandler()
 ch.setLevel(logging.DEBUG)
 ch.setFormatter(formatter)
-logger.addHandler(ch)
+package_logger.addHandler(ch)
 
 
 class YearDataError(Exception):
@@ -53,12 +74,15 @@ class YearData(threading.Thread):
     """Manages al the logic for retrieving, decompressing, formatting and
     merging data of a given year.
 
-    It will create its own thread to connect to the remote ftp server for
-    downloading data and the for performing the necessary operations over
-    that data
+    It will create its own thread for requesting the data to a
+    :class:`pynoaa.download.DownloadManager`, which may be shared by several
+    years, and then for performing the necessary operations over that data
     """
 
-    def __init__(self, year, ish=True, out_dir=None):
+    def __init__(self, year, ish=True, out_dir=None, stream=False, engine="python", workers=CONVERT_WORKERS,
+                 catalog=True, downloader=None, columnar=False, compression=None, block_size=COMPRESSION_BLOCK_SIZE,
+                 level=COMPRESSION_LEVEL, decompress_workers=DECOMPRESS_WORKERS, metrics=None, fields=None,
+                 incremental=False):
         """
         The only argument that the thread needs is the year the user wants
         to retrieve. There is also one optional argument for indicating if
@@ -68,29 +92,88 @@ class YearData(threading.Thread):
            year (int): The year to be processed.
            ish (bool): if True, a ish file will be also generated.
            out_dir (str): string indicating the base output directory
+           stream (bool): if True, downloaded files are inflated straight into
+              the merged (and ish) output instead of being decompressed to disk
+              first. See :func:`stream_merge`.
+           engine (str): ish conversion engine, "python", "numpy" or "bytes". See
+              :func:`pynoaa.ish.get_engine`.
+           workers (int): number of processes used for the ish conversion,
+              None for one per cpu. See :func:`pynoaa.ish.convert`.
+           catalog (bool): if True, the remote listing is read from the local
+              catalog while it is fresh, instead of listing the ftp directory.
+              See :class:`pynoaa.catalog.Catalog`.
+           downloader (DownloadManager): started download manager used for
+              listing and downloading files. If None, the thread starts its
+              own one while it downloads.
+           columnar (bool): if True, a directory of column files that can be
+              memory mapped with numpy will be also generated. See
+              :mod:`pynoaa.columnar`.
+           compression (str): if "gzip" or "bz2", the merged and ish files
+              are compressed once all the outputs are built. See
+              :func:`compress_outputs`.
+           block_size (int): approximate uncompressed bytes of each block of
+              the compressed files, e.g. 128 MB for one block per Hadoop
+              split.
+           level (int): compression level, from 1 (fastest) to 9
+              (smallest).
+           decompress_workers (int): number of threads decompressing the
+              station files, None for one per cpu. See :func:`decompress`.
+           metrics (Metrics): metrics the year counts its work and times its
+              stages in, which may be shared by several years. See
+              :mod:`pynoaa.metrics`.
+           fields (list): if given, the ish file only has these columns. See
+              :func:`pynoaa.ish.compile_projection`.
+           incremental (bool): if True, the merged and ish files of a
+              previous run are updated with the records appended to the
+              station files since then, instead of being built again, e.g.
+              for refreshing the current year. See :func:`update_incremental`.
         """
         super(YearData, self).__init__()
 
         if out_dir is None:
             out = LOCAL_DATA_OUTPUT
             out_ish = LOCAL_DATA_OUTPUT_ISH
+            out_columnar = LOCAL_DATA_OUTPUT_COLUMNAR
         else:
             out = os.path.join(out_dir, "plain_format/")
             out_ish = os.path.join(out_dir, "ish_format/")
+            out_columnar = os.path.join(out_dir, "columnar_format/")
             self.create_directory(out)
             self.create_directory(out_ish)
 
         self.year = year
         self.ish = ish
+        self.columnar = columnar
+        self.compression = compression
+        self.compression_extension = None if compression is None else get_extension(compression)
+        self.block_size = block_size
+        self.level = level
+        self.decompress_workers = decompress_workers
+        self.metrics = metrics or NULL_METRICS
+        self.fields = None if fields is None else list(fields)
+        if self.fields is not None:
+            compile_projection(self.fields)  # fail early on unknown fields
+        self.stream = stream
+        self.incremental = incremental
+        self.ish_updated = False
+        self.engine = engine
+        self.workers = workers
+        self.catalog = None
+        if catalog:
+            self.create_directory(LOCAL_DATA)
+            self.catalog = get_catalog(LOCAL_DATA_CATALOG)
         self.name = "year:{0}".format(year)
         self.raw_data_dir = os.path.join(LOCAL_DATA_RAW_DIR, str(year) + "/")
         self.raw_data_uncompressed_dir = os.path.join(LOCAL_DATA_DECOMPRESS, str(year) + "/")
+        self.manifest_dir = os.path.join(LOCAL_DATA_MANIFEST, str(year) + "/")
         self.output_data_dir = out
         self.output_ish_data_dir = out_ish
+        self.output_columnar_data_dir = out_columnar
         self.remote_year_path = NOAA_BASE_DIR + str(year) + "/"
         self.output_file = None
         self.output_file_ish = None
-        self.ftp = None
+        self.output_dir_columnar = None
+        self.downloader = downloader
         self.remote_files = dict()
         self.remote_files_total_size = 0
         self.remote_files_total_num = 0
@@ -100,128 +183,174 @@ class YearData(threading.Thread):
         self.files = dict()
         self.files_decompressed = list()
         self.files_not_downloaded = list()
+        self.decompress_stats = dict()
+        self.decompress_executor = None
+        self.decompressing = dict()
 
     def run(self):
         """
         This method contains the code that the thread executes. It runs thread-
-        safe for avoiding too many operations running at the same time and also
-        having more that one FTP connection at the same time (limitation os the
-        NOAA server).
+        safe for avoiding too many operations running at the same time. The
+        FTP connections are owned by the download manager (limited by the NOAA
+        server), which only connects when the listing is not in the catalog or
+        there are files to download.
 
-        It calls the methods that connect to the server, download the data and
-        then transform the data to the desired output. There are some mechanism
-        for retrying whenever a download fails or another error occurs.
+        It calls the methods that download the data and then transform the
+        data to the desired output. There are some mechanism for retrying
+        whenever a download fails or another error occurs.
         """
         with pool_semaphore:
+            own_downloader = self.downloader is None
             try:
-                self.connect()
-
-                # create directories
-                self.create_directory(self.raw_data_dir)
-                self.create_directory(self.raw_data_uncompressed_dir)
-                self.create_directory(self.output_data_dir)
-                self.create_directory(self.output_ish_data_dir)
-
-                attempt = 0
-                while True:
-                    self.get_list_pending_files()
-                    if self.is_all_data_downloaded():
-                        logger.info("All files have been downloaded")
-                        break
-                    elif 0 < attempt < NUM_RETRIES:
-                        logger.warning(
-                            "Not all files have been downloaded, retrying missing. Attempt number: {0}".format(attempt))
-                    elif attempt == NUM_RETRIES:
-                        err_text = "Aborting after {0} attempts, {1} files missing".format(attempt,
-                                                                                           self.pending_files_total_num)
-                        logger.error(err_text)
-                        raise YearDataError(err_text)
-                    self.download_files()
-                    attempt += 1
+                if own_downloader:
+                    self.downloader = create_downloader().start()
+                self.fetch()
+                if own_downloader:
                     # finished downloading files, free ftp connection
-                self.disconnect()
-                # decompress files
-                self.decompress()
-                # merge files
-                self.merge()
-                # convert to ish
-                if self.ish:
-                    logger.info("Building ish output")
-                    self.output_file_ish = self.output_ish_data_dir + str(self.year) + "_ish"
-                    convert(self.output_file, self.output_file_ish)
+                    self.downloader.stop()
+                    self.downloader = None
+                if not (self.incremental and self.update_incremental()):
+                    # when streaming, the ish output is built in the same pass unless converted in parallel
+                    self.process(inline_ish=self.workers == 1)
+                    if self.ish:
+                        self.convert_ish()
+                if self.columnar:
+                    self.convert_columnar()
+                if self.compression:
+                    self.compress_outputs()
             except YearDataError as err:
                 logger.error(err)
             finally:
-                if self.ftp is not None:
-                    self.disconnect()
+                if own_downloader and self.downloader is not None:
+                    self.downloader.stop()
+                    self.downloader = None
 
-    def connect(self):
+    @timed("download")
+    def fetch(self):
         """
-        This method performs the remote FTP connection to the NOAA server. In
-        case of failure it will raise an exception and then the thread will end.
+        Creates the local directories and downloads all pending files of the
+        year, retrying up to :data:`NUM_RETRIES` times while some files are
+        missing. The download manager must be set and started. If it fails,
+        the decompressions started meanwhile are stopped (see
+        :func:`stop_decompress`).
 
         Raises:
-           YearDataError: indicates the cause of the ftp connection error.
+           YearDataError if some files could not be downloaded.
         """
+        # create directories
+        self.create_directory(self.raw_data_dir)
+        if not self.stream:
+            # streamed files are inflated straight into the merged output
+            self.create_directory(self.raw_data_uncompressed_dir)
+        self.create_directory(self.manifest_dir)
+        self.create_directory(self.output_data_dir)
+        self.create_directory(self.output_ish_data_dir)
+        if self.columnar:
+            self.create_directory(self.output_columnar_data_dir)
+
+        attempt = 0
         try:
-            ftp_semaphore.acquire(blocking=True)
-            self.ftp = FTP(timeout=None)
-            self.ftp.connect(host=SERVER_URL, port=SERVER_PORT, timeout=FTP_CONN_TIMEOUT)
-            self.ftp.login(user=USER, passwd=PASSWORD, )
-            self.ftp.set_pasv(False)
-            logger.info("Login to FTP successfully")
-        except socket.timeout as err:
-            self.ftp = None
-            ftp_semaphore.release()
-            err_test = "Can't connect to server: {0}".format(err)
-            logger.error(err_test)
-            raise YearDataError(err_test)
-        except error_perm as err:
-            err_test = "Login to FTP failed: {0}".format(err)
-            logger.error(err_test)
-            self.disconnect()
-            raise YearDataError(err_test)
+            while True:
+                if attempt > 0 and self.catalog is not None:
+                    # files are still missing, the cached listing may be outdated
+                    self.catalog.invalidate(self.year)
+                self.get_list_pending_files()
+                if self.is_all_data_downloaded():
+                    logger.info("All files have been downloaded")
+                    break
+                elif 0 < attempt < NUM_RETRIES:
+                    logger.warning(
+                        "Not all files have been downloaded, retrying missing. Attempt number: {0}".format(attempt))
+                    self.metrics.add(self.year, "download_retries")
+                elif attempt == NUM_RETRIES:
+                    err_text = "Aborting after {0} attempts, {1} files missing".format(attempt,
+                                                                                       self.pending_files_total_num)
+                    logger.error(err_text)
+                    raise YearDataError(err_text)
+                self.download_files()
+                attempt += 1
+        except BaseException:
+            self.stop_decompress()
+            raise
 
-    def disconnect(self):
+    def process(self, inline_ish=True):
         """
-        Disconnects from the FTP server. The next thread in the pool is then
-        allowed to start a new connection.
+        Builds the merged file from the downloaded files, either streaming
+        them (see :func:`stream_merge`) or decompressing them to disk first.
+
+        Args:
+           inline_ish (bool): if True and streaming, the ish output is also
+              built while merging.
         """
-        try:
-            self.ftp.quit()
-            logger.info("Disconnected from FTP successfully")
-        except (error_reply, OSError):
-            self.ftp.close()
-        finally:
-            self.ftp = None
-            ftp_semaphore.release()
+        if self.stream:
+            self.stream_merge(inline_ish=inline_ish)
+        else:
+            self.decompress()
+            self.merge()
 
     def get_list_remote_files(self):
         """
         Gets the list of all files in the ftp for the given year. This lists
         contains both the file name and the metadata of each file. This
         method is normally used by :func:`get_list_pending_files` for comparing
-        local and remote list of files.
+        local and remote list of files. A fresh listing in the catalog is used
+        instead of connecting to the server.
         """
-        # change directory
-        self.ftp.sendcmd(cmd="CWD " + self.remote_year_path)
-        # get the list of all remote files
-        remote_list = self.ftp.mlsd(path=self.remote_year_path)
+        remote_list = self.get_catalog_listing()
+        if remote_list is None:
+            # get the list of all remote files
+            remote_list = self.downloader.list_files(self.remote_year_path).result()
+            self.put_catalog_listing(remote_list)
+        else:
+            logger.info("Using remote listing from catalog")
         # clear previous list
         self.remote_files.clear()
         self.remote_files_total_size = 0
         self.remote_files_total_num = 0
-        for filename, metadata in remote_list:
-            if metadata['type'] == 'file':
-                self.remote_files[filename] = metadata
-                self.remote_files_total_size += int(metadata["size"])
-                self.remote_files_total_num += 1
+        for filename, metadata in remote_list.items():
+            self.remote_files[filename] = metadata
+            self.remote_files_total_size += int(metadata["size"])
+            self.remote_files_total_num += 1
+
+    def get_catalog_listing(self):
+        if self.catalog is None:
+            return None
+        try:
+            return self.catalog.get(self.year)
+        except sqlite3.Error as err:
+            logger.warning("Couldn't read catalog: {0}".format(err))
+            return None
+
+    def put_catalog_listing(self, remote_list):
+        if self.catalog is None:
+            return
+        try:
+            self.catalog.put(self.year, remote_list)
+        except sqlite3.Error as err:
+            logger.warning("Couldn't update catalog: {0}".format(err))
+
+    def estimate_size(self):
+        """
+        Estimates the bytes to download for the year from the catalog, even if
+        its listing is stale, used for scheduling the largest years first.
+
+        Returns:
+           The total size of the remote files, or None if unknown.
+        """
+        if self.catalog is None:
+            return None
+        try:
+            return self.catalog.total_size(self.year)
+        except sqlite3.Error as err:
+            logger.warning("Couldn't read catalog: {0}".format(err))
+            return None
 
     def get_list_pending_files(self):
         """
         Get the list of pending files to be downloaded. It checks for each file
         in the ftp if it has already been downloaded and if the local file is
-        not corrupted. If some error occurs a :class:`YearDataError` is raised.
+        not corrupted, and if the remote file has not been modified since it was
+        downloaded. If some error occurs a :class:`YearDataError` is raised.
 
         Raises:
            YearDataError indicates the cause of the error.
@@ -229,7 +358,7 @@ class YearData(threading.Thread):
         # get the list of files from remote server
         try:
             self.get_list_remote_files()
-        except (error_perm, socket.timeout, OSError) as err:
+        except all_errors as err:
             err_text = "Error while getting remote list directory: {0}".format(err)
             logger.error(err_text)
             raise YearDataError(err_text)
@@ -238,16 +367,20 @@ class YearData(threading.Thread):
         self.pending_files_total_num = self.remote_files_total_num
         self.pending_files_total_size = self.remote_files_total_size
 
+        downloaded = self.load_manifest("download") or dict()
+
         # exclude downloaded files and build a list containing only pending files to be downloaded
         try:
             for file in os.listdir(self.raw_data_dir):
                 if file in self.remote_files and int(self.remote_files[file]["size"]) == int(
                         os.stat(self.raw_data_dir + file).st_size):
+                    remote = self.file_manifest({file: self.remote_files[file]})[file]
+                    if downloaded.get(file, remote) != remote:
+                        continue  # modified in the server since it was downloaded
                     self.pending_files_total_size -= int(self.remote_files[file]["size"])
                     self.pending_files_total_num -= 1
                     self.pending_files.pop(file)  # file already downloaded
-                    if file not in self.files.keys():
-                        self.files[file] = self.remote_files[file]
+                    self.files[file] = self.remote_files[file]
         except error_perm as err:
             err_test = "Error while getting list of pending files: {0}".format(err)
             logger.error(err_test)
@@ -257,26 +390,77 @@ class YearData(threading.Thread):
         """
         This method downloads all files that were previously marked ad pending
         by :func:`get_list_pending_files`. If there is any error when the file
-        is being downloaded, it is marked for a later retry.
+        is being downloaded, it is marked for a later retry, which resumes the
+        partial file. The metadata of the downloaded files is saved in the
+        download manifest.
         """
         logger.info("Ready for downloading {0} files, {1} bytes".format(self.pending_files_total_num,
                                                                         self.pending_files_total_size))
-        for file, metadata in self.remote_files.items():
-            new_file = self.raw_data_dir + file
+        try:
+            self.download_pending_files()
+        finally:
+            self.save_manifest("download", self.file_manifest(self.files))
+
+    def download_pending_files(self):
+        futures = dict()
+        for file, metadata in self.pending_files.items():
+            callback = self.metrics.download_callback(self.year, file, int(metadata["size"]))
+            future = self.downloader.retrieve(self.remote_year_path, file, self.raw_data_dir + file, metadata,
+                                              callback=callback)
+            futures[future] = (file, metadata)
+        # files are recorded as they arrive, whatever the order they were requested
+        for future in as_completed(futures):
+            file, metadata = futures[future]
             try:
-                with open(new_file, "wb") as f:
-                    cmd = 'RETR {fname}'.format(fname=file)
-                    self.ftp.retrbinary(cmd, f.write)
+                future.result()
                 self.files[file] = metadata
+                self.metrics.add(self.year, "files_downloaded")
+                self.start_decompress(file)
+            except DownloadError as err:
+                # the file and its partial marker are already removed, so the next attempt downloads it again
+                logger.error("Corrupt download of file {0}: {1}".format(file, err))
+                self.metrics.add(self.year, "download_errors")
             except error_perm as err:
                 logger.error("Error downloading file: {0}".format(err))
                 self.files_not_downloaded.append((file, metadata))
-            except (OSError, socket.timeout) as err:
+                self.metrics.add(self.year, "download_errors")
+            except all_errors as err:
                 logger.warning("Timeout downloading file: {0}".format(err))
-                try:
-                    os.remove(new_file)
-                except OSError as err:
-                    logger.warning("Couldn't delete file {0}: {1}".format(new_file, err))
+                self.metrics.add(self.year, "download_errors")
+
+    def start_decompress(self, file):
+        """
+        Starts decompressing a station file as soon as it is downloaded, in
+        a pool of :attr:`decompress_workers` threads, so the files of a year
+        are decompressed while the rest are still downloading.
+        :func:`decompress` waits for them. Nothing is done when streaming or
+        updating incrementally, as the station files are read straight from
+        the downloaded ones.
+        """
+        if self.stream or self.incremental:
+            return
+        if self.decompress_executor is None:
+            self.decompress_executor = ThreadPoolExecutor(max_workers=self.decompress_workers or os.cpu_count() or 1,
+                                                          thread_name_prefix=self.name + ":decompress")
+        self.decompressing[file] = self.decompress_executor.submit(
+            decompress_station, self.raw_data_dir + file, self.decompressed_filename(file), self.decompress_stats)
+
+    def stop_decompress(self):
+        """
+        Stops the decompression of the station files started while
+        downloading, e.g. when the download fails, waiting for the files
+        already being decompressed. Files not decompressed yet are left for
+        :func:`decompress`.
+        """
+        executor, self.decompress_executor = self.decompress_executor, None
+        if executor is not None:
+            for future in self.decompressing.values():
+                future.cancel()
+            executor.shutdown()
+        self.decompressing = dict()
+
+    def decompressed_filename(self, file):
+        return str(self.raw_data_uncompressed_dir + file).replace(".gz", "")
 
     def is_all_data_downloaded(self):
         """
@@ -293,27 +477,514 @@ class YearData(threading.Thread):
         else:
             return False
 
+    @timed("decompress")
     def decompress(self):
         """
-        Decompresses all downloaded files.
+        Decompresses all downloaded files in a pool of
+        :attr:`decompress_workers` threads, as zlib releases the GIL while
+        inflating. The files already being decompressed since they were
+        downloaded (see :func:`start_decompress`) are waited for, and files
+        that have not changed since the last run, according to the decompress
+        manifest, are not decompressed again. The list of decompressed files
+        keeps the sorted order needed by :func:`merge`, and the throughput of
+        each thread is kept in :attr:`decompress_stats`.
         """
+        inputs = self.file_manifest(self.files)
+        decompressed = self.load_manifest("decompress") or dict()
+        self.files_decompressed = list()
+        pending = list()
         logger.info("Decompressing files")
-        for file, _ in self.files.items():
-            new_filename = str(self.raw_data_uncompressed_dir + file).replace(".gz", "")
-            with gzip.open(self.raw_data_dir + file, 'rb') as fr, open(new_filename, 'wb') as fw:
-                fw.write(fr.read())
+        for file in sorted(self.files):
+            new_filename = self.decompressed_filename(file)
+            if file not in self.decompressing and (decompressed.get(file) != inputs[file] or
+                                                   not os.path.exists(new_filename)):
+                pending.append((self.raw_data_dir + file, new_filename))
             self.files_decompressed.append(new_filename)
+        early = len(self.decompressing)
+        executor, self.decompress_executor = self.decompress_executor, None
+        if pending and executor is None:
+            executor = ThreadPoolExecutor(max_workers=self.decompress_workers or os.cpu_count() or 1,
+                                          thread_name_prefix=self.name + ":decompress")
+        if executor is not None:
+            with executor:
+                futures = list(self.decompressing.values())
+                futures.extend(executor.submit(decompress_station, filename, new_filename, self.decompress_stats)
+                               for filename, new_filename in pending)
+                self.decompressing = dict()
+                # consuming the results raises the first error, if any
+                for future in futures:
+                    future.result()
+        for worker, stats in sorted(self.decompress_stats.items()):
+            logger.info("{0}: {1} files, {2:.1f} MB read, {3:.1f} MB written, {4:.1f} MB/s".format(
+                worker, stats["files"], stats["bytes_in"] / 1e6, stats["bytes_out"] / 1e6,
+                stats["bytes_out"] / 1e6 / max(stats["seconds"], 1e-9)))
+        logger.info("Decompressed {0} files ({1} while downloading), {2} unchanged".format(
+            len(pending) + early, early, len(inputs) - len(pending) - early))
+        self.metrics.add(self.year, "files_decompressed", len(pending) + early)
+        self.metrics.add(self.year, "bytes_decompressed", sum(stats["bytes_out"]
+                                                              for stats in self.decompress_stats.values()))
+        self.save_manifest("decompress", inputs)
 
+    @timed("merge")
     def merge(self):
         """
-        Merges into one file all decompressed files.
+        Merges into one file all decompressed files, writing the index of the
+        stations in the merged file (see :mod:`pynoaa.index`). Nothing is done
+        if the inputs have not changed since the last merge.
         """
-        logger.info("Merging decompressed files")
         self.output_file = self.output_data_dir + str(self.year)
+        if self.is_stage_current("merge", self.output_file) and has_index(self.output_file):
+            logger.info("Merged file is up to date")
+            return
+        logger.info("Merging decompressed files")
+        self.remove_manifest("merge")
+        index = IndexBuilder()
         with open(self.output_file, 'wb') as fw:
             for file in self.files_decompressed:
+                index.start(file)
                 with open(file, 'rb') as fr:
-                    shutil.copyfileobj(fr, fw)
+                    chunk = fr.read(CHUNK_SIZE)
+                    while chunk:
+                        fw.write(chunk)
+                        index.update(chunk)
+                        chunk = fr.read(CHUNK_SIZE)
+        index.save(self.output_file)
+        self.save_manifest("merge", self.file_manifest(self.files))
+        self.metrics.add(self.year, "bytes_merged", index.offset)
+
+    @timed("merge")
+    def stream_merge(self, inline_ish=True):
+        """
+        Inflates all downloaded files straight into the merged output, reading
+        at most :data:`CHUNK_SIZE` bytes at a time, so no decompressed copy is
+        written to disk and memory use does not depend on the file sizes. When
+        an ish file is requested and inline_ish is True, the same chunks are
+        also fed to the ish converter. Otherwise the merged file must be
+        converted afterwards with :func:`convert_ish`, e.g. in parallel
+        processes.
+        """
+        self.output_file = self.output_data_dir + str(self.year)
+        self.output_file_ish = self.output_ish_data_dir + str(self.year) + "_ish"
+        if self.is_stage_current("merge", self.output_file) and has_index(self.output_file):
+            logger.info("Merged file is up to date")
+            return
+
+        logger.info("Streaming decompressed files into merged output")
+        inline_ish = self.ish and inline_ish
+        self.remove_manifest("merge")
+        self.remove_manifest("ish")
+        index = IndexBuilder()
+        with open(self.output_file, 'wb') as fw:
+            chunks = tee_chunks(self.iter_decompressed_chunks(index), fw)
+            if inline_ish:
+                logger.info("Building ish output")
+                with open(self.output_file_ish, 'w') as fout:
+                    fout.write(get_header(self.fields))
+                    engine_convert_lines = get_engine(self.engine) if self.fields is None else \
+                        compile_projection(self.fields)
+                    engine_convert_lines(iter_lines(chunks), fout)
+            else:
+                for _ in chunks:
+                    pass
+        index.save(self.output_file)
+        self.save_manifest("merge", self.file_manifest(self.files))
+        self.metrics.add(self.year, "bytes_merged", index.offset)
+        if inline_ish:
+            build_ish_index(self.output_file_ish, index.stations)
+            self.save_manifest("ish", self.ish_manifest())
+            self.metrics.add(self.year, "lines_ish", count_records(index.stations))
+
+    @timed("ish")
+    def convert_ish(self, executor=None):
+        """
+        Converts the merged file into the ish format. Nothing is done if the
+        inputs have not changed since the last conversion.
+
+        Args:
+           executor (ProcessPoolExecutor): process pool for converting the
+              file in parallel, which may be shared by several years. See
+              :func:`pynoaa.ish.convert_parallel`.
+        """
+        self.output_file_ish = self.output_ish_data_dir + str(self.year) + "_ish"
+        if self.is_stage_current("ish", self.output_file_ish, self.ish_manifest()) and \
+                has_index(self.output_file_ish):
+            logger.info("Ish file is up to date")
+            return
+        logger.info("Building ish output")
+        self.remove_manifest("ish")
+        self.restore_merged()
+        convert(self.output_file, self.output_file_ish, engine=self.engine, workers=self.workers, executor=executor,
+                fields=self.fields)
+        index = load_index(self.output_file)
+        build_ish_index(self.output_file_ish, index)
+        self.save_manifest("ish", self.ish_manifest())
+        self.metrics.add(self.year, "lines_ish", count_records(index))
+
+    @timed("columnar")
+    def convert_columnar(self, executor=None):
+        """
+        Converts the merged file into column files. Nothing is done if the
+        inputs have not changed since the last conversion.
+
+        Args:
+           executor (ProcessPoolExecutor): process pool running the
+              conversion, which may be shared by several years. If None, it
+              runs in this thread.
+        """
+        from .columnar import convert as convert_columnar
+
+        self.output_dir_columnar = self.output_columnar_data_dir + str(self.year)
+        if self.is_stage_current("columnar", self.output_dir_columnar):
+            logger.info("Columnar files are up to date")
+            return
+        logger.info("Building columnar output")
+        self.remove_manifest("columnar")
+        self.restore_merged()
+        if executor is None:
+            convert_columnar(self.output_file, self.output_dir_columnar)
+        else:
+            executor.submit(convert_columnar, self.output_file, self.output_dir_columnar).result()
+        self.save_manifest("columnar", self.file_manifest(self.files))
+        self.metrics.add(self.year, "lines_columnar", count_records(load_index(self.output_file)))
+
+    @timed("compress")
+    def compress_outputs(self):
+        """
+        Compresses the merged and ish files, which are then removed, in
+        independent line aligned blocks (see :mod:`pynoaa.compress`), writing
+        the block index of each compressed file (of the ish file, only if its
+        rows start with the station and date). Their station index sidecars
+        are kept and still describe the uncompressed content, which
+        :func:`get_station` and :func:`aggregate_interval` read through the
+        block index.
+        """
+        self.output_file = self.output_data_dir + str(self.year)
+        self.output_file_ish = self.output_ish_data_dir + str(self.year) + "_ish"
+        # ish rows without the station and date first can't be indexed by block
+        ish_key = get_ish_key if self.fields is None or self.fields[:3] == ["usaf", "wban", "date"] else None
+        for file, get_key in ((self.output_file, get_raw_key), (self.output_file_ish, ish_key)):
+            if os.path.exists(file):
+                logger.info("Compressing {0}".format(file))
+                self.metrics.add(self.year, "bytes_compressed", os.path.getsize(file))
+                compress_file(file, file + self.compression_extension, self.compression, level=self.level,
+                              block_size=self.block_size, get_key=get_key)
+                os.remove(file)
+
+    @timed("incremental")
+    def update_incremental(self):
+        """
+        Updates the merged and ish files of a previous run with the station
+        files downloaded since then, without merging and converting the whole
+        year again. Each changed station file is inflated and compared, a
+        chunk at a time, with the records of the station already merged.
+
+        When every changed file only has new records after them, just those
+        records are appended at the end of the merged file and their rows at
+        the end of the ish file, as new segments of their stations in the
+        indexes (see :func:`pynoaa.index.get_segments`), and new stations
+        are appended in the same way, so a refresh costs the new records
+        only. Otherwise (e.g. a corrected or removed station file) the
+        outputs are rewritten through temporary files, copying the records
+        and rows kept and converting the rest.
+
+        Returns:
+           True if the outputs are up to date (and then
+           :attr:`ish_updated` is set if there is an ish output), False if
+           they must be built from scratch, e.g. because there are no
+           previous uncompressed outputs or they have other fields.
+        """
+        self.output_file = self.output_data_dir + str(self.year)
+        self.output_file_ish = self.output_ish_data_dir + str(self.year) + "_ish"
+        previous = self.load_manifest("merge")
+        index = load_index(self.output_file)
+        if previous is None or index is None or not os.path.exists(self.output_file):
+            logger.info("No previous merged file to update")
+            return False
+        ish_index = None
+        if self.ish:
+            ish_index = load_index(self.output_file_ish)
+            if ish_index is None or not os.path.exists(self.output_file_ish) or \
+                    self.load_manifest("ish") != self.ish_manifest(previous):
+                logger.info("No previous ish file to update")
+                return False
+        current = self.file_manifest(self.files)
+        if previous == current:
+            logger.info("Merged file is up to date")
+            self.ish_updated = self.ish
+            return True
+
+        self.remove_manifest("merge")
+        self.remove_manifest("ish")
+        changed = [file for file in sorted(self.files) if previous.get(file) != current[file]]
+        updated = None
+        if all(file in self.files for file in previous):
+            logger.info("Appending new records to merged output")
+            updated = self.append_in_place(changed, index, ish_index)
+        if updated is None:
+            logger.info("Rewriting merged output with new records")
+            updated = self.rewrite_outputs(previous, current, index, ish_index)
+        self.save_manifest("merge", current)
+        if self.ish:
+            self.save_manifest("ish", self.ish_manifest())
+        self.metrics.add(self.year, "stations_appended", updated)
+        logger.info("Updated {0} stations".format(updated))
+        self.ish_updated = self.ish
+        return True
+
+    def append_in_place(self, changed, index, ish_index):
+        """
+        Appends the new records of the changed station files at the end of
+        the merged and ish files, see :func:`update_incremental`.
+
+        Returns:
+           The number of stations updated, or None if a station file changed
+           its previous records, in which case the outputs are left as they
+           were.
+        """
+        merged_size = os.path.getsize(self.output_file)
+        with open(self.output_file, "r+b") as fw:
+            if self.ish:
+                ish_size = os.path.getsize(self.output_file_ish)
+                with open(self.output_file_ish, "r+b") as fw_ish:
+                    updates = self.append_stations(changed, index, ish_index, fw, fw_ish)
+                    if updates is None:
+                        fw_ish.truncate(ish_size)
+            else:
+                updates = self.append_stations(changed, index, None, fw, None)
+            if updates is None:
+                fw.truncate(merged_size)
+                return None
+        merged_updates, ish_updates = updates
+        index.update(merged_updates)
+        save_index(self.output_file, index)
+        if self.ish:
+            ish_index.update(ish_updates)
+            save_index(self.output_file_ish, ish_index)
+        self.metrics.add(self.year, "bytes_merged", os.path.getsize(self.output_file) - merged_size)
+        return len(merged_updates)
+
+    def append_stations(self, changed, index, ish_index, fw, fw_ish):
+        """
+        Appends the new records of the changed station files to the merged
+        file fw and their rows to the ish file fw_ish (None if there is no ish
+        output), both open for reading and writing.
+
+        Returns:
+           The new index entries of the updated stations in the merged and
+           ish files, or None if a station file changed its previous records.
+        """
+        convert_lines = self.get_convert_lines()
+        merged_updates = dict()
+        ish_updates = dict()
+        for file in changed:
+            station = station_id(file)
+            entry = index.get(station)
+            kept, chunks = read_appended(self.raw_data_dir + file, fw,
+                                         list() if entry is None else get_segments(entry))
+            if kept is None:
+                chunks.close()
+                logger.info("Station file {0} changed its previous records".format(file))
+                return None
+            offset = fw.seek(0, os.SEEK_END)
+            ish_offset = None if fw_ish is None else fw_ish.seek(0, os.SEEK_END)
+            builder = IndexBuilder()
+            builder.offset = offset
+            builder.start(file)
+            write_records(chunks, fw, builder, fw_ish, convert_lines)
+            builder.finish_station()
+            segment = builder.stations[station]
+            if not segment["length"]:
+                continue
+            first, last = get_timestamps(fw, offset, segment["length"])
+            if entry is None:
+                merged_updates[station] = dict(segment, first=first, last=last)
+            else:
+                merged_updates[station] = add_segment(entry, segment, first, last)
+            if fw_ish is None:
+                continue
+            ish_segment = dict(segment, offset=ish_offset, length=fw_ish.tell() - ish_offset)
+            if entry is None:
+                ish_updates[station] = dict(ish_segment, first=first, last=last)
+            else:
+                ish_updates[station] = add_segment(ish_index[station], ish_segment, first, last)
+        return merged_updates, ish_updates
+
+    def rewrite_outputs(self, previous, current, index, ish_index):
+        """
+        Rewrites the merged and ish files with the records of the downloaded
+        station files, copying the records and rows of the previous outputs
+        that are kept, see :func:`update_incremental`. The records of each
+        station are contiguous again in the new outputs.
+
+        Returns:
+           The number of stations updated.
+        """
+        merged_index = IndexBuilder()
+        ish_offsets = dict()
+        with open(self.output_file, "rb") as fr, open(self.output_file + ".tmp", "wb") as fw:
+            if self.ish:
+                with open(self.output_file_ish, "rb") as fr_ish, open(self.output_file_ish + ".tmp", "wb") as fw_ish:
+                    fw_ish.write(get_header(self.fields).encode())
+                    updated = self.rewrite_stations(previous, current, index, ish_index, fr, fw, merged_index,
+                                                    (fr_ish, fw_ish), ish_offsets)
+            else:
+                updated = self.rewrite_stations(previous, current, index, None, fr, fw, merged_index, None, None)
+        os.replace(self.output_file + ".tmp", self.output_file)
+        merged_index.save(self.output_file)
+        self.metrics.add(self.year, "bytes_merged", merged_index.offset)
+        if self.ish:
+            os.replace(self.output_file_ish + ".tmp", self.output_file_ish)
+            save_index(self.output_file_ish, dict((station, dict(entry, offset=ish_offsets[station][0],
+                                                                 length=ish_offsets[station][1]))
+                                                  for station, entry in merged_index.stations.items()))
+        return updated
+
+    def rewrite_stations(self, previous, current, index, ish_index, fr, fw, merged_index, ish_files, ish_offsets):
+        """
+        Writes the records of every station to fw, and their rows to the
+        second file of ish_files (None if there is no ish output), copying
+        the ones kept from fr and the first of ish_files.
+
+        Returns:
+           The number of stations updated.
+        """
+        convert_lines = self.get_convert_lines()
+        fr_ish, fw_ish = ish_files or (None, None)
+        updated = 0
+        for file in sorted(self.files):
+            station = station_id(file)
+            entry = index.get(station)
+            segments = list() if entry is None else get_segments(entry)
+            merged_index.start(file)
+            ish_offset = None if fw_ish is None else fw_ish.tell()
+            if previous.get(file) == current[file] and entry is not None:
+                kept, chunks = entry["length"], iter(())
+            else:
+                kept, chunks = read_appended(self.raw_data_dir + file, fr, segments)
+                updated += 1
+            if kept is not None:
+                for offset, length, _ in segments:
+                    for chunk in copy_range(fr, fw, offset, length):
+                        merged_index.update(chunk)
+                if fw_ish is not None and entry is not None:
+                    for offset, length, _ in get_segments(ish_index[station]):
+                        for _ in copy_range(fr_ish, fw_ish, offset, length):
+                            pass
+            write_records(chunks, fw, merged_index, fw_ish, convert_lines)
+            if fw_ish is not None:
+                ish_offsets[station] = (ish_offset, fw_ish.tell() - ish_offset)
+        return updated
+
+    def get_convert_lines(self):
+        """
+        Returns the function converting lines into the rows of the ish
+        output, see :func:`pynoaa.ish.get_engine`.
+        """
+        return get_engine(self.engine) if self.fields is None else compile_projection(self.fields)
+
+    def restore_merged(self):
+        """
+        Decompresses the merged file when only its compressed version is
+        left, as it is needed for building the other outputs.
+        """
+        compressed = self.output_file + (self.compression_extension or "")
+        if self.compression and not os.path.exists(self.output_file) and os.path.exists(compressed):
+            logger.info("Decompressing merged file")
+            decompress_file(compressed, self.output_file, self.compression)
+
+    def output_exists(self, output):
+        """
+        Checks if the output of a stage exists, either as is or compressed.
+        """
+        return os.path.exists(output) or (self.compression is not None and
+                                          os.path.exists(output + self.compression_extension))
+
+    def iter_decompressed_chunks(self, index=None):
+        """
+        Yields the decompressed content of all downloaded files, in the same
+        order used by :func:`merge`, as chunks of at most :data:`CHUNK_SIZE`
+        bytes.
+
+        Args:
+           index (IndexBuilder): if given, it is updated with the station
+              files and the chunks, see :mod:`pynoaa.index`.
+        """
+        for file in sorted(self.files):
+            if index is not None:
+                index.start(file)
+            with gzip.open(self.raw_data_dir + file, 'rb') as fr:
+                chunk = fr.read(CHUNK_SIZE)
+                while chunk:
+                    if index is not None:
+                        index.update(chunk)
+                    yield chunk
+                    chunk = fr.read(CHUNK_SIZE)
+
+    @staticmethod
+    def file_manifest(files):
+        """
+        Builds the manifest of a dict of files and their MLSD metadata.
+
+        Returns:
+           A dict mapping each file name to a [size, modify] list.
+        """
+        return dict((file, [int(metadata["size"]), metadata.get("modify")]) for file, metadata in files.items())
+
+    def load_manifest(self, stage):
+        """
+        Loads the manifest saved by a stage in a previous run.
+
+        Returns:
+           The manifest, or None if there is no valid manifest.
+        """
+        try:
+            with open(os.path.join(self.manifest_dir, stage + ".json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save_manifest(self, stage, manifest):
+        """
+        Saves the manifest of the inputs processed by a stage.
+        """
+        filename = os.path.join(self.manifest_dir, stage + ".json")
+        with open(filename + ".tmp", "w") as f:
+            json.dump(manifest, f, sort_keys=True)
+        os.replace(filename + ".tmp", filename)
+
+    def remove_manifest(self, stage):
+        """
+        Removes the manifest of a stage before its output is rewritten, so an
+        interrupted run is never taken as up to date.
+        """
+        try:
+            os.remove(os.path.join(self.manifest_dir, stage + ".json"))
+        except FileNotFoundError:
+            pass
+
+    def is_stage_current(self, stage, output, manifest=None):
+        """
+        Checks if a stage can be skipped: its output exists and its manifest
+        matches the current downloaded files, or the given manifest.
+        """
+        if manifest is None:
+            manifest = self.file_manifest(self.files)
+        return self.output_exists(output) and self.load_manifest(stage) == manifest
+
+    def ish_manifest(self, files=None):
+        """
+        Builds the manifest of the ish stage, which also depends on the
+        fields of the output, if only some of them are written.
+
+        Args:
+           files (dict): manifest of the input files, the one of the
+              downloaded files if None.
+        """
+        if files is None:
+            files = self.file_manifest(self.files)
+        if self.fields is None:
+            return files
+        return dict(files=files, fields=self.fields)
 
     @staticmethod
     def create_directory(directory):
@@ -331,38 +1002,344 @@ class YearData(threading.Thread):
         pass
 
 
-def get_all(out_dir=None):
+def create_downloader():
+    """
+    Creates a download manager for the NOAA server, with as many sessions as
+    allowed connections.
+    """
+    return DownloadManager(SERVER_URL, SERVER_PORT, USER, PASSWORD, num_connections=MAX_NUM_FTP_CONNECTIONS,
+                           timeout=FTP_CONN_TIMEOUT, semaphore=ftp_semaphore)
+
+
+def decompress_station(filename, new_filename, stats=None):
+    """
+    Decompresses a station file, through a temporary file renamed when
+    complete.
+
+    Args:
+       filename (str): gzip station file.
+       new_filename (str): decompressed file.
+       stats (dict): if given, the files, bytes read and written and seconds
+          spent are added to the counters of the current thread in it.
+    """
+    start = time.perf_counter()
+    with gzip.open(filename, 'rb') as fr, open(new_filename + ".tmp", 'wb') as fw:
+        shutil.copyfileobj(fr, fw, CHUNK_SIZE)
+        bytes_out = fw.tell()
+    os.replace(new_filename + ".tmp", new_filename)
+    if stats is not None:
+        worker = stats.setdefault(threading.current_thread().name,
+                                  dict(files=0, bytes_in=0, bytes_out=0, seconds=0.0))
+        worker["files"] += 1
+        worker["bytes_in"] += os.path.getsize(filename)
+        worker["bytes_out"] += bytes_out
+        worker["seconds"] += time.perf_counter() - start
+
+
+def read_appended(filename, fr, segments):
+    """
+    Inflates a station file, checking a chunk at a time if it starts with
+    the records of the station already in the merged file.
+
+    Args:
+       filename (str): gzip station file.
+       fr: merged file, open for reading in binary mode.
+       segments (list): segments of the station in the merged file, see
+          :func:`pynoaa.index.get_segments`. Empty for a new station.
+
+    Returns:
+       The number of bytes of the station that are still in the merged file
+       (or None if its previous records changed), and an iterator of chunks
+       of at most :data:`CHUNK_SIZE` bytes with the rest of the station file
+       (the whole file if its previous records changed).
+    """
+    fz = gzip.open(filename, "rb")
+    try:
+        kept = 0
+        last_byte = b"\n"
+        for offset, length, _ in segments:
+            fr.seek(offset)
+            while length > 0:
+                previous = fr.read(min(length, CHUNK_SIZE))
+                if not previous or fz.read(len(previous)) != previous:
+                    kept = None
+                    break
+                length -= len(previous)
+                kept += len(previous)
+                last_byte = previous[-1:]
+            if kept is None:
+                break
+        if kept is not None and last_byte != b"\n":
+            kept = None  # the last record may have been completed
+        if kept is None:
+            fz.close()
+            fz = gzip.open(filename, "rb")
+    except BaseException:
+        fz.close()
+        raise
+    return kept, iter_file_chunks(fz)
+
+
+def iter_file_chunks(f):
+    """
+    Yields the rest of a file in chunks of at most :data:`CHUNK_SIZE` bytes,
+    and closes it.
+    """
+    with f:
+        chunk = f.read(CHUNK_SIZE)
+        while chunk:
+            yield chunk
+            chunk = f.read(CHUNK_SIZE)
+
+
+def write_records(chunks, fw, index, fw_ish=None, convert_lines=None):
+    """
+    Writes chunks of raw records to fw, accounting for them in the station
+    being built by index (an :class:`pynoaa.index.IndexBuilder`), and their
+    rows, converted with convert_lines, to the binary file fw_ish if given.
+    """
+    chunks = tee_chunks(index_chunks(chunks, index), fw)
+    if fw_ish is None:
+        for _ in chunks:
+            pass
+    else:
+        for rows in iter_converted(chunks, convert_lines):
+            fw_ish.write(rows)
+
+
+def index_chunks(chunks, index):
+    for chunk in chunks:
+        index.update(chunk)
+        yield chunk
+
+
+def copy_range(fr, fw, offset, length):
+    """
+    Copies length bytes of fr from offset to fw, yielding the chunks of at
+    most :data:`CHUNK_SIZE` bytes as they are written.
+    """
+    fr.seek(offset)
+    while length > 0:
+        chunk = fr.read(min(length, CHUNK_SIZE))
+        if not chunk:
+            break
+        fw.write(chunk)
+        length -= len(chunk)
+        yield chunk
+
+
+def count_records(index):
+    """
+    Returns the number of records of a file, given its station index.
+    """
+    return sum(entry["records"] for entry in (index or dict()).values())
+
+
+def tee_chunks(chunks, fw):
+    """
+    Writes every chunk to fw before passing it on.
+    """
+    for chunk in chunks:
+        fw.write(chunk)
+        yield chunk
+
+
+def iter_converted(chunks, convert_lines):
+    """
+    Converts a stream of byte chunks of raw lines into ish rows, yielding the
+    rows of the complete lines of each chunk as bytes, so memory use stays
+    bounded by the chunk size.
+    """
+    tail = b''
+    for chunk in chunks:
+        data = tail + chunk
+        end = data.rfind(b'\n') + 1
+        tail = data[end:]
+        if end:
+            yield convert_chunk(data[:end], convert_lines)
+    if tail:
+        yield convert_chunk(tail, convert_lines)
+
+
+def convert_chunk(data, convert_lines):
+    rows = io.StringIO()
+    convert_lines(iter_lines([data]), rows)
+    return rows.getvalue().encode()
+
+
+def iter_lines(chunks):
+    """
+    Splits a stream of byte chunks into decoded lines. Only the incomplete
+    last line of a chunk is kept between chunks.
+    """
+    tail = b''
+    for chunk in chunks:
+        data = tail + chunk
+        end = data.rfind(b'\n') + 1
+        tail = data[end:]
+        if end:
+            yield from io.StringIO(data[:end].decode())
+    if tail:
+        yield tail.decode()
+
+
+def get_all(out_dir=None, **kwargs):
     """
     This function tries to retrieve and process all data from FTP server. It
     calls :func:`get_interval` starting from 1901 (first year with data) and
     finishing in the current year.
     """
-    get_interval(1901, date.today().year, out_dir)
+    get_interval(1901, date.today().year, out_dir, **kwargs)
 
 
-def get_interval(from_year, to_year, out_dir=None):
+def get_interval(from_year, to_year, out_dir=None, report=None, progress=None, pipeline=None, **kwargs):
     """
     Retrieves data from two years (both years inclusive). Range must be valid,
-    starting from 1901.
+    starting from 1901. The years are processed by a
+    :class:`pynoaa.pipeline.Pipeline`. Extra keyword arguments are passed to
+    :class:`YearData`.
+
+    Args:
+       from_year (int): first year.
+       to_year (int): last year.
+       out_dir (str): base output directory.
+       report (str): if given, the metrics of the run are saved to this JSON
+          file at the end, see :func:`pynoaa.metrics.Metrics.report`.
+       progress (callable): called with the progress events of the run, see
+          :class:`pynoaa.metrics.Metrics`.
+       pipeline (Pipeline): pipeline scheduling the years, e.g. for showing
+          their status or cancelling them from another thread. A new one is
+          used if None.
     """
     if to_year < from_year or from_year < 1901 or to_year > date.today().year + 1:
         logger.error("Bad year interval, only valid: ({0}, {1})".format(1901, date.today().year))
         exit(1)
 
-    jobs = list()
-    for i in range(from_year, to_year + 1):
-        y = YearData(i, ish=True, out_dir=out_dir)
-        y.start()
-        jobs.append(y)
+    # a single download manager serves all years, so the allowed connections are never idle between years,
+    # and the years go through a pipeline, so later years are downloaded while earlier ones are converted
+    metrics = create_metrics(report, progress, kwargs)
+    with create_downloader() as downloader:
+        years = [YearData(i, ish=True, out_dir=out_dir, downloader=downloader, metrics=metrics, **kwargs)
+                 for i in range(from_year, to_year + 1)]
+        (pipeline or Pipeline()).run(years)
+    save_report(metrics, report)
 
-    for j in jobs:
-        j.join()
 
+def get_station(year, station, out_dir=None, ish=False):
+    """
+    Reads the records of a station from the output of a year already
+    retrieved, seeking straight to them with the index of the output.
+
+    Args:
+       year (int): the year.
+       station (str): station id, "USAF-WBAN", e.g. "010010-99999".
+       out_dir (str): base output directory used when retrieving the year.
+       ish (bool): if True, the rows of the ish output are read instead of
+          the raw records.
 
-def get_year(year, out_dir=None):
+    Returns:
+       A list with the lines of the station, empty if it is not in the year.
     """
-    Retrieves a single year data.
+    return read_station(get_output_filename(year, out_dir, ish), station)
+
+
+def aggregate_interval(from_year, to_year, fields, group_by=("station", "day"), out_dir=None, **kwargs):
+    """
+    Aggregates fields of the merged files of the years already retrieved in
+    an interval (both years inclusive), e.g. the maximum temperature of each
+    year with ``aggregate_interval(1901, 1950, ["temp"], group_by=["year"])``.
+    Compressed merged files are read if the uncompressed ones were removed,
+    and years without a merged file are skipped. Extra keyword arguments are
+    passed to :func:`pynoaa.aggregate.aggregate`, see it for the result.
+    """
+    filenames = list()
+    for year in range(from_year, to_year + 1):
+        filename = get_output_filename(year, out_dir)
+        compressed = None if os.path.exists(filename) else find_compressed(filename)
+        if compressed is not None:
+            filename = compressed[0]
+        elif not os.path.exists(filename):
+            logger.warning("Skipping missing merged file {0}".format(filename))
+            continue
+        filenames.append(filename)
+    return aggregate(filenames, fields, group_by, **kwargs)
+
+
+def get_output_filename(year, out_dir=None, ish=False):
+    """
+    Returns the path of the merged (or ish) file of a year, the same used by
+    :class:`YearData`.
+    """
+    if out_dir is None:
+        filename = (LOCAL_DATA_OUTPUT_ISH if ish else LOCAL_DATA_OUTPUT) + str(year)
+    else:
+        filename = os.path.join(out_dir, "ish_format/" if ish else "plain_format/") + str(year)
+    return filename + "_ish" if ish else filename
+
+
+def iter_records(year, stations=None, fields=None):
+    """
+    Iterates over the records of a year straight from the downloaded station
+    files, without decompressing them to disk nor merging them, one station
+    file at a time, so memory use stays constant. The files must have been
+    downloaded before, e.g. with :func:`get_year`.
+
+    Args:
+       year (int): the year.
+       stations (iterable): station ids, "USAF-WBAN", to read. All if None.
+       fields (list): names of the fields of each record, see
+          :data:`pynoaa.records.FIELD_NAMES`. All if None.
+
+    Returns:
+       An iterator of dicts, one for each record, see
+       :class:`pynoaa.records.RecordParser`.
+
+    Raises:
+       ValueError if a field is unknown.
     """
-    y = YearData(year, ish=True, out_dir=out_dir)
+    parser = RecordParser(fields)
+    raw_data_dir = os.path.join(LOCAL_DATA_RAW_DIR, str(year))
+    return iter_raw_records(raw_data_dir, None if stations is None else set(stations), parser)
+
+
+def iter_raw_records(raw_data_dir, stations, parser):
+    for file in sorted(os.listdir(raw_data_dir)):
+        if not file.endswith(".gz") or os.path.exists(os.path.join(raw_data_dir, file + PARTIAL_SUFFIX)):
+            continue  # not a station file, or not completely downloaded
+        if stations is not None and station_id(file) not in stations:
+            continue
+        with gzip.open(os.path.join(raw_data_dir, file), 'rt') as fr:
+            for line in fr:
+                yield parser.parse(line)
+
+
+def get_year(year, out_dir=None, report=None, progress=None, **kwargs):
+    """
+    Retrieves a single year data. The report and progress arguments are the
+    ones of :func:`get_interval`. Extra keyword arguments are passed to
+    :class:`YearData`.
+    """
+    metrics = create_metrics(report, progress, kwargs)
+    y = YearData(year, ish=True, out_dir=out_dir, metrics=metrics, **kwargs)
     y.start()
     y.join()
+    save_report(metrics, report)
+
+
+def create_metrics(report, progress, kwargs):
+    """
+    Returns the metrics given in kwargs (which are removed from it), new
+    metrics if a report or progress events are requested, or None.
+    """
+    metrics = kwargs.pop("metrics", None)
+    if metrics is None and (report is not None or progress is not None):
+        metrics = Metrics()
+    if progress is not None:
+        metrics.callbacks.append(progress)
+    return metrics
+
+
+def save_report(metrics, report):
+    if report is not None:
+        metrics.save_report(report)
+        logger.info("Run report saved to {0}".format(report))
@@ -0,0 +1,290 @@
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from ftplib import FTP
+from ftplib import all_errors, error_perm
+
+PARTIAL_SUFFIX = ".partial"  # marker kept next to a partially downloaded file
+CHECKSUM_BLOCK_SIZE = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadError(Exception):
+    """A transfer finished but the local file doesn't match the remote one.
+
+    It is not a connection error (nor one of :data:`ftplib.all_errors`), so
+    it is never retried as one: the file is removed and downloaded again from
+    the start on the next attempt of the year.
+    """
+
+
+class FTPSession(object):
+    """A long-lived FTP connection. It is opened on first use and opened again
+    after any connection error, so a single session can serve any number of
+    requests.
+    """
+
+    def __init__(self, host, port, user, password, timeout=None, semaphore=None):
+        """
+        Args:
+           host (str): ftp server.
+           port (int): ftp port.
+           user (str): login user.
+           password (str): login password.
+           timeout (int): connection timeout in seconds.
+           semaphore (threading.BoundedSemaphore): held while the connection
+              is open, for limiting the number of concurrent connections.
+        """
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.timeout = timeout
+        self.semaphore = semaphore
+        self.ftp = None
+        self.cwd = None
+
+    def connect(self):
+        if self.ftp is not None:
+            return
+        if self.semaphore is not None:
+            self.semaphore.acquire()
+        try:
+            ftp = FTP(timeout=None)
+            ftp.connect(host=self.host, port=self.port, timeout=self.timeout)
+            ftp.login(user=self.user, passwd=self.password)
+            ftp.set_pasv(False)
+        except BaseException:
+            if self.semaphore is not None:
+                self.semaphore.release()
+            raise
+        self.ftp = ftp
+        self.cwd = None
+        logger.info("Login to FTP successfully")
+
+    def close(self):
+        if self.ftp is None:
+            return
+        try:
+            self.ftp.quit()
+            logger.info("Disconnected from FTP successfully")
+        except all_errors:
+            self.ftp.close()
+        finally:
+            self.ftp = None
+            self.cwd = None
+            if self.semaphore is not None:
+                self.semaphore.release()
+
+    def change_directory(self, path):
+        if self.cwd != path:
+            self.ftp.sendcmd(cmd="CWD " + path)
+            self.cwd = path
+
+    def list_files(self, path):
+        """
+        Lists the files of a remote directory.
+
+        Returns:
+           A dict mapping each file name to its MLSD metadata.
+        """
+        self.change_directory(path)
+        return dict((filename, metadata) for filename, metadata in self.ftp.mlsd(path=path)
+                    if metadata['type'] == 'file')
+
+    def retrieve(self, path, filename, local_file, metadata=None, checksum=None, callback=None):
+        """
+        Downloads a remote file. If the transfer fails, the partial local file
+        is kept along with a marker holding the remote metadata, and the next
+        retrieve of the same file resumes from its last byte (with REST), as
+        long as the remote file has not changed.
+
+        Args:
+           path (str): remote directory.
+           filename (str): remote file name.
+           local_file (str): local path of the file.
+           metadata (dict): MLSD metadata of the remote file. If it has a
+              size, the downloaded file is checked against it.
+           checksum (tuple): optional (algorithm, hexdigest) of the remote
+              file, e.g. ("md5", "..."), checked after the download.
+           callback (callable): called with each block of data received,
+              after it is written.
+
+        Raises:
+           DownloadError if the downloaded file doesn't match the size or the
+           checksum. The local file is removed, so it is downloaded again from
+           the start.
+        """
+        metadata = metadata or dict()
+        size = int(metadata["size"]) if "size" in metadata else None
+        marker = dict(size=size, modify=metadata.get("modify"))
+        offset = self.get_resume_offset(local_file, marker)
+        self.change_directory(path)
+        self.save_partial_marker(local_file, marker)
+        if size is None or offset < size:
+            if offset:
+                logger.info("Resuming download of {0} from byte {1}".format(filename, offset))
+            with open(local_file, "ab" if offset else "wb") as f:
+                def write(block):
+                    f.write(block)
+                    callback(block)
+                self.ftp.retrbinary('RETR {fname}'.format(fname=filename), f.write if callback is None else write,
+                                    rest=offset or None)
+        self.check_download(local_file, size, checksum)
+        os.remove(local_file + PARTIAL_SUFFIX)
+
+    @staticmethod
+    def get_resume_offset(local_file, marker):
+        """
+        Returns the number of bytes of local_file that can be kept, which is 0
+        unless it is a partial download of the same remote file.
+        """
+        try:
+            with open(local_file + PARTIAL_SUFFIX) as f:
+                if json.load(f) != marker:
+                    return 0
+            return os.path.getsize(local_file)
+        except (OSError, ValueError):
+            return 0
+
+    @staticmethod
+    def save_partial_marker(local_file, marker):
+        with open(local_file + PARTIAL_SUFFIX, "w") as f:
+            json.dump(marker, f, sort_keys=True)
+
+    @staticmethod
+    def check_download(local_file, size, checksum):
+        error = None
+        if size is not None and os.path.getsize(local_file) != size:
+            error = "{0} has {1} bytes, expected {2}".format(local_file, os.path.getsize(local_file), size)
+        elif checksum is not None:
+            algorithm, expected = checksum
+            digest = hashlib.new(algorithm)
+            with open(local_file, "rb") as f:
+                for block in iter(lambda: f.read(CHECKSUM_BLOCK_SIZE), b""):
+                    digest.update(block)
+            if digest.hexdigest() != expected.lower():
+                error = "{0} {1} checksum mismatch".format(local_file, algorithm)
+        if error is not None:
+            for file in (local_file, local_file + PARTIAL_SUFFIX):
+                try:
+                    os.remove(file)
+                except OSError as err:
+                    logger.warning("Couldn't delete file {0}: {1}".format(file, err))
+            raise DownloadError(error)
+
+
+class DownloadManager(object):
+    """Serves listing and download requests of any number of threads from a
+    queue, using a fixed number of persistent FTP sessions.
+
+    Each request returns a :class:`concurrent.futures.Future`, so callers can
+    handle files as soon as they are downloaded. Requests are served in the
+    order they are made. A request that fails because of the connection is
+    retried once on a new connection, resuming the partial download; other
+    errors (e.g. a missing file, or a :class:`DownloadError`) are set on its
+    future.
+    """
+
+    def __init__(self, host, port, user, password, num_connections=1, timeout=None, semaphore=None):
+        """
+        Args:
+           host (str): ftp server.
+           port (int): ftp port.
+           user (str): login user.
+           password (str): login password.
+           num_connections (int): number of sessions (and threads) serving
+              the requests.
+           timeout (int): connection timeout in seconds.
+           semaphore (threading.BoundedSemaphore): shared by all the sessions,
+              see :class:`FTPSession`.
+        """
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.num_connections = num_connections
+        self.timeout = timeout
+        self.semaphore = semaphore
+        self.requests = queue.Queue()
+        self.threads = list()
+
+    def start(self):
+        for i in range(self.num_connections):
+            thread = threading.Thread(target=self.serve, name="ftp:{0}".format(i), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self):
+        """
+        Waits for the queued requests to be served and closes the sessions.
+        """
+        for _ in self.threads:
+            self.requests.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = list()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def list_files(self, path):
+        """
+        Requests the listing of a remote directory, see
+        :func:`FTPSession.list_files`.
+        """
+        return self.submit(FTPSession.list_files, path)
+
+    def retrieve(self, path, filename, local_file, metadata=None, checksum=None, callback=None):
+        """
+        Requests the download of a remote file, see :func:`FTPSession.retrieve`.
+        """
+        return self.submit(FTPSession.retrieve, path, filename, local_file, metadata, checksum, callback)
+
+    def submit(self, method, *args):
+        future = Future()
+        self.requests.put((future, method, args))
+        return future
+
+    def serve(self):
+        session = FTPSession(self.host, self.port, self.user, self.password, self.timeout, self.semaphore)
+        try:
+            while True:
+                request = self.requests.get()
+                if request is None:
+                    break
+                future, method, args = request
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    result = self.execute(session, method, args)
+                except BaseException as err:
+                    future.set_exception(err)
+                else:
+                    future.set_result(result)
+        finally:
+            session.close()
+
+    @staticmethod
+    def execute(session, method, args):
+        for attempt in range(2):
+            try:
+                session.connect()
+                return method(session, *args)
+            except error_perm:
+                raise
+            except all_errors as err:
+                # the connection may have been dropped, try once again with a new one
+                session.close()
+                if attempt > 0:
+                    raise
+                logger.warning("FTP connection error, reconnecting: {0}".format(err))
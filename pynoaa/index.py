@@ -0,0 +1,216 @@
+"""
+Station index of the merged and ish year files.
+
+The index is a JSON sidecar (the data file name plus :data:`INDEX_SUFFIX`)
+mapping each station id, ``"USAF-WBAN"``, to the byte offset and length of its
+records in the data file, their number and the timestamps (YYYYMMDDHHMM) of
+the first and last ones, so the records of a station can be read without
+scanning the whole year.
+
+Records appended to a station after the file was built (see
+:func:`pynoaa.data.YearData.update_incremental`) are written at the end of
+the file, and listed in the ``appended`` segments of its entry, each one
+with its offset, length and number of records. See :func:`get_segments`.
+"""
+import io
+import json
+import os
+
+from .compress import find_compressed, read_range
+
+INDEX_SUFFIX = ".index.json"
+TIMESTAMP_SLICE = slice(15, 27)  # position of the date of an observation in a raw record
+TAIL_SIZE = 8192                 # bytes read from the end of a station for finding its last record
+
+
+class IndexBuilder(object):
+    """Builds the index of a merged file while the station files are appended
+    to it, see :func:`pynoaa.data.YearData.merge`.
+    """
+
+    def __init__(self):
+        self.stations = dict()
+        self.offset = 0
+        self.entry = None
+        self.last_byte = b"\n"
+
+    def start(self, filename):
+        """
+        Starts a new station, given the name of its file.
+        """
+        self.finish_station()
+        self.entry = dict(offset=self.offset, length=0, records=0)
+        self.stations[station_id(filename)] = self.entry
+        self.last_byte = b"\n"
+
+    def update(self, chunk):
+        """
+        Accounts for a chunk of the current station written to the merged file.
+        """
+        self.entry["length"] += len(chunk)
+        self.entry["records"] += chunk.count(b"\n")
+        self.offset += len(chunk)
+        if chunk:
+            self.last_byte = chunk[-1:]
+
+    def finish_station(self):
+        if self.entry is not None and self.last_byte != b"\n":
+            self.entry["records"] += 1  # last record without a new line
+        self.entry = None
+
+    def save(self, data_filename):
+        """
+        Adds the first and last timestamps of each station, read from the
+        merged file, and saves the index.
+        """
+        self.finish_station()
+        with open(data_filename, "rb") as f:
+            for entry in self.stations.values():
+                entry["first"], entry["last"] = get_timestamps(f, entry["offset"], entry["length"])
+        save_index(data_filename, self.stations)
+
+
+def station_id(filename):
+    """
+    Returns the station id of a station file name, e.g. "010010-99999" for
+    "010010-99999-1990.gz".
+    """
+    return "-".join(os.path.basename(filename).split("-")[:2])
+
+
+def get_timestamps(f, offset, length):
+    """
+    Returns the timestamps of the first and last records of a station.
+    """
+    if length == 0:
+        return None, None
+    f.seek(offset)
+    first = f.readline()[TIMESTAMP_SLICE].decode()
+    tail_size = TAIL_SIZE
+    while True:
+        start = max(offset, offset + length - tail_size)
+        f.seek(start)
+        tail = f.read(offset + length - start).rstrip(b"\n")
+        line_start = tail.rfind(b"\n")
+        if line_start >= 0 or start == offset:
+            return first, tail[line_start + 1:][TIMESTAMP_SLICE].decode()
+        tail_size *= 2
+
+
+def get_segments(entry):
+    """
+    Returns the segments of a station in a data file, its first one and the
+    appended ones, in the order of its records.
+
+    Returns:
+       A list of (offset, length, records) tuples.
+    """
+    appended = entry.get("appended", list())
+    records = entry["records"] - sum(segment["records"] for segment in appended)
+    return [(entry["offset"], entry["length"], records)] + [
+        (segment["offset"], segment["length"], segment["records"]) for segment in appended]
+
+
+def add_segment(entry, segment, first, last):
+    """
+    Returns a copy of the index entry of a station with a segment of records
+    appended at the end of the file.
+
+    Args:
+       entry (dict): index entry.
+       segment (dict): offset, length and number of records of the segment.
+       first (str): timestamp of the first record of the segment.
+       last (str): timestamp of the last record of the segment.
+    """
+    return dict(entry, records=entry["records"] + segment["records"], first=entry["first"] or first, last=last,
+                appended=entry.get("appended", list()) + [segment])
+
+
+def build_ish_index(ish_filename, index):
+    """
+    Builds the index of an ish file from the index of the merged file it was
+    converted from, as both have one line per record in the same order.
+    """
+    segments = sorted((offset, records, station, number) for station, entry in index.items()
+                      for number, (offset, _, records) in enumerate(get_segments(entry)))
+    ish_segments = dict()
+    with open(ish_filename, "rb") as f:
+        f.readline()  # header
+        for _, records, station, number in segments:
+            offset = f.tell()
+            for _ in range(records):
+                f.readline()
+            ish_segments[station, number] = dict(offset=offset, length=f.tell() - offset, records=records)
+    ish_index = dict()
+    for station, entry in index.items():
+        ish_index[station] = dict(entry, offset=ish_segments[station, 0]["offset"],
+                                  length=ish_segments[station, 0]["length"])
+        if "appended" in entry:
+            ish_index[station]["appended"] = [ish_segments[station, number]
+                                              for number in range(1, len(entry["appended"]) + 1)]
+    save_index(ish_filename, ish_index)
+
+
+def save_index(data_filename, index):
+    filename = data_filename + INDEX_SUFFIX
+    with open(filename + ".tmp", "w") as f:
+        json.dump(index, f, sort_keys=True)
+    os.replace(filename + ".tmp", filename)
+
+
+def load_index(data_filename):
+    """
+    Loads the index of a data file.
+
+    Returns:
+       The index, or None if the data file has no valid index.
+    """
+    try:
+        with open(data_filename + INDEX_SUFFIX) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def has_index(data_filename):
+    return os.path.exists(data_filename + INDEX_SUFFIX)
+
+
+def read_station(data_filename, station, index=None):
+    """
+    Reads the records of a station from a merged or ish year file, seeking
+    straight to them. If the file was compressed, its compressed version is
+    read (see :func:`pynoaa.compress.read_range`), as the index still
+    describes the uncompressed content.
+
+    Args:
+       data_filename (str): merged or ish year file.
+       station (str): station id, "USAF-WBAN".
+       index (dict): index of the file, loaded if None.
+
+    Returns:
+       A list with the lines of the station, empty if it is not in the file.
+
+    Raises:
+       FileNotFoundError if the file has no index.
+    """
+    if index is None:
+        index = load_index(data_filename)
+        if index is None:
+            raise FileNotFoundError("No index for {0}".format(data_filename))
+    entry = index.get(station)
+    if entry is None:
+        return list()
+    compressed = None if os.path.exists(data_filename) else find_compressed(data_filename)
+    if compressed is not None:
+        data = b"".join(read_range(compressed[0], offset, length, compressed[1])
+                        for offset, length, _ in get_segments(entry))
+    else:
+        with open(data_filename, "rb") as f:
+            data = b"".join(read_segment(f, offset, length) for offset, length, _ in get_segments(entry))
+    return io.StringIO(data.decode()).readlines()
+
+
+def read_segment(f, offset, length):
+    f.seek(offset)
+    return f.read(length)
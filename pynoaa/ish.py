@@ -1,5 +1,13 @@
 __author__ = 'jabaldonedo'
 
+import io
+import os
+import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor, wait
+from collections import namedtuple
+from operator import itemgetter
+
 cds_format = [('fill1', [0, 4]), ('id', [4, 10]), ('wban', [10, 15]), ('year', [15, 19]), ('month', [19, 21]),
               ('day', [21, 23]), ('hour', [23, 25]), ('minute', [25, 27]), ('fill2', [27, 60])]
 
@@ -34,438 +42,790 @@ AAX_LENGTH = 11
 aj1_format = [('sd', [3, 7])]
 AJ1_LENGTH = 17
 
+ADD_IDX = 105      # the additional data section starts after the mandatory data section
+ADD_ID = "ADD"
+
+# (code prefix, first number, last number, element length) of the elements that may appear in the additional data
+# section, used to walk it without searching
+element_format = [("AA", 1, 4, 11), ("AB", 1, 1, 10), ("AC", 1, 1, 6), ("AD", 1, 1, 22), ("AE", 1, 1, 15),
+                  ("AG", 1, 1, 7), ("AH", 1, 6, 18), ("AI", 1, 6, 18), ("AJ", 1, 1, AJ1_LENGTH), ("AK", 1, 1, 15),
+                  ("AL", 1, 4, 10), ("AM", 1, 1, 21), ("AN", 1, 1, 12), ("AO", 1, 4, 11), ("AP", 1, 4, 9),
+                  ("AT", 1, 8, 12), ("AU", 1, 9, 11), ("AW", 1, 4, XW_LENGTH), ("AX", 1, 6, 9), ("AY", 1, 2, AY_LENGTH),
+                  ("AZ", 1, 2, 8), ("CB", 1, 2, 13), ("CF", 1, 3, 9), ("CG", 1, 3, 11), ("CH", 1, 2, 18),
+                  ("CI", 1, 1, 31), ("CN", 1, 2, 21), ("CN", 3, 4, 19), ("CO", 1, 1, 8), ("CO", 2, 9, 11),
+                  ("CR", 1, 1, 10), ("CT", 1, 3, 10), ("CU", 1, 3, 16), ("CV", 1, 3, 29), ("CW", 1, 1, 17),
+                  ("CX", 1, 3, 29), ("ED", 1, 1, 11), ("GA", 1, 6, 16), ("GD", 1, 6, 15), ("GE", 1, 1, 22),
+                  ("GF", 1, 1, GF1_LENGTH), ("GG", 1, 6, 18), ("GH", 1, 1, 31), ("GJ", 1, 1, 8), ("GK", 1, 1, 7),
+                  ("GL", 1, 1, 9), ("GM", 1, 1, 33), ("GN", 1, 1, 31), ("GO", 1, 1, 22), ("GP", 1, 1, 34),
+                  ("GQ", 1, 1, 17), ("GR", 1, 1, 17), ("HL", 1, 1, 7), ("IA", 1, 1, 6), ("IA", 2, 2, 12),
+                  ("IB", 1, 1, 30), ("IB", 2, 2, 16), ("IC", 1, 1, 28), ("KA", 1, 4, KA1_LENGTH), ("KB", 1, 3, 13),
+                  ("KC", 1, 2, 17), ("KD", 1, 2, 12), ("KE", 1, 1, 15), ("KF", 1, 1, 9), ("KG", 1, 2, 14),
+                  ("MA", 1, 1, MA1_LENGTH), ("MD", 1, 1, 14), ("ME", 1, 1, 9), ("MF", 1, 1, 15), ("MG", 1, 1, 15),
+                  ("MH", 1, 1, 15), ("MK", 1, 1, 27), ("MV", 1, 7, 6), ("MW", 1, 7, XW_LENGTH), ("OA", 1, 3, 11),
+                  ("OB", 1, 2, 31), ("OC", 1, 1, OC1_LENGTH), ("OD", 1, 3, 14), ("OE", 1, 3, 19), ("RH", 1, 3, 12),
+                  ("SA", 1, 1, 9), ("ST", 1, 1, 20), ("UA", 1, 1, 13), ("UG", 1, 2, 12), ("WA", 1, 1, 9)]
+
+# identifiers of the sections that follow the additional data section
+add_end_ids = ("REM", "EQD", "QNN")
+
+PARALLEL_CHUNK_SIZE = 64 * 1024 * 1024  # target bytes of input converted by each parallel task
+
 header = "  USAF  WBAN YR--MODAHRMN DIR SPD GUS CLG SKC L M H  VSB MW MW MW MW AW AW AW AW W TEMP DEWP    SLP   ALT " \
     "   STP MAX MIN PCP01 PCP06 PCP24 PCPXX SD\n"
-rem_idx = None
 
 
-class Cds(object):
-    prefix = "cds"
+def compile_format(format_data):
+    """
+    Compiles a format table into a function that slices all its fields out of
+    a string at once and returns them as a tuple.
+    """
+    slicer = itemgetter(*[slice(start, end) for _, (start, end) in format_data])
+    if len(format_data) == 1:
+        return lambda text: (slicer(text),)
+    return slicer
+
+
+cds_slicer = compile_format(cds_format)
+mds_slicer = compile_format(mds_format)
+oc1_slicer = compile_format(oc1_format)
+gf1_slicer = compile_format(gf1_format)
+mw_slicer = compile_format(mw_format)
+aw_slicer = compile_format(aw_format)
+ay1_slicer = compile_format(ay1_format)
+ma1_slicer = compile_format(ma1_format)
+ka1_slicer = compile_format(ka1_format)
+aax_slicer = compile_format(aax_format)
+aj1_slicer = compile_format(aj1_format)
+
+element_length = dict((prefix + str(i), length) for prefix, first, last, length in element_format
+                      for i in range(first, last + 1))
+element_re = re.compile("|".join(sorted(element_length) + list(add_end_ids)))
+
+MW_NAMES = ("MW1", "MW2", "MW3", "MW4")
+AW_NAMES = ("AW1", "AW2", "AW3", "AW4")
+AA_NAMES = ("AA1", "AA2", "AA3", "AA4")
+
+Cds = namedtuple("Cds", ["cds_id", "cds_wban", "cds_year", "cds_month", "cds_day", "cds_hour", "cds_minute"])
+Mds = namedtuple("Mds", ["mds_dir", "mds_spd", "mds_clg", "mds_vsb", "mds_temp", "mds_dewp", "mds_slp"])
+Oc1 = namedtuple("Oc1", ["oc1_gus"])
+Gf1 = namedtuple("Gf1", ["gf1_skc", "gf1_low", "gf1_med", "gf1_hi"])
+Ay1 = namedtuple("Ay1", ["ay1_pw"])
+Ma1 = namedtuple("Ma1", ["ma1_alt", "ma1_stp"])
+Ka1 = namedtuple("Ka1", ["ka1_max_temp", "ka1_min_temp"])
+Aj1 = namedtuple("Aj1", ["aj1_sd"])
+
+# values used when a section is not present in a line
+OC1_MISSING = Oc1("***")
+GF1_MISSING = Gf1("***", "*", "*", "*")
+AY1_MISSING = Ay1("*")
+MA1_MISSING = Ma1("*****", "******")
+KA1_MISSING = Ka1("***", "***")
+AJ1_MISSING = Aj1("**")
 
 
-class Mds(object):
-    prefix = "mds"
+class Pcp(object):
+    __slots__ = ("pcp01", "pcp06", "pcp24", "pcp12", "pcp01t", "pcp06t", "pcp24t", "pcp12t")
 
+    def __init__(self):
+        self.pcp01 = self.pcp06 = self.pcp24 = self.pcp12 = "*****"
+        self.pcp01t = self.pcp06t = self.pcp24t = self.pcp12t = " "
 
-class Oc1(object):
-    prefix = "oc1"
 
+def format_blank(i, length):
+    blanks = "                 "
+    s = str(i)
+    if len(s) < length:
+        s = blanks[0:length - len(s)] + s
 
-class Gf1(object):
-    prefix = "gf1"
+    return s
 
 
-class Ay1(object):
-    prefix = "ay1"
+def convert_speed(speed):
+    # tenths of m/s to mph
+    return format_blank(int((float(speed) / 10.) * 2.237 + 0.5), 3)
 
 
-class Ma1(object):
-    prefix = "ma1"
+def convert_ceiling(clg):
+    # meters to hundreds of feet
+    return format_blank(int((float(clg) * 3.281) / 100.0 + 0.5), 3)
 
 
-class Ka1(object):
-    prefix = "ka1"
+def convert_visibility(vsb):
+    # meters to miles
+    vsb = float(vsb) * 0.000625
+    if vsb > 99.9:
+        vsb = 99.9
 
+    if vsb > 10.058125:
+        vsb = 10.0
 
-class Pcp(object):
-    pcp01 = pcp06 = pcp24 = pcp12 = "*****"
-    pcp01t = pcp06t = pcp24t = pcp12t = " "
+    return "{:>4}".format(round(vsb, 1))
 
 
-class Aj1(object):
-    prefix = "aj1"
+def convert_temperature(sign, temp):
+    # signed tenths of Celsius degrees to Fahrenheit degrees
+    temp = int(temp)
+    if sign == "-":
+        temp = -temp
+    if temp < -178:
+        temp = int((float(temp) / 10.) * 1.8 + 32. - 0.5)
+    else:
+        temp = int((float(temp) / 10.) * 1.8 + 32. + 0.5)
+    return format_blank(temp, 4)
 
 
-pcp = None
+def convert_pressure(pressure):
+    # tenths of hectopascals to hectopascals
+    return "{:>6}".format(round(float(pressure) / 10.0, 1))
 
 
-def main():
-    convert("./data/data", "./data/data_out")
+def convert_altimeter(alt):
+    # tenths of hectopascals to inches of mercury
+    return "{:>5}".format(round(((float(alt) / 10.0) * 100.0) / 3386.39, 2))
 
 
-def convert(input_filename, output_filename):
-    global rem_idx, pcp
+def convert_extreme_temperature(temp):
+    temp = float(temp)
+    if temp < -178:
+        temp = int((temp / 10.) * 1.8 + 32. - 0.5)
+    else:
+        temp = int((temp / 10.) * 1.8 + 32. + 0.5)
+    return "{:>3}".format(temp)
 
-    with open(input_filename) as fin, open(output_filename, "w") as fout:
-        fout.write(header)
-        for line in fin:
-            rem_idx = line.find("REM")
-            if rem_idx == -1:
-                rem_idx = 9999
 
-            cds = get_control_data_section(line)
-            mds = get_mandatory_data_section(line)
-            oc1 = get_oc1(line)
-            gf1 = get_gf1(line)
-            ay1 = get_ay1(line)
-            ma1 = get_ma1(line)
-            ka1 = get_ka1(line)
+def convert_precipitation(pcp):
+    # tenths of millimeters to inches
+    return "{:<6}".format(round((float(pcp) / 10.) * 0.03937008, 2))
 
-            mw = sorted(
-                [getattr(get_xw(line, "MW" + str(i), mw_format, "ww"), "mw" + str(i) + "_ww") for i in range(1, 5)],
-                reverse=True)
 
-            aw = sorted(
-                [getattr(get_xw(line, "AW" + str(i), mw_format, "zz"), "aw" + str(i) + "_zz") for i in range(1, 5)],
-                reverse=True)
+def convert_snow_depth(sd):
+    # centimeters to inches
+    return "{:<2}".format(int(float(sd) * 0.3937008 + 0.5))
 
-            pcp = Pcp()
-            [get_aax(line, "AA" + str(i), aax_format) for i in range(1, 5)]
 
-            aj1 = get_aj1(line)
+def build_table(convert_value, keys):
+    return dict((key, convert_value(key)) for key in keys)
 
-            control_data = "{cds_id} {wban} {year}{month}{day}{hour}{minute} ".format(cds_id=cds.cds_id,
-                                                                                      wban=cds.cds_wban,
-                                                                                      year=cds.cds_year,
-                                                                                      month=cds.cds_month,
-                                                                                      day=cds.cds_day,
-                                                                                      hour=cds.cds_hour,
-                                                                                      minute=cds.cds_minute)
 
-            mandatory_data = " ".join(
-                [mds.mds_dir, mds.mds_spd, oc1.oc1_gus, mds.mds_clg, gf1.gf1_skc, gf1.gf1_low, gf1.gf1_med, gf1.gf1_hi,
-                 mds.mds_vsb] + mw + aw + [ay1.ay1_pw, mds.mds_temp, mds.mds_dewp, mds.mds_slp, ma1.ma1_alt,
-                                           ma1.ma1_stp, ka1.ka1_max_temp, ka1.ka1_min_temp]) + " " + "".join(
-                [pcp.pcp01, pcp.pcp01t, pcp.pcp06, pcp.pcp06t, pcp.pcp24, pcp.pcp24t, pcp.pcp12,
-                 pcp.pcp12t]) + str(aj1.aj1_sd)
+# formatted output of the raw values within the usual range of each field, built once so the conversion of most
+# values is a lookup; values out of the tables are converted with the functions above
+SPEED_TABLE = build_table(convert_speed, ("{:04d}".format(i) for i in range(1000)))
+TEMPERATURE_TABLE = dict((sign + "{:04d}".format(i), convert_temperature(sign, "{:04d}".format(i)))
+                         for sign in "+-" for i in range(1000))
+PRESSURE_TABLE = build_table(convert_pressure, ("{:05d}".format(i) for i in range(8000, 11000)))
+ALTIMETER_TABLE = build_table(convert_altimeter, ("{:05d}".format(i) for i in range(8000, 11000)))
+PRECIPITATION_TABLE = build_table(convert_precipitation, ("{:04d}".format(i) for i in range(3000)))
+SNOW_DEPTH_TABLE = build_table(convert_snow_depth, ("{:04d}".format(i) for i in range(1000)))
 
 
+def main():
+    convert("./data/data", "./data/data_out")
 
-            out_line = control_data + mandatory_data + "\n"
-            fout.write(out_line)
+
+def convert(input_filename, output_filename, engine="python", workers=1, executor=None, fields=None):
+    """
+    Converts a merged year file into an ish file. With more than one worker,
+    or an executor, the input is split into line aligned byte ranges that are
+    converted in parallel processes, see :func:`convert_parallel`.
+
+    If fields is given, only those columns are computed and written, see
+    :func:`compile_projection`, whatever the engine.
+    """
+    if workers is None or workers > 1 or executor is not None:
+        convert_parallel(input_filename, output_filename, engine, workers, executor=executor, fields=fields)
+        return
+
+    if fields is not None:
+        convert_projected = compile_projection(fields)
+        with open(input_filename) as fin, open(output_filename, "w") as fout:
+            fout.write(get_header(fields))
+            convert_projected(fin, fout)
+        return
+    engine_convert_lines = get_engine(engine)
+    if engine == "bytes":
+        from .ish_bytes import convert_file
+        with open(output_filename, "wb") as fout:
+            fout.write(header.encode())
+            convert_file(input_filename, fout)
+        return
+    with open(input_filename) as fin, open(output_filename, "w") as fout:
+        fout.write(header)
+        engine_convert_lines(fin, fout)
+
+
+def convert_parallel(input_filename, output_filename, engine="python", workers=None,
+                     chunk_size=PARALLEL_CHUNK_SIZE, executor=None, fields=None):
+    """
+    Converts the input in chunks of about chunk_size bytes, and at least
+    workers chunks, using a pool of workers processes (one per cpu if None),
+    or the given process executor, which may be shared with other
+    conversions. Each chunk is written to its own part file next to the
+    output, and the parts are appended to the output in order as they finish,
+    so the result is identical to a serial conversion.
+    """
+    get_engine(engine)
+    if fields is not None:
+        compile_projection(fields)
+    workers = workers or os.cpu_count() or 1
+    num_chunks = max(workers, -(-os.path.getsize(input_filename) // chunk_size))
+    ranges = split_file(input_filename, num_chunks)
+    parts = [output_filename + ".part{0}".format(i) for i in range(len(ranges))]
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    futures = list()
+    try:
+        futures = [executor.submit(convert_range, input_filename, part, start, end, engine, fields)
+                   for part, (start, end) in zip(parts, ranges)]
+        with open(output_filename, "wb") as fout:
+            fout.write(get_header(fields).encode())
+            for part, future in zip(parts, futures):
+                future.result()
+                with open(part, "rb") as fpart:
+                    shutil.copyfileobj(fpart, fout)
+                os.remove(part)
+    finally:
+        for future in futures:
+            future.cancel()
+        wait(futures)
+        if own_executor:
+            executor.shutdown()
+        for part in parts:
+            if os.path.exists(part):
+                os.remove(part)
+
+
+def convert_range(input_filename, output_filename, start, end, engine="python", fields=None):
+    """
+    Converts the lines of the input between byte offsets start and end (both
+    at line boundaries) into output_filename, without header.
+    """
+    if fields is not None:
+        with open(output_filename, "w") as fout:
+            compile_projection(fields)(iter_range(input_filename, start, end), fout)
+        return
+    if engine == "bytes":
+        from .ish_bytes import convert_file
+        with open(output_filename, "wb") as fout:
+            convert_file(input_filename, fout, start, end)
+        return
+    with open(output_filename, "w") as fout:
+        get_engine(engine)(iter_range(input_filename, start, end), fout)
+
+
+def iter_range(filename, start, end):
+    """
+    Yields the decoded lines of a file between byte offsets start and end,
+    with universal newlines, as the lines of the file opened in text mode.
+    """
+    with open(filename, "rb") as fin:
+        fin.seek(start)
+        remaining = end - start
+        for line in fin:
+            if remaining <= 0:
+                break
+            remaining -= len(line)
+            if b"\r" in line:
+                # the line may be several ones, split as text
+                yield from io.StringIO(line.decode(), newline=None)
+            else:
+                yield line.decode()
+
+
+def split_file(filename, num_chunks):
+    """
+    Splits a file into at most num_chunks byte ranges of similar size, each one
+    starting and ending at a line boundary.
+
+    Returns:
+       A list of (start, end) tuples.
+    """
+    size = os.path.getsize(filename)
+    bounds = [0]
+    with open(filename, "rb") as f:
+        for i in range(1, num_chunks):
+            pos = size * i // num_chunks
+            if pos <= bounds[-1]:
+                continue
+            # move to the start of the next line
+            f.seek(pos - 1)
+            f.readline()
+            pos = f.tell()
+            if pos >= size:
+                break
+            if pos > bounds[-1]:
+                bounds.append(pos)
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+
+def get_engine(engine):
+    """
+    Returns the convert_lines function of the given engine: "python" (line by
+    line), "numpy" (the control and mandatory sections are computed in blocks
+    of lines, requires numpy) or "bytes" (files are memory mapped and
+    converted as bytes, see :mod:`pynoaa.ish_bytes`).
+    """
+    if engine == "python":
+        return convert_lines
+    elif engine == "numpy":
+        from .ish_numpy import convert_lines as numpy_convert_lines
+        return numpy_convert_lines
+    elif engine == "bytes":
+        from .ish_bytes import convert_lines as bytes_convert_lines
+        return bytes_convert_lines
+    else:
+        raise ValueError("Unknown ish engine: {0}".format(engine))
+
+
+def convert_lines(lines, fout):
+    """
+    Converts an iterable of raw lines into ish rows written to fout. The
+    header is not written, so lines can be fed from any source (a merged
+    file, a stream of decompressed station files...).
+    """
+    for line in lines:
+        fout.write(format_line(line, format_control_data(get_control_data_section(line)),
+                               get_mandatory_data_section(line)))
+
+
+def format_control_data(cds):
+    return "{0} {1} {2}{3}{4}{5}{6} ".format(*cds)
+
+
+def format_line(line, control_data, mandatory):
+    """
+    Builds the ish row of a line from its already formatted control data and
+    mandatory fields (dir, spd, clg, vsb, temp, dewp, slp); the additional
+    data sections are extracted here.
+    """
+    index = tokenize(line)
+
+    mds_dir, mds_spd, mds_clg, mds_vsb, mds_temp, mds_dewp, mds_slp = mandatory
+    oc1_gus, = get_oc1(line, index)
+    gf1_skc, gf1_low, gf1_med, gf1_hi = get_gf1(line, index)
+    ay1_pw, = get_ay1(line, index)
+    ma1_alt, ma1_stp = get_ma1(line, index)
+    ka1_max_temp, ka1_min_temp = get_ka1(line, index)
+
+    mw = sorted([get_xw(line, index, name, mw_slicer) for name in MW_NAMES], reverse=True)
+    aw = sorted([get_xw(line, index, name, aw_slicer) for name in AW_NAMES], reverse=True)
+
+    pcp = Pcp()
+    for name in AA_NAMES:
+        get_aax(line, index, name, pcp)
+
+    aj1_sd, = get_aj1(line, index)
+
+    mandatory_data = " ".join(
+        [mds_dir, mds_spd, oc1_gus, mds_clg, gf1_skc, gf1_low, gf1_med, gf1_hi,
+         mds_vsb] + mw + aw + [ay1_pw, mds_temp, mds_dewp, mds_slp, ma1_alt,
+                               ma1_stp, ka1_max_temp, ka1_min_temp]) + " " + "".join(
+        [pcp.pcp01, pcp.pcp01t, pcp.pcp06, pcp.pcp06t, pcp.pcp24, pcp.pcp24t, pcp.pcp12,
+         pcp.pcp12t]) + aj1_sd
+
+    return control_data + mandatory_data + "\n"
+
+
+def tokenize(line):
+    """
+    Walks the additional data section of a line once, jumping from element
+    to element with the lengths in element_format, and returns a dict with
+    the offset of each element code. Only codes found at the start of an
+    element count, so a code inside a value or a remark is never matched.
+    If an unknown element is found, the walk resumes at the next known code.
+    """
+    index = dict()
+    if line[ADD_IDX:ADD_IDX + 3] != ADD_ID:
+        return index
+
+    idx = ADD_IDX + 3
+    end = len(line)
+    while idx < end:
+        code = line[idx:idx + 3]
+        length = element_length.get(code)
+        if length is None:
+            if code in add_end_ids:
+                break
+            match = element_re.search(line, idx + 1)
+            if match is None:
+                break
+            idx = match.start()
+        else:
+            index.setdefault(code, idx)
+            idx += length
+    return index
 
 
 def get_control_data_section(line):
-    cds = get_data(line, cds_format, Cds())
+    _, cds_id, wban, year, month, day, hour, minute, _ = cds_slicer(line)
 
-    if cds.cds_wban == "99999":
-        cds.cds_wban = "*****"
+    if wban == "99999":
+        wban = "*****"
 
-    return cds
+    return Cds(cds_id, wban, year, month, day, hour, minute)
 
 
 def get_mandatory_data_section(line):
-    line_data = get_data(line, mds_format, Mds())
+    _, mds_dir, _, _, spd, _, clg, _, vsb, _, temp_sign, temp, _, dewp_sign, dewp, _, slp, _ = mds_slicer(line)
 
     # apply rules to certain fields
 
-    if line_data.mds_dir == "999":
-        line_data.mds_dir = "***"
+    if mds_dir == "999":
+        mds_dir = "***"
 
-    if line_data.mds_dir_type == "V":
-        line_data.mds_dir_type = "990"
-
-    if line_data.mds_spd == "9999":
-        line_data.mds_spd = "***"
+    if spd == "9999":
+        spd = "***"
     else:
-        line_data.mds_spd = format_blank(int((float(line_data.mds_spd) / 10.) * 2.237 + 0.5), 3)
+        spd = SPEED_TABLE.get(spd) or convert_speed(spd)
 
-    if line_data.mds_clg == "99999":
-        line_data.mds_clg = "***"
-    else:
-        if line_data.mds_clg.isdecimal():
-            line_data.mds_clg = str(line_data.mds_clg)
-        else:
-            line_data.mds_clg = format_blank(int((float(line_data.mds_clg) * 3.281) / 100.0 + 0.5), 3)
+    if clg == "99999":
+        clg = "***"
+    elif not clg.isdecimal():
+        clg = convert_ceiling(clg)
 
-    if line_data.mds_vsb == "999999":
-        line_data.mds_vsb = "****"
+    if vsb == "999999":
+        vsb = "****"
     else:
-        line_data.mds_vsb = float(line_data.mds_vsb) * 0.000625
-        if line_data.mds_vsb > 99.9:
-            line_data.mds_vsb = 99.9
-
-        if line_data.mds_vsb > 10.058125:
-            line_data.mds_vsb = 10.0
-
-        line_data.mds_vsb = "{:>4}".format(round(line_data.mds_vsb, 1))
+        vsb = convert_visibility(vsb)
 
-    if line_data.mds_temp == "9999":
-        line_data.mds_temp = "****"
+    if temp == "9999":
+        temp = "****"
     else:
-        mds = int(line_data.mds_temp)
-        if line_data.mds_temp_sign == "-":
-            mds = -int(mds)
-        if mds < -178:
-            mds = int((float(mds) / 10.) * 1.8 + 32. - 0.5)
-        else:
-            mds = int((float(mds) / 10.) * 1.8 + 32. + 0.5)
-        line_data.mds_temp = format_blank(mds, 4)
+        temp = TEMPERATURE_TABLE.get(temp_sign + temp) or convert_temperature(temp_sign, temp)
 
-    if line_data.mds_dewp == "9999":
-        line_data.mds_dewp = "****"
+    if dewp == "9999":
+        dewp = "****"
     else:
-        dewp = int(line_data.mds_dewp)
-        if line_data.mds_dewp_sign == "-":
-            dewp = -dewp
-        if dewp < -178:
-            dewp = int((float(dewp) / 10.) * 1.8 + 32. - 0.5)
-        else:
-            dewp = int((float(dewp) / 10.) * 1.8 + 32 + 0.5)
-        line_data.mds_dewp = format_blank(dewp, 4)
+        dewp = TEMPERATURE_TABLE.get(dewp_sign + dewp) or convert_temperature(dewp_sign, dewp)
 
-    if line_data.mds_slp == "99999":
-        line_data.mds_slp = "******"
+    if slp == "99999":
+        slp = "******"
     else:
-        slp = float(line_data.mds_slp) / 10.0
-        line_data.mds_slp = "{:>6}".format(round(slp, 1))
+        slp = PRESSURE_TABLE.get(slp) or convert_pressure(slp)
 
-    return line_data
+    return Mds(mds_dir, spd, clg, vsb, temp, dewp, slp)
 
 
-def get_oc1(line):
-    oc1_idx = line.find("OC1")
+def get_oc1(line, index):
+    oc1_idx = index.get("OC1")
 
-    if 0 <= oc1_idx < rem_idx:
-        line_data = get_data(line[oc1_idx:oc1_idx + OC1_LENGTH], oc1_format, Oc1())
-
-        if line_data.oc1_gus == "9999":
-            line_data.oc1_gus = "***"
-        else:
-            if line_data.oc1_gus.isdecimal():
-                line_data.oc1_gus = format_blank(int((float(line_data.oc1_gus) / 10.) * 2.237 + .5), 3)
-            else:
-                line_data.oc1_gus = "***"
+    if oc1_idx is not None:
+        gus, = oc1_slicer(line[oc1_idx:oc1_idx + OC1_LENGTH])
 
-        return line_data
-    else:
-        ret = Oc1()
-        ret.__setattr__('oc1_gus', '***')
-        return ret
+        if gus != "9999" and gus.isdecimal():
+            return Oc1(SPEED_TABLE.get(gus) or convert_speed(gus))
+    return OC1_MISSING
 
 
-def get_gf1(line):
-    gf1_idx = line.find("GF1")
+def get_gf1(line, index):
+    gf1_idx = index.get("GF1")
 
-    if 0 <= gf1_idx < rem_idx:
-        gf1 = line[gf1_idx:gf1_idx + GF1_LENGTH]
-        line_data = get_data(gf1, gf1_format, Gf1())
+    if gf1_idx is not None:
+        _, skc, _, low, _, med, _, hi, _ = gf1_slicer(line[gf1_idx:gf1_idx + GF1_LENGTH])
 
-        if line_data.gf1_skc == "99":
-            line_data.gf1_skc = "**"
+        if skc == "99":
+            skc = "**"
         else:
-            if line_data.gf1_skc.isdecimal():
-                x = int(line_data.gf1_skc)
+            if skc.isdecimal():
+                x = int(skc)
                 if x == 0:
-                    line_data.gf1_skc = "CLR"
+                    skc = "CLR"
                 elif 1 <= x <= 4:
-                    line_data.gf1_skc = "SCT"
+                    skc = "SCT"
                 elif 5 <= x <= 7:
-                    line_data.gf1_skc = "BKN"
+                    skc = "BKN"
                 elif x == 8:
-                    line_data.gf1_skc = "OVC"
+                    skc = "OVC"
                 elif x == 9:
-                    line_data.gf1_skc = "OBS"
+                    skc = "OBS"
                 elif x == 10:
-                    line_data.gf1_skc = "POB"
+                    skc = "POB"
             else:
-                line_data.gf1_skc = "**"
+                skc = "**"
 
-        if line_data.gf1_low == "99":
-            line_data.gf1_low = "*"
-        else:
-            line_data.gf1_low = line_data.gf1_low[1:2]
+        low = "*" if low == "99" else low[1:2]
+        med = "*" if med == "99" else med[1:2]
+        hi = "*" if hi == "99" else hi[1:2]
 
-        if line_data.gf1_med == "99":
-            line_data.gf1_med = "*"
-        else:
-            line_data.gf1_med = line_data.gf1_med[1:2]
-
-        if line_data.gf1_hi == "99":
-            line_data.gf1_hi = "*"
-        else:
-            line_data.gf1_hi = line_data.gf1_hi[1:2]
-
-        return line_data
+        return Gf1(skc, low, med, hi)
     else:
-        ret = Gf1()
-        ret.__setattr__("gf1_skc", "***")
-        ret.__setattr__("gf1_low", "*")
-        ret.__setattr__("gf1_med", "*")
-        ret.__setattr__("gf1_hi", "*")
-        return ret
-
+        return GF1_MISSING
 
-def get_xw(line, xw_name, xw_format, prefix):
-    mw_idx = line.find(xw_name)
 
-    cls = type(xw_name.title(), (object,), dict(prefix=str.lower(xw_name)))
+def get_xw(line, index, xw_name, xw_slicer):
+    """
+    Returns the weather code of a MW1-MW4 or AW1-AW4 section, "**" if the
+    section is not present.
+    """
+    xw_idx = index.get(xw_name)
 
-    if 0 <= mw_idx < rem_idx:
-        mw = line[mw_idx:mw_idx + XW_LENGTH]
-        line_data = get_data(mw, xw_format, cls)
-        return line_data
+    if xw_idx is not None:
+        code, = xw_slicer(line[xw_idx:xw_idx + XW_LENGTH])
+        return code
     else:
-        setattr(cls, cls.prefix + "_" + prefix, "**")
-        return cls
+        return "**"
 
 
-def get_ay1(line):
-    ay_idx = line.find("AY1")
+def get_ay1(line, index):
+    ay_idx = index.get("AY1")
 
-    if 0 <= ay_idx < rem_idx:
-        ay = line[ay_idx:ay_idx + AY_LENGTH]
-        line_data = get_data(ay, ay1_format, Ay1())
-        return line_data
+    if ay_idx is not None:
+        return Ay1._make(ay1_slicer(line[ay_idx:ay_idx + AY_LENGTH]))
     else:
-        ret = Ay1()
-        ret.__setattr__("ay1_pw", "*")
-        return ret
+        return AY1_MISSING
 
 
-def get_ma1(line):
-    ma1_idx = line.find("MA1")
+def get_ma1(line, index):
+    ma1_idx = index.get("MA1")
 
-    if 0 <= ma1_idx < rem_idx:
-        ma1 = line[ma1_idx:ma1_idx + MA1_LENGTH]
-        line_data = get_data(ma1, ma1_format, Ma1())
+    if ma1_idx is not None:
+        alt, stp = ma1_slicer(line[ma1_idx:ma1_idx + MA1_LENGTH])
 
-        if line_data.ma1_alt == "99999":
-            line_data.ma1_alt = "*****"
+        if alt != "99999" and alt.isdecimal():
+            alt = ALTIMETER_TABLE.get(alt) or convert_altimeter(alt)
         else:
-            if line_data.ma1_alt.isdecimal():
-                line_data.ma1_alt = ((float(line_data.ma1_alt) / 10.0) * 100.0) / 3386.39
-                line_data.ma1_alt = "{:>5}".format(round(line_data.ma1_alt, 2))
-            else:
-                line_data.ma1_alt = "*****"
+            alt = "*****"
 
-        if line_data.ma1_stp == "99999":
-            line_data.ma1_stp = "******"
+        if stp == "99999":
+            stp = "******"
+        elif stp.isdecimal():
+            stp = PRESSURE_TABLE.get(stp) or convert_pressure(stp)
         else:
-            if line_data.ma1_stp.isdecimal():
-                line_data.ma1_stp = float(line_data.ma1_stp) / 10.0
-                line_data.ma1_stp = "{:>6}".format(round(line_data.ma1_stp, 1))
-            else:
-                line_data.ma1_alt = "******"
+            alt = "******"
 
-        return line_data
+        return Ma1(alt, stp)
     else:
-        ret = Ma1()
-        ret.__setattr__('ma1_alt', "*****")
-        ret.__setattr__('ma1_stp', "******")
-        return ret
-
+        return MA1_MISSING
 
-def get_ka1(line):
-    ka1_idx = line.find("KA1")
 
-    if 0 <= ka1_idx < rem_idx:
-        ka1 = line[ka1_idx:ka1_idx + KA1_LENGTH]
-        line_data = get_data(ka1, ka1_format, Ka1())
+def get_ka1(line, index):
+    ka1_idx = index.get("KA1")
 
-        if line_data.ka1_temp == "+9999":
-            line_data.ka1_temp = "***"
-            setattr(line_data, "ka1_max_temp", "***")
-            setattr(line_data, "ka1_min_temp", "***")
-        else:
-            setattr(line_data, "ka1_max_temp", "***")
-            setattr(line_data, "ka1_min_temp", "***")
-            if line_data.ka1_temp.isdecimal():
-                temp = float(line_data.ka1_temp)
-                if temp < -178:
-                    temp = int((temp / 10.) * 1.8 + 32. - 0.5)
-                else:
-                    temp = int((temp / 10.) * 1.8 + 32. + 0.5)
-
-                if line_data.ka1_code == "N":
-                    setattr(line_data, "ka1_min_temp", "{:>3}".format(temp))
-
-                elif line_data.ka1_code == "M":
-                    setattr(line_data, "ka1_max_temp", "{:>3}".format(temp))
-            else:
-                line_data.ka1_temp = "***"
-        return line_data
-    else:
-        ret = Ka1()
-        ret.__setattr__("ka1_max_temp", "***")
-        ret.__setattr__("ka1_min_temp", "***")
-        return ret
+    if ka1_idx is not None:
+        code, temp = ka1_slicer(line[ka1_idx:ka1_idx + KA1_LENGTH])
 
+        if temp != "+9999" and temp.isdecimal():
+            temp = convert_extreme_temperature(temp)
 
-def get_aax(line, aax_name, ax_format):
-    idx_aax = line.find(aax_name)
+            if code == "N":
+                return Ka1("***", temp)
+            elif code == "M":
+                return Ka1(temp, "***")
+    return KA1_MISSING
 
-    pcp_id = str.lower(aax_name) + '_pcp'
-    hours_id = str.lower(aax_name) + '_hours'
-    trace_id = str.lower(aax_name) + '_trace'
 
-    cls = type(aax_name.title(), (object,), dict(prefix=str.lower(aax_name)))
+def get_extreme_temperatures(line, index):
+    """
+    Same as :func:`get_ka1`, but reading the sign of the temperature, which
+    the ish output always leaves missing. Used where the values don't have to
+    match the ish output, e.g. the records and the column files.
+    """
+    ka1_idx = index.get("KA1")
 
-    if 0 <= idx_aax < rem_idx:
-        aax = line[idx_aax:idx_aax + AAX_LENGTH]
-        line_data = get_data(aax, ax_format, cls)
+    if ka1_idx is not None:
+        code, temp = ka1_slicer(line[ka1_idx:ka1_idx + KA1_LENGTH])
 
-        pcp_val = str(getattr(line_data, pcp_id))
-        hours = str(getattr(line_data, hours_id))
-        trace = str(getattr(line_data, trace_id))
+        if temp != "+9999" and temp[:1] in ("+", "-") and temp[1:].isdecimal():
+            temp = TEMPERATURE_TABLE.get(temp) or convert_temperature(temp[:1], temp[1:])
 
-        if pcp_val == "9999":
-            setattr(line_data, pcp_id, '*****')
-        elif pcp_val.isdecimal():
-            set_pcp(float(pcp_val), hours, trace)
-        else:
-            setattr(line_data, pcp_id, '*****')
-        return line_data
-    else:
-        setattr(cls, pcp_id, '*****')
-        return cls
+            if code == "N":
+                return Ka1("***", temp)
+            elif code == "M":
+                return Ka1(temp, "***")
+    return KA1_MISSING
 
 
-def get_aj1(line):
-    aj1_idx = line.find("AJ1")
+def get_aax(line, index, aax_name, pcp):
+    """
+    Reads a AA1-AA4 section and stores its precipitation into pcp.
+    """
+    idx_aax = index.get(aax_name)
 
-    if 0 <= aj1_idx < rem_idx:
-        aj1 = line[aj1_idx:aj1_idx + AJ1_LENGTH]
-        line_data = get_data(aj1, aj1_format, Aj1())
+    if idx_aax is not None:
+        hours, pcp_val, trace = aax_slicer(line[idx_aax:idx_aax + AAX_LENGTH])
 
-        if line_data.aj1_sd == "9999":
-            line_data.aj1_sd = "**"
-        else:
-            if line_data.aj1_sd.isdecimal():
-                line_data.aj1_sd = "{:<2}".format(int(float(line_data.aj1_sd) * 0.3937008 + 0.5))
-            else:
-                line_data.aj1_sd = "**"
-            return line_data
-    else:
-        ret = Aj1()
-        ret.__setattr__('aj1_sd', '**')
-        return ret
+        if pcp_val != "9999" and pcp_val.isdecimal():
+            set_pcp(pcp, PRECIPITATION_TABLE.get(pcp_val) or convert_precipitation(pcp_val), hours, trace)
 
 
-def get_data(line, format_data, ret):
-    for data in format_data:
-        setattr(ret, ret.prefix + "_" + data[0], line[data[1][0]:data[1][1]])
-    return ret
+def get_aj1(line, index):
+    aj1_idx = index.get("AJ1")
 
+    if aj1_idx is not None:
+        sd, = aj1_slicer(line[aj1_idx:aj1_idx + AJ1_LENGTH])
 
-def set_pcp(value, hours, trace):
-    global pcp
+        if sd != "9999" and sd.isdecimal():
+            return Aj1(SNOW_DEPTH_TABLE.get(sd) or convert_snow_depth(sd))
+    return AJ1_MISSING
 
-    value = (value / 10.) * 0.03937008
 
+def set_pcp(pcp, value, hours, trace):
+    """
+    Stores a precipitation, already converted with
+    :func:`convert_precipitation`, in the field of its period.
+    """
     if hours == "01":
-        pcp.pcp01 = "{:<6}".format(round(value, 2))
+        pcp.pcp01 = value
         if trace == "2":
             pcp.pcp01t = "T"
     elif hours == "06":
-        pcp.pcp06 = "{:<6}".format(round(value, 2))
+        pcp.pcp06 = value
         if trace == "2":
             pcp.pcp06t = "T"
     elif hours == "24":
-        pcp.pcp24 = "{:<6}".format(round(value, 2))
+        pcp.pcp24 = value
         pcp.pcp24t = "T"
     else:
-        pcp.pcp12 = "{:<6}".format(round(value, 2))
+        pcp.pcp12 = value
         pcp.pcp12t = "T"
 
 
-def format_blank(i, length):
-    blanks = "                 "
-    s = str(i)
-    if len(s) < length:
-        s = blanks[0:length - len(s)] + s
-
-    return s
+def get_control_fields(line, index):
+    """
+    Returns the usaf, wban and date (YYYYMMDDHHMM) of a line.
+    """
+    cds = get_control_data_section(line)
+    return cds.cds_id, cds.cds_wban, cds.cds_year + cds.cds_month + cds.cds_day + cds.cds_hour + cds.cds_minute
+
+
+def get_mandatory_field(name, sentinel, missing, convert_value, is_converted=None):
+    """
+    Builds the extractor of a single field of the mandatory data section, so
+    a projection computes only the fields it needs, with the same rules as
+    :func:`get_mandatory_data_section`.
+    """
+    start, end = dict(mds_format)[name]
+
+    def get_field(line, index):
+        value = line[start:end]
+        if value == sentinel:
+            return missing,
+        if is_converted is not None and is_converted(value):
+            return value,
+        return convert_value(value),
+    return get_field
+
+
+def get_temperature_field(name):
+    start, end = dict(mds_format)[name]
+
+    def get_field(line, index):
+        temp = line[start:end]
+        if temp == "9999":
+            return "****",
+        sign = line[start - 1:start]
+        return TEMPERATURE_TABLE.get(sign + temp) or convert_temperature(sign, temp),
+    return get_field
+
+
+def get_xw_fields(names, slicer):
+    def get_codes(line, index):
+        return " ".join(sorted([get_xw(line, index, name, slicer) for name in names], reverse=True)),
+    return get_codes
+
+
+def get_pcp_fields(line, index):
+    """
+    Returns the pcp01, pcp06, pcp24 and pcpxx columns of a line, each one
+    with its trace flag.
+    """
+    pcp = Pcp()
+    for name in AA_NAMES:
+        get_aax(line, index, name, pcp)
+    return pcp.pcp01 + pcp.pcp01t, pcp.pcp06 + pcp.pcp06t, pcp.pcp24 + pcp.pcp24t, pcp.pcp12 + pcp.pcp12t
+
+
+# columns of the ish output: field name, header label, section computing it and its position in the section values,
+# also used for parsing records, see pynoaa.records
+output_format = [("usaf", "  USAF", "control", 0), ("wban", " WBAN", "control", 1),
+                 ("date", "YR--MODAHRMN", "control", 2), ("dir", "DIR", "dir", 0),
+                 ("spd", "SPD", "spd", 0), ("gus", "GUS", "oc1", 0), ("clg", "CLG", "clg", 0),
+                 ("skc", "SKC", "gf1", 0), ("low", "L", "gf1", 1), ("med", "M", "gf1", 2), ("hi", "H", "gf1", 3),
+                 ("vsb", " VSB", "vsb", 0), ("mw", "MW MW MW MW", "mw", 0), ("aw", "AW AW AW AW", "aw", 0),
+                 ("w", "W", "ay1", 0), ("temp", "TEMP", "temp", 0), ("dewp", "DEWP", "dewp", 0),
+                 ("slp", "   SLP", "slp", 0), ("alt", "  ALT", "ma1", 0), ("stp", "   STP", "ma1", 1),
+                 ("max", "MAX", "ka1", 0), ("min", "MIN", "ka1", 1), ("pcp01", "PCP01", "aa", 0),
+                 ("pcp06", "PCP06", "aa", 1), ("pcp24", "PCP24", "aa", 2), ("pcpxx", "PCPXX", "aa", 3),
+                 ("sd", "SD", "aj1", 0)]
+OUTPUT_FIELDS = [name for name, _, _, _ in output_format]
+
+output_sections = dict(control=get_control_fields,
+                       dir=get_mandatory_field("dir", "999", "***", str),
+                       spd=get_mandatory_field("spd", "9999", "***",
+                                               lambda spd: SPEED_TABLE.get(spd) or convert_speed(spd)),
+                       clg=get_mandatory_field("clg", "99999", "***", convert_ceiling, str.isdecimal),
+                       vsb=get_mandatory_field("vsb", "999999", "****", convert_visibility),
+                       temp=get_temperature_field("temp"),
+                       dewp=get_temperature_field("dewp"),
+                       slp=get_mandatory_field("slp", "99999", "******",
+                                               lambda slp: PRESSURE_TABLE.get(slp) or convert_pressure(slp)),
+                       oc1=get_oc1,
+                       gf1=get_gf1,
+                       mw=get_xw_fields(MW_NAMES, mw_slicer),
+                       aw=get_xw_fields(AW_NAMES, aw_slicer),
+                       ay1=get_ay1,
+                       ma1=get_ma1,
+                       ka1=get_ka1,
+                       aa=get_pcp_fields,
+                       aj1=get_aj1)
+# header label, section and position of each field
+OUTPUT_COLUMNS = dict((name, (label, section, position)) for name, label, section, position in output_format)
+
+# sections read from the additional data section, which has to be tokenized
+ADDITIONAL_SECTIONS = ("oc1", "gf1", "mw", "aw", "ay1", "ma1", "ka1", "aa", "aj1")
+
+
+def get_header(fields=None):
+    """
+    Returns the header of the ish output, or of the output with only the
+    given fields.
+    """
+    if fields is None:
+        return header
+    return " ".join([OUTPUT_COLUMNS[name][0] for name in fields]) + "\n"
+
+
+def compile_projection(fields):
+    """
+    Compiles the conversion of lines into ish rows with only the given
+    columns, in the given order and separated by a space. Only the sections
+    holding them are extracted, and the additional data section is only
+    tokenized if they need it, so e.g. the station, date and temperature are
+    converted several times faster than whole rows.
+
+    Args:
+       fields (list): names of the columns, see :data:`OUTPUT_FIELDS`.
+
+    Returns:
+       A function converting an iterable of lines into rows written to a
+       file, like :func:`convert_lines`.
+
+    Raises:
+       ValueError if a field is unknown.
+    """
+    fields = list(fields)
+    unknown = [name for name in fields if name not in OUTPUT_COLUMNS]
+    if unknown or not fields:
+        raise ValueError("Unknown fields: {0}".format(", ".join(unknown) or "none given"))
+    sections = list()
+    columns = list()
+    for name in fields:
+        _, section, position = OUTPUT_COLUMNS[name]
+        if section not in sections:
+            sections.append(section)
+        columns.append((sections.index(section), position))
+    getters = [output_sections[section] for section in sections]
+    needs_index = any(section in ADDITIONAL_SECTIONS for section in sections)
+    no_index = dict()
+
+    def convert_projected(lines, fout):
+        for line in lines:
+            index = tokenize(line) if needs_index else no_index
+            values = [get(line, index) for get in getters]
+            fout.write(" ".join([values[section][position] for section, position in columns]) + "\n")
+    return convert_projected
 
 
 if __name__ == "__main__":
@@ -0,0 +1,296 @@
+"""
+Bytes engine for :func:`pynoaa.ish.convert`.
+
+The merged file is memory mapped, so the page cache does the read buffering,
+and each line is handled as bytes: fields are sliced and looked up in bytes
+versions of the conversion tables of :mod:`pynoaa.ish`, so nothing is decoded
+nor encoded, and the rows are assembled into a bytearray that is written in
+blocks of :data:`OUTPUT_BUFFER_SIZE` bytes. Lines with non ASCII characters or
+carriage returns, where bytes and text lines differ, are converted by the line
+by line engine, so the output is byte-identical to it.
+"""
+import io
+import mmap
+import re
+
+from . import ish
+
+OUTPUT_BUFFER_SIZE = 4 * 1024 * 1024  # bytes of rows buffered before writing them
+
+ADD_ID = ish.ADD_ID.encode()
+ADD_END_IDS = tuple(code.encode() for code in ish.add_end_ids)
+ELEMENT_LENGTH = dict((code.encode(), length) for code, length in ish.element_length.items())
+ELEMENT_RE = re.compile(ish.element_re.pattern.encode())
+
+MW_NAMES = tuple(name.encode() for name in ish.MW_NAMES)
+AW_NAMES = tuple(name.encode() for name in ish.AW_NAMES)
+AA_NAMES = tuple(name.encode() for name in ish.AA_NAMES)
+
+SKY_COVER = {0: b"CLR", 1: b"SCT", 2: b"SCT", 3: b"SCT", 4: b"SCT", 5: b"BKN", 6: b"BKN", 7: b"BKN", 8: b"OVC",
+             9: b"OBS", 10: b"POB"}
+
+
+def to_bytes(table):
+    return dict((key.encode(), value.encode()) for key, value in table.items())
+
+
+SPEED_TABLE = to_bytes(ish.SPEED_TABLE)
+TEMPERATURE_TABLE = to_bytes(ish.TEMPERATURE_TABLE)
+PRESSURE_TABLE = to_bytes(ish.PRESSURE_TABLE)
+ALTIMETER_TABLE = to_bytes(ish.ALTIMETER_TABLE)
+PRECIPITATION_TABLE = to_bytes(ish.PRECIPITATION_TABLE)
+SNOW_DEPTH_TABLE = to_bytes(ish.SNOW_DEPTH_TABLE)
+
+# visibilities have few distinct values, each one is converted once
+_visibility = dict()
+
+
+def convert_file(input_filename, fout, start=0, end=None):
+    """
+    Converts the lines of a file between byte offsets start and end (both at
+    line boundaries, end of file if None) into ish rows written to the binary
+    file fout. The header is not written.
+    """
+    with open(input_filename, "rb") as fin:
+        fin.seek(0, io.SEEK_END)
+        if fin.tell() == 0:
+            return
+        with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            convert_buffer(data, fout, start, len(data) if end is None else end)
+
+
+def convert_buffer(data, fout, start, end):
+    data.seek(start)
+    readline = data.readline
+    out = bytearray()
+    position = start
+    while position < end:
+        line = readline()
+        position += len(line)
+        out += convert_line(line)
+        if len(out) >= OUTPUT_BUFFER_SIZE:
+            fout.write(out)
+            del out[:]
+    fout.write(out)
+
+
+def convert_lines(lines, fout):
+    """
+    Same as :func:`pynoaa.ish.convert_lines`, for text lines and output, e.g.
+    when streaming. Files are better converted with :func:`convert_file`.
+    """
+    for line in lines:
+        fout.write(convert_line(line.encode()).decode())
+
+
+def convert_line(line):
+    if not line.isascii() or b"\r" in line:
+        # read as text, the line may be several ones and its characters are not its bytes
+        return "".join(ish.format_line(text, ish.format_control_data(ish.get_control_data_section(text)),
+                                       ish.get_mandatory_data_section(text))
+                       for text in io.StringIO(line.decode(), newline=None)).encode()
+
+    wban = line[10:15]
+    index = tokenize(line)
+    pcp = [b"*****", b" ", b"*****", b" ", b"*****", b" ", b"*****", b" "]
+    for name in AA_NAMES:
+        get_aax(line, index, name, pcp)
+    return b"".join([line[4:10], b" ", b"*****" if wban == b"99999" else wban, b" ", line[15:27], b" ",
+                     b" ".join(get_fields(line, index)), b" ", b"".join(pcp), get_aj1(line, index), b"\n"])
+
+
+def get_fields(line, index):
+    """
+    Returns the fields of a row from dir to min, the ones of the mandatory
+    data section converted as in :func:`pynoaa.ish.get_mandatory_data_section`.
+    """
+    mds_dir = line[60:63]
+    if mds_dir == b"999":
+        mds_dir = b"***"
+
+    spd = line[65:69]
+    if spd == b"9999":
+        spd = b"***"
+    else:
+        spd = SPEED_TABLE.get(spd) or ish.convert_speed(spd.decode()).encode()
+
+    clg = line[70:75]
+    if clg == b"99999":
+        clg = b"***"
+    elif not clg.isdigit():
+        clg = ish.format_blank(int((float(clg.decode()) * 3.281) / 100.0 + 0.5), 3).encode()
+
+    vsb = line[78:84]
+    vsb = b"****" if vsb == b"999999" else get_visibility(vsb)
+
+    slp = line[99:104]
+    if slp == b"99999":
+        slp = b"******"
+    else:
+        slp = PRESSURE_TABLE.get(slp) or ish.convert_pressure(slp.decode()).encode()
+
+    mw = sorted([get_xw(line, index, name) for name in MW_NAMES], reverse=True)
+    aw = sorted([get_xw(line, index, name) for name in AW_NAMES], reverse=True)
+
+    return [mds_dir, spd, get_oc1(line, index), clg] + get_gf1(line, index) + [vsb] + mw + aw + \
+        [get_ay1(line, index), get_temperature(line, 87), get_temperature(line, 93), slp] + \
+        get_ma1(line, index) + get_ka1(line, index)
+
+
+def get_visibility(vsb):
+    value = _visibility.get(vsb)
+    if value is None:
+        value = float(vsb.decode()) * 0.000625
+        if value > 99.9:
+            value = 99.9
+        if value > 10.058125:
+            value = 10.0
+        value = _visibility[vsb] = "{:>4}".format(round(value, 1)).encode()
+    return value
+
+
+def get_temperature(line, start):
+    # sign and value of a temperature of the mandatory data section
+    if line[start + 1:start + 5] == b"9999":
+        return b"****"
+    signed = line[start:start + 5]
+    return TEMPERATURE_TABLE.get(signed) or ish.convert_temperature(signed[:1].decode(), signed[1:].decode()).encode()
+
+
+def tokenize(line):
+    """
+    Same as :func:`pynoaa.ish.tokenize`, for bytes lines.
+    """
+    index = dict()
+    if line[ish.ADD_IDX:ish.ADD_IDX + 3] != ADD_ID:
+        return index
+
+    idx = ish.ADD_IDX + 3
+    end = len(line)
+    while idx < end:
+        code = line[idx:idx + 3]
+        length = ELEMENT_LENGTH.get(code)
+        if length is None:
+            if code in ADD_END_IDS:
+                break
+            match = ELEMENT_RE.search(line, idx + 1)
+            if match is None:
+                break
+            idx = match.start()
+        else:
+            index.setdefault(code, idx)
+            idx += length
+    return index
+
+
+def get_oc1(line, index):
+    idx = index.get(b"OC1")
+    if idx is not None:
+        gus = line[idx + 3:idx + 7]
+        if gus != b"9999" and gus.isdigit():
+            return SPEED_TABLE.get(gus) or ish.convert_speed(gus.decode()).encode()
+    return b"***"
+
+
+def get_gf1(line, index):
+    idx = index.get(b"GF1")
+    if idx is None:
+        return [b"***", b"*", b"*", b"*"]
+    skc, low, med, hi = line[idx + 3:idx + 5], line[idx + 11:idx + 13], line[idx + 20:idx + 22], line[idx + 23:idx + 25]
+
+    if skc == b"99":
+        skc = b"**"
+    elif skc.isdigit():
+        skc = SKY_COVER.get(int(skc), skc)
+    else:
+        skc = b"**"
+
+    return [skc, b"*" if low == b"99" else low[1:2], b"*" if med == b"99" else med[1:2],
+            b"*" if hi == b"99" else hi[1:2]]
+
+
+def get_xw(line, index, name):
+    idx = index.get(name)
+    if idx is None:
+        return b"**"
+    return line[idx + 3:idx + 5]
+
+
+def get_ay1(line, index):
+    idx = index.get(b"AY1")
+    if idx is None:
+        return b"*"
+    return line[idx + 3:idx + 4]
+
+
+def get_ma1(line, index):
+    idx = index.get(b"MA1")
+    if idx is None:
+        return [b"*****", b"******"]
+    alt, stp = line[idx + 3:idx + 8], line[idx + 9:idx + 14]
+
+    if alt != b"99999" and alt.isdigit():
+        alt = ALTIMETER_TABLE.get(alt) or ish.convert_altimeter(alt.decode()).encode()
+    else:
+        alt = b"*****"
+
+    if stp == b"99999":
+        stp = b"******"
+    elif stp.isdigit():
+        stp = PRESSURE_TABLE.get(stp) or ish.convert_pressure(stp.decode()).encode()
+    else:
+        alt = b"******"
+
+    return [alt, stp]
+
+
+def get_ka1(line, index):
+    idx = index.get(b"KA1")
+    if idx is not None:
+        code, temp = line[idx + 6:idx + 7], line[idx + 7:idx + 12]
+
+        if temp != b"+9999" and temp.isdigit():
+            temp = ish.convert_extreme_temperature(temp.decode()).encode()
+            if code == b"N":
+                return [b"***", temp]
+            elif code == b"M":
+                return [temp, b"***"]
+    return [b"***", b"***"]
+
+
+def get_aax(line, index, name, pcp):
+    """
+    Reads a AA1-AA4 section into pcp, a list with the pcp01, pcp06, pcp24 and
+    pcpxx values, each one followed by its trace flag.
+    """
+    idx = index.get(name)
+    if idx is None:
+        return
+    hours, value, trace = line[idx + 3:idx + 5], line[idx + 5:idx + 9], line[idx + 9:idx + 10]
+    if value == b"9999" or not value.isdigit():
+        return
+    value = PRECIPITATION_TABLE.get(value) or ish.convert_precipitation(value.decode()).encode()
+
+    if hours == b"01":
+        pcp[0] = value
+        if trace == b"2":
+            pcp[1] = b"T"
+    elif hours == b"06":
+        pcp[2] = value
+        if trace == b"2":
+            pcp[3] = b"T"
+    elif hours == b"24":
+        pcp[4] = value
+        pcp[5] = b"T"
+    else:
+        pcp[6] = value
+        pcp[7] = b"T"
+
+
+def get_aj1(line, index):
+    idx = index.get(b"AJ1")
+    if idx is not None:
+        sd = line[idx + 3:idx + 7]
+        if sd != b"9999" and sd.isdigit():
+            return SNOW_DEPTH_TABLE.get(sd) or ish.convert_snow_depth(sd.decode()).encode()
+    return b"**"
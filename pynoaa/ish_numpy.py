@@ -0,0 +1,168 @@
+"""
+Batch engine for :func:`pynoaa.ish.convert` built on numpy.
+
+Lines are read in blocks and their first :data:`MANDATORY_LENGTH` characters
+are copied into a fixed-width byte array, so the control and mandatory data
+sections of the whole block are sliced, checked for sentinels and converted
+with array operations. Numeric results are formatted once per distinct value
+with the same expressions used by :func:`pynoaa.ish.get_mandatory_data_section`,
+so the output is byte-identical to the line by line engine. The additional
+data sections are still handled by :func:`pynoaa.ish.format_line`.
+"""
+from itertools import islice
+
+import numpy as np
+
+from .ish import cds_format, mds_format, format_blank, format_line, get_control_data_section, \
+    get_mandatory_data_section, format_control_data
+
+BLOCK_SIZE = 65536     # lines converted per block
+MANDATORY_LENGTH = 105  # length of the control plus the mandatory data sections
+
+_cds = dict(cds_format)
+_mds = dict(mds_format)
+
+
+def convert_lines(lines, fout, block_size=BLOCK_SIZE):
+    """
+    Same as :func:`pynoaa.ish.convert_lines`, but processing the lines in
+    blocks of block_size.
+    """
+    lines = iter(lines)
+    block = list(islice(lines, block_size))
+    while block:
+        control, mandatory = convert_block(block)
+        fout.write("".join(map(format_line, block, control, mandatory)))
+        block = list(islice(lines, block_size))
+
+
+def convert_block(lines):
+    """
+    Computes the control data and the mandatory fields of a block of lines.
+
+    Returns:
+       A list with the formatted control data of each line and a list with a
+       (dir, spd, clg, vsb, temp, dewp, slp) tuple for each line.
+    """
+    n = len(lines)
+    data = np.frombuffer("".join([line[:MANDATORY_LENGTH].ljust(MANDATORY_LENGTH) for line in lines]).encode(
+        "latin-1", errors="replace"), dtype=np.uint8).reshape(n, MANDATORY_LENGTH)
+
+    control = get_control_data(data)
+
+    # lines with non numeric values are left to the line by line parser
+    valid = np.ones(n, dtype=bool)
+
+    dir_ = get_text(data, _mds["dir"])
+    dir_ = np.where(is_sentinel(data, _mds["dir"], b"999"), "***", dir_)
+
+    spd_sentinel = is_sentinel(data, _mds["spd"], b"9999")
+    spd, ok = get_number(data, _mds["spd"])
+    valid &= ok | spd_sentinel
+    spd = format_values(np.trunc((spd / 10.) * 2.237 + 0.5), lambda x: format_blank(int(x), 3))
+    spd = np.where(spd_sentinel, "***", spd)
+
+    clg_sentinel = is_sentinel(data, _mds["clg"], b"99999")
+    _, ok = get_number(data, _mds["clg"])
+    valid &= ok | clg_sentinel
+    clg = np.where(clg_sentinel, "***", get_text(data, _mds["clg"]))
+
+    vsb_sentinel = is_sentinel(data, _mds["vsb"], b"999999")
+    vsb, ok = get_number(data, _mds["vsb"])
+    valid &= ok | vsb_sentinel
+    vsb = vsb * 0.000625
+    vsb = np.where(vsb > 99.9, 99.9, vsb)
+    vsb = np.where(vsb > 10.058125, 10.0, vsb)
+    vsb = format_values(vsb, lambda x: "{:>4}".format(round(x, 1)))
+    vsb = np.where(vsb_sentinel, "****", vsb)
+
+    temp, ok = get_temperature(data, _mds["temp_sign"], _mds["temp"])
+    valid &= ok
+    dewp, ok = get_temperature(data, _mds["dewp_sign"], _mds["dewp"])
+    valid &= ok
+
+    slp_sentinel = is_sentinel(data, _mds["slp"], b"99999")
+    slp, ok = get_number(data, _mds["slp"])
+    valid &= ok | slp_sentinel
+    slp = format_values(slp, lambda x: "{:>6}".format(round(x / 10.0, 1)))
+    slp = np.where(slp_sentinel, "******", slp)
+
+    mandatory = list(zip(dir_.tolist(), spd.tolist(), clg.tolist(), vsb.tolist(), temp.tolist(), dewp.tolist(),
+                         slp.tolist()))
+
+    for i in np.flatnonzero(~valid).tolist():
+        control[i] = format_control_data(get_control_data_section(lines[i]))
+        mandatory[i] = get_mandatory_data_section(lines[i])
+
+    return control, mandatory
+
+
+def get_control_data(data):
+    """
+    Builds the "USAF WBAN YYYYMMDDHHMM " prefix of each row as a fixed-width
+    byte array.
+    """
+    id_start, id_end = _cds["id"]
+    wban_start, wban_end = _cds["wban"]
+    date_start, date_end = _cds["year"][0], _cds["minute"][1]
+
+    id_len = id_end - id_start
+    wban_len = wban_end - wban_start
+    date_len = date_end - date_start
+    width = id_len + wban_len + date_len + 3
+
+    out = np.full((data.shape[0], width), ord(" "), dtype=np.uint8)
+    out[:, :id_len] = data[:, id_start:id_end]
+    out[:, id_len + 1:id_len + 1 + wban_len] = np.where(
+        is_sentinel(data, _cds["wban"], b"99999")[:, None], ord("*"), data[:, wban_start:wban_end])
+    out[:, id_len + wban_len + 2:width - 1] = data[:, date_start:date_end]
+
+    return out.view("S{0}".format(width)).ravel().astype("U{0}".format(width)).tolist()
+
+
+def get_text(data, position):
+    start, end = position
+    return np.ascontiguousarray(data[:, start:end]).view("S{0}".format(end - start)).ravel().astype(
+        "U{0}".format(end - start))
+
+
+def is_sentinel(data, position, sentinel):
+    start, end = position
+    return (data[:, start:end] == np.frombuffer(sentinel, dtype=np.uint8)).all(axis=1)
+
+
+def get_number(data, position):
+    """
+    Parses a fixed-width unsigned decimal field.
+
+    Returns:
+       A float array with the values and a mask of the rows made only of
+       digits.
+    """
+    start, end = position
+    digits = data[:, start:end].astype(np.int64) - ord("0")
+    ok = ((digits >= 0) & (digits <= 9)).all(axis=1)
+    weights = 10 ** np.arange(end - start - 1, -1, -1, dtype=np.int64)
+    return (np.where(ok[:, None], digits, 0) @ weights).astype(np.float64), ok
+
+
+def get_temperature(data, sign_position, position):
+    """
+    Converts a signed temperature in tenths of Celsius degrees to formatted
+    Fahrenheit degrees, as done by
+    :func:`pynoaa.ish.get_mandatory_data_section`.
+    """
+    sentinel = is_sentinel(data, position, b"9999")
+    temp, ok = get_number(data, position)
+    temp = np.where(data[:, sign_position[0]] == ord("-"), -temp, temp)
+    temp = np.where(temp < -178, np.trunc((temp / 10.) * 1.8 + 32. - 0.5), np.trunc((temp / 10.) * 1.8 + 32. + 0.5))
+    temp = format_values(temp, lambda x: format_blank(int(x), 4))
+    return np.where(sentinel, "****", temp), ok | sentinel
+
+
+def format_values(values, formatter):
+    """
+    Formats an array of numbers calling formatter only once per distinct value.
+    """
+    unique, inverse = np.unique(values, return_inverse=True)
+    return np.array([formatter(value) for value in unique.tolist()])[inverse.ravel()]
@@ -1,7 +1,7 @@
 from datetime import date
 import argparse
 
-from data import get_interval, get_year
+from data import COMPRESSION_BLOCK_SIZE, COMPRESSION_LEVEL, DECOMPRESS_WORKERS, get_interval, get_year
 
 
 def main():
@@ -13,6 +13,31 @@ def main():
     parser.add_argument('-y', '--year', nargs='?', type=int, default=None, help='get dataset for single year.')
     parser.add_argument('-f', '--fromyear', nargs='?', type=int, default=init_year, help='initial year of the dataset.')
     parser.add_argument('-t', '--toyear', nargs='?', type=int, default=end_year, help='last year of the dataset.')
+    parser.add_argument('-s', '--stream', action='store_true',
+                        help='inflate downloaded files straight into the output, without a decompressed copy.')
+    parser.add_argument('-e', '--engine', choices=['python', 'numpy', 'bytes'], default='python',
+                        help='ish conversion engine, numpy converts lines in blocks, bytes memory maps the input.')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='processes used to convert each year to ish, 0 for one per cpu.')
+    parser.add_argument('--no-catalog', dest='catalog', action='store_false',
+                        help='always list the remote directories instead of using the local catalog.')
+    parser.add_argument('-c', '--columnar', action='store_true',
+                        help='also write numpy column files of each year, which can be memory mapped.')
+    parser.add_argument('-z', '--compression', choices=['gzip', 'bz2'], default=None,
+                        help='compress the merged and ish files.')
+    parser.add_argument('--fields', type=lambda text: text.split(','), default=None,
+                        help='comma separated columns of the ish file, e.g. usaf,wban,date,temp (all by default).')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='update the outputs of a previous run with the records appended since, '
+                             'e.g. for the current year.')
+    parser.add_argument('-r', '--report', default=None,
+                        help='save the metrics of the run (bytes, rates and time of each stage) to this JSON file.')
+    parser.add_argument('-d', '--decompress-workers', type=int, default=DECOMPRESS_WORKERS or 0,
+                        help='threads decompressing the station files of each year, 0 for one per cpu.')
+    parser.add_argument('-l', '--level', type=int, choices=range(1, 10), default=COMPRESSION_LEVEL, metavar='1-9',
+                        help='compression level, from 1 (fastest) to 9 (smallest).')
+    parser.add_argument('-b', '--block-size', type=int, default=COMPRESSION_BLOCK_SIZE // (1024 * 1024),
+                        help='megabytes of data in each independently compressed block, e.g. 128 for hadoop.')
 
     args = parser.parse_args()
 
@@ -26,10 +51,16 @@ def main():
             init_year = args.fromyear
 
         print("Starting retrieving data for interval: ({0}, {1})".format(init_year, end_year))
-        get_interval(init_year, end_year)
+        get_interval(init_year, end_year, stream=args.stream, engine=args.engine, workers=args.workers or None,
+                     catalog=args.catalog, columnar=args.columnar, compression=args.compression, level=args.level,
+                     block_size=args.block_size * 1024 * 1024, decompress_workers=args.decompress_workers or None,
+                     report=args.report, fields=args.fields, incremental=args.incremental)
     else:
         print("Starting retrieving data for year: {0}".format(args.year))
-        get_year(args.year)
+        get_year(args.year, stream=args.stream, engine=args.engine, workers=args.workers or None, catalog=args.catalog,
+                 columnar=args.columnar, compression=args.compression, level=args.level,
+                 block_size=args.block_size * 1024 * 1024, decompress_workers=args.decompress_workers or None,
+                 report=args.report, fields=args.fields, incremental=args.incremental)
 
 
 if __name__ == "__main__":
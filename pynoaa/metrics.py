@@ -0,0 +1,176 @@
+"""
+Metrics and progress events of a run.
+
+A :class:`Metrics` object is shared by the years of a run. Each year counts
+bytes, files, lines and retries and times its stages in it, and progress
+callbacks are called as files are downloaded and stages start and finish.
+At the end, :func:`Metrics.report` summarizes everything, with the throughput
+of each stage, e.g. for telling if a slow run is bound by the network, the
+disk or the conversion.
+
+When no metrics are requested the years use :data:`NULL_METRICS`, whose
+methods do nothing, so disabled metrics cost a method call per event.
+"""
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# counter used as the amount of work of each stage, for its throughput in the report
+STAGE_THROUGHPUT = dict(download=("bytes_downloaded", "MB/s"), decompress=("bytes_decompressed", "MB/s"),
+                        merge=("bytes_merged", "MB/s"), ish=("lines_ish", "lines/s"),
+                        columnar=("lines_columnar", "lines/s"), compress=("bytes_compressed", "MB/s"),
+                        incremental=("bytes_merged", "MB/s"))
+
+
+class Metrics(object):
+    """Thread-safe counters and stage timers of the years of a run.
+
+    Progress callbacks are called with an event name and a dict of details:
+
+    - "download": a block of a file was downloaded, with the year, the file,
+      the bytes downloaded so far and its size (None if unknown).
+    - "stage_start" and "stage_end": with the year, the stage and, for the
+      end, its seconds.
+
+    Callbacks run in the threads doing the work, so they must be quick.
+    """
+
+    enabled = True
+
+    def __init__(self, callbacks=None):
+        """
+        Args:
+           callbacks (list): callables receiving the progress events.
+        """
+        self.callbacks = list(callbacks or ())
+        self.lock = threading.Lock()
+        self.years = dict()
+        self.start_time = time.time()
+
+    def get_year(self, year):
+        # called with the lock held
+        return self.years.setdefault(year, dict(counters=dict(), stages=dict()))
+
+    def add(self, year, name, value=1):
+        """
+        Adds value to a counter of a year.
+        """
+        with self.lock:
+            counters = self.get_year(year)["counters"]
+            counters[name] = counters.get(name, 0) + value
+
+    @contextmanager
+    def stage(self, year, name):
+        """
+        Times a stage of a year, as a context manager. The seconds of the
+        stages run more than once (e.g. retried downloads) are added up.
+        """
+        self.progress("stage_start", year=year, stage=name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self.lock:
+                stages = self.get_year(year)["stages"]
+                stages[name] = stages.get(name, 0.0) + seconds
+            self.progress("stage_end", year=year, stage=name, seconds=seconds)
+
+    def progress(self, event, **info):
+        for callback in self.callbacks:
+            try:
+                callback(event, info)
+            except Exception as err:
+                logger.warning("Progress callback failed: {0}".format(err))
+
+    def download_callback(self, year, file, size=None):
+        """
+        Returns a callback for the blocks of a file being downloaded, which
+        counts its bytes and sends "download" progress events.
+        """
+        downloaded = [0]
+
+        def callback(block):
+            downloaded[0] += len(block)
+            self.add(year, "bytes_downloaded", len(block))
+            self.progress("download", year=year, file=file, bytes=downloaded[0], size=size)
+        return callback
+
+    def report(self):
+        """
+        Summarizes the run.
+
+        Returns:
+           A dict with the wall time of the run and, for each year, its
+           counters and the seconds and throughput of each stage.
+        """
+        with self.lock:
+            years = dict()
+            for year, values in sorted(self.years.items()):
+                stages = dict()
+                for name, seconds in values["stages"].items():
+                    stages[name] = dict(seconds=seconds)
+                    counter, unit = STAGE_THROUGHPUT.get(name, (None, None))
+                    if counter in values["counters"] and seconds > 0:
+                        amount = values["counters"][counter]
+                        stages[name][unit] = (amount / 1e6 if unit == "MB/s" else amount) / seconds
+                years[str(year)] = dict(counters=dict(values["counters"]), stages=stages)
+        return dict(start=self.start_time, seconds=time.time() - self.start_time, years=years)
+
+    def save_report(self, filename):
+        """
+        Saves :func:`report` as JSON, through a temporary file.
+        """
+        with open(filename + ".tmp", "w") as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+        os.replace(filename + ".tmp", filename)
+
+
+def timed(name):
+    """
+    Decorator timing a method as a stage, in the metrics attribute of its
+    object and for its year attribute.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.stage(self.year, name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class NullMetrics(Metrics):
+    """Metrics that record nothing, used when metrics are disabled."""
+
+    enabled = False
+
+    def add(self, year, name, value=1):
+        pass
+
+    def stage(self, year, name):
+        return _null_stage
+
+    def progress(self, event, **info):
+        pass
+
+    def download_callback(self, year, file, size=None):
+        return None
+
+
+class _NullStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_null_stage = _NullStage()
+NULL_METRICS = NullMetrics()
@@ -0,0 +1,251 @@
+import logging
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+DOWNLOAD_JOBS = 2         # years listing and downloading files at the same time (they share the ftp connections)
+PROCESS_JOBS = 2          # years being decompressed and merged at the same time
+CONVERT_JOBS = 2          # years being converted to ish at the same time
+CONVERT_PROCESSES = None  # processes shared by all ish conversions (None for one per cpu)
+STAGE_QUEUE_SIZE = 1      # years waiting for each stage before the previous one blocks
+
+# states of a job besides the name of the stage it is in, see Pipeline.status
+PENDING = "pending"
+QUEUED = "queued"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+logger = logging.getLogger(__name__)
+
+
+class Stage(object):
+    """A pipeline stage: a bounded queue of years served by a fixed number of
+    threads.
+
+    Each year taken from the queue is passed to target, and the year returned
+    by it, if any, is put in the queue of the next stage. Putting a year in a
+    full queue blocks, so a slow stage holds back the previous ones instead of
+    piling up finished work. A year whose target fails is logged and dropped.
+    """
+
+    def __init__(self, name, target, num_jobs, queue_size=STAGE_QUEUE_SIZE, next_stage=None):
+        """
+        Args:
+           name (str): name of the stage, used for its threads.
+           target (callable): called with each year.
+           num_jobs (int): number of threads serving the stage.
+           queue_size (int): maximum number of years waiting in the queue.
+           next_stage (Stage): stage receiving the years returned by target.
+        """
+        self.name = name
+        self.target = target
+        self.num_jobs = num_jobs
+        self.next_stage = next_stage
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.threads = list()
+
+    def start(self):
+        for i in range(self.num_jobs):
+            thread = threading.Thread(target=self.serve, name="{0}:{1}".format(self.name, i), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def put(self, year):
+        self.queue.put(year)
+
+    def close(self):
+        """
+        Waits for the queued years to be served and stops the threads.
+        """
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = list()
+
+    def serve(self):
+        while True:
+            year = self.queue.get()
+            if year is None:
+                break
+            try:
+                result = self.target(year)
+            except Exception as err:
+                logger.error("Year {0} failed in {1} stage: {2}".format(year.year, self.name, err))
+                continue
+            if result is not None and self.next_stage is not None:
+                self.next_stage.put(result)
+
+
+class Job(object):
+    """A year scheduled in a :class:`Pipeline`."""
+
+    def __init__(self, year, size=None):
+        """
+        Args:
+           year (YearData): the year.
+           size (int): estimated bytes to download, None if unknown.
+        """
+        self.year = year
+        self.size = size
+        self.state = PENDING
+        self.cancelled = threading.Event()
+
+    @property
+    def priority(self):
+        # largest years first, then years of unknown size from the most recent one, which are the largest
+        return -(self.size or 0), -self.year.year
+
+
+class Pipeline(object):
+    """Processes years in three stages, each one with its own concurrency
+    limit, so the network and the cpus are kept busy at the same time:
+
+    1. download: :func:`pynoaa.data.YearData.fetch`, I/O bound.
+    2. process: :func:`pynoaa.data.YearData.process`, decompressing and
+       merging the files, or :func:`pynoaa.data.YearData.update_incremental`
+       for incremental years, which also updates their ish output.
+    3. convert: :func:`pynoaa.data.YearData.convert_ish` and
+       :func:`pynoaa.data.YearData.convert_columnar`, cpu bound, in a process
+       pool shared by all years, and then
+       :func:`pynoaa.data.YearData.compress_outputs`.
+
+    While a year is being converted, the next ones are already downloading.
+    Years are scheduled by their estimated size, largest first, so the
+    largest years do not end up running alone at the end. Years can be
+    cancelled and the state of each one is shown by :func:`status` while the
+    pipeline runs.
+    """
+
+    def __init__(self, download_jobs=DOWNLOAD_JOBS, process_jobs=PROCESS_JOBS, convert_jobs=CONVERT_JOBS,
+                 convert_processes=CONVERT_PROCESSES, queue_size=STAGE_QUEUE_SIZE):
+        """
+        Args:
+           download_jobs (int): years downloading at the same time.
+           process_jobs (int): years being merged at the same time.
+           convert_jobs (int): years being converted at the same time.
+           convert_processes (int): size of the conversion process pool, None
+              for one per cpu.
+           queue_size (int): maximum number of years waiting for each stage.
+        """
+        self.download_jobs = download_jobs
+        self.process_jobs = process_jobs
+        self.convert_jobs = convert_jobs
+        self.convert_processes = convert_processes
+        self.queue_size = queue_size
+        self.jobs = dict()
+        self.lock = threading.Lock()
+
+    def run(self, years):
+        """
+        Runs the given years, which must have a started download manager,
+        through the pipeline and waits for all of them to finish. Years enter
+        the download stage as it has room for them, largest first according
+        to :func:`pynoaa.data.YearData.estimate_size`.
+
+        Args:
+           years (iterable): :class:`pynoaa.data.YearData` objects.
+        """
+        jobs = sorted((Job(year, year.estimate_size()) for year in years), key=lambda job: job.priority)
+        with self.lock:
+            self.jobs.update((job.year.year, job) for job in jobs)
+        with ProcessPoolExecutor(max_workers=self.convert_processes) as executor:
+            convert = Stage("convert", self.track("convert", lambda year: convert_year(year, executor)),
+                            self.convert_jobs, self.queue_size)
+            process = Stage("process", self.track("process", process_year), self.process_jobs, self.queue_size,
+                            next_stage=convert)
+            download = Stage("download", self.track("download", download_year), self.download_jobs,
+                             self.queue_size, next_stage=process)
+            stages = [download, process, convert]
+            for stage in stages:
+                stage.start()
+            try:
+                for job in jobs:
+                    if job.cancelled.is_set():
+                        job.state = CANCELLED
+                    else:
+                        download.put(job.year)
+            finally:
+                for stage in stages:
+                    stage.close()
+
+    def track(self, name, target):
+        """
+        Wraps the target of a stage, keeping the state of the jobs and
+        dropping the cancelled ones before they enter the stage.
+        """
+        def run(year):
+            job = self.jobs[year.year]
+            if job.cancelled.is_set():
+                logger.info("Year {0} cancelled before {1} stage".format(year.year, name))
+                job.state = CANCELLED
+                return None
+            job.state = name
+            try:
+                result = target(year)
+            except Exception:
+                job.state = FAILED
+                raise
+            job.state = DONE if result is None else QUEUED
+            return result
+        return run
+
+    def cancel(self, year):
+        """
+        Cancels a year. A year waiting for a stage is dropped, and a year in
+        a stage is dropped once the stage finishes, so its outputs are never
+        left half written.
+
+        Args:
+           year (int): the year.
+
+        Returns:
+           True if the year will be cancelled, False if it is not scheduled
+           or it has already finished.
+        """
+        with self.lock:
+            job = self.jobs.get(year)
+        if job is None or job.state in (DONE, FAILED, CANCELLED):
+            return False
+        job.cancelled.set()
+        return True
+
+    def status(self):
+        """
+        Returns the state of the scheduled years.
+
+        Returns:
+           A list with a dict for each year, in the order they are scheduled,
+           with the year, its estimated size in bytes (None if unknown), its
+           state (pending, queued, done, failed, cancelled or the name of the
+           stage it is in) and whether it has been cancelled.
+        """
+        with self.lock:
+            jobs = sorted(self.jobs.values(), key=lambda job: job.priority)
+        return [dict(year=job.year.year, size=job.size, state=job.state, cancelled=job.cancelled.is_set())
+                for job in jobs]
+
+
+def download_year(year):
+    year.fetch()
+    return year
+
+
+def process_year(year):
+    # an incremental update also brings the ish output up to date, the other ones are left to the convert stage
+    if not (year.incremental and year.update_incremental()):
+        # the ish output is left to the convert stage, so it runs in the process pool
+        year.process(inline_ish=False)
+    if year.ish or year.columnar or year.compression:
+        return year
+
+
+def convert_year(year, executor):
+    if year.ish and not year.ish_updated:
+        year.convert_ish(executor=executor)
+    if year.columnar:
+        year.convert_columnar(executor=executor)
+    if year.compression:
+        year.compress_outputs()
@@ -0,0 +1,74 @@
+"""
+Parsing of raw records into dicts of fields, with the same values as the ish
+output (and also the max and min values, which it always leaves missing),
+built on the columns and section getters of the ish projections, see
+:func:`pynoaa.ish.compile_projection`.
+
+Only the sections holding the requested fields are parsed, so asking for a
+few fields of the mandatory data section is much cheaper than a full ish
+conversion.
+"""
+from . import ish
+
+FIELD_NAMES = list(ish.OUTPUT_FIELDS)
+
+# fields kept as text, the others are numbers
+TEXT_FIELDS = ("usaf", "wban", "date", "skc", "low", "med", "hi", "w")
+# fields with the weather codes of a row, parsed as lists
+CODE_FIELDS = ("mw", "aw")
+# fields whose column ends with a trace flag
+TRACE_FIELDS = ("pcp01", "pcp06", "pcp24", "pcpxx")
+
+# the getters of the ish columns, except for KA1, whose signed temperatures the ish output leaves missing
+SECTIONS = dict(ish.output_sections, ka1=ish.get_extreme_temperatures)
+
+
+class RecordParser(object):
+    """Parses raw lines into dicts with the requested fields.
+
+    Missing values (``*`` in the ish output) are None, numeric fields are
+    floats, and mw and aw are lists of weather codes, in the order of the
+    ish output.
+    """
+
+    def __init__(self, fields=None):
+        """
+        Args:
+           fields (list): names of the fields, see :data:`FIELD_NAMES`. All of
+              them if None.
+
+        Raises:
+           ValueError if a field is unknown.
+        """
+        self.fields = list(fields or FIELD_NAMES)
+        unknown = [name for name in self.fields if name not in ish.OUTPUT_COLUMNS]
+        if unknown:
+            raise ValueError("Unknown fields: {0}".format(", ".join(unknown)))
+        self.sections = sorted(set(ish.OUTPUT_COLUMNS[name][1] for name in self.fields))
+        self.tokenize = any(section in ish.ADDITIONAL_SECTIONS for section in self.sections)
+        self.cache = dict()
+
+    def parse(self, line):
+        index = ish.tokenize(line) if self.tokenize else None
+        values = dict((section, SECTIONS[section](line, index)) for section in self.sections)
+        record = dict()
+        for name in self.fields:
+            _, section, position = ish.OUTPUT_COLUMNS[name]
+            record[name] = self.to_value(name, values[section][position])
+        return record
+
+    def to_value(self, name, value):
+        if name in CODE_FIELDS:
+            return [code for code in value.split() if code != "**"]
+        if name in TEXT_FIELDS:
+            text = value.strip()
+            return text if text.strip("*") else None
+        if name in TRACE_FIELDS:
+            value = value[:-1]
+        # numeric values have few distinct formatted values, each one is converted once
+        if value not in self.cache:
+            try:
+                self.cache[value] = float(value)
+            except ValueError:
+                self.cache[value] = None
+        return self.cache[value]
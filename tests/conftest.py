@@ -0,0 +1,38 @@
+import os
+
+import pytest
+
+from benchmarks.ftpserver import FTPServer
+from benchmarks.synthetic import build_tree
+from pynoaa import data
+
+YEARS = [1990, 1991]
+NUM_STATIONS = 4
+LINES_PER_STATION = 200
+
+
+def set_local_dirs(monkeypatch, work_dir):
+    """
+    Points the local data directories of pynoaa to work_dir.
+    """
+    local_data = os.path.join(work_dir, "data")
+    monkeypatch.setattr(data, "LOCAL_DATA", local_data)
+    monkeypatch.setattr(data, "LOCAL_DATA_RAW_DIR", os.path.join(local_data, "raw"))
+    monkeypatch.setattr(data, "LOCAL_DATA_DECOMPRESS", os.path.join(local_data, "decompress"))
+    monkeypatch.setattr(data, "LOCAL_DATA_MANIFEST", os.path.join(local_data, "manifest"))
+    monkeypatch.setattr(data, "LOCAL_DATA_CATALOG", os.path.join(local_data, "catalog.sqlite"))
+
+
+@pytest.fixture
+def ftp_root(tmp_path):
+    root = str(tmp_path / "ftp")
+    build_tree(root, YEARS, NUM_STATIONS, LINES_PER_STATION)
+    return root
+
+
+@pytest.fixture
+def ftp_server(ftp_root, monkeypatch):
+    with FTPServer(ftp_root) as server:
+        monkeypatch.setattr(data, "SERVER_URL", "127.0.0.1")
+        monkeypatch.setattr(data, "SERVER_PORT", server.port)
+        yield server
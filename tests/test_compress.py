@@ -0,0 +1,58 @@
+import gzip
+import os
+import zlib
+
+import pytest
+
+from pynoaa import data
+from pynoaa.compress import compress_file, decompress_file, load_block_index
+
+from .conftest import set_local_dirs
+
+
+@pytest.mark.parametrize("compression", ["gzip", "bz2"])
+def test_compressed_outputs_are_readable(tmp_path, ftp_server, monkeypatch, compression):
+    set_local_dirs(monkeypatch, str(tmp_path))
+    plain_dir, compressed_dir = str(tmp_path / "plain"), str(tmp_path / "compressed")
+    data.get_year(1990, plain_dir, catalog=False)
+    data.get_year(1990, compressed_dir, catalog=False, compression=compression, level=1, block_size=16 * 1024)
+
+    merged = data.get_output_filename(1990, compressed_dir)
+    extension = ".gz" if compression == "gzip" else ".bz2"
+    assert not os.path.exists(merged) and os.path.exists(merged + extension)
+    assert len(load_block_index(merged + extension)["blocks"]) > 1
+
+    raw_dir = os.path.join(data.LOCAL_DATA_RAW_DIR, "1990")
+    for file in sorted(os.listdir(raw_dir)):
+        station = data.station_id(file)
+        with gzip.open(os.path.join(raw_dir, file), "rt") as f:
+            assert data.get_station(1990, station, compressed_dir) == f.readlines()
+        assert data.get_station(1990, station, compressed_dir, ish=True) == \
+            data.get_station(1990, station, plain_dir, ish=True)
+
+    fields, group_by = ["temp", "max", "min"], ("station", "month")
+    result = data.aggregate_interval(1990, 1990, fields, group_by, compressed_dir, workers=2)
+    expected = data.aggregate_interval(1990, 1990, fields, group_by, plain_dir, workers=2)
+    assert result.keys() == expected.keys()
+    for group, stats in expected.items():
+        assert result[group].keys() == stats.keys()
+        for name, field_stats in stats.items():
+            # the partial sums are added in the order the tasks finish
+            assert result[group][name] == pytest.approx(field_stats)
+
+
+def test_failures_leave_no_temporary_files(tmp_path):
+    filename = str(tmp_path / "data")
+    with open(filename, "wb") as f:
+        f.write(b"0" * 100 + b"\n")
+    with pytest.raises(zlib.error):
+        compress_file(filename, filename + ".gz", level=99)
+    assert sorted(os.listdir(str(tmp_path))) == ["data"]
+
+    with gzip.open(filename + ".gz", "wb") as f:
+        f.write(os.urandom(64 * 1024))
+    with open(filename + ".gz", "r+b") as f:
+        f.truncate(os.path.getsize(filename + ".gz") // 2)
+    with pytest.raises(EOFError):
+        decompress_file(filename + ".gz", filename + ".out")
+    assert sorted(os.listdir(str(tmp_path))) == ["data", "data.gz"]
@@ -0,0 +1,54 @@
+import gzip
+import os
+
+import pytest
+
+from pynoaa import data
+from pynoaa.metrics import Metrics
+
+from .conftest import set_local_dirs
+
+
+def test_files_are_decompressed_as_they_are_downloaded(tmp_path, ftp_server, monkeypatch):
+    set_local_dirs(monkeypatch, str(tmp_path))
+    metrics = Metrics()
+    year = data.YearData(1990, out_dir=str(tmp_path / "out"), catalog=False, metrics=metrics)
+    with data.create_downloader() as year.downloader:
+        year.fetch()
+    assert sorted(year.decompressing) == sorted(year.files)
+
+    year.process()
+    assert not year.decompressing and year.decompress_executor is None
+    assert metrics.report()["years"]["1990"]["counters"]["files_decompressed"] == len(year.files)
+    expected = b""
+    for file in sorted(year.files):
+        with gzip.open(os.path.join(year.raw_data_dir, file), "rb") as f:
+            expected += f.read()
+    with open(year.output_file, "rb") as f:
+        assert f.read() == expected
+
+
+def test_streaming_does_not_decompress_to_disk(tmp_path, ftp_server, monkeypatch):
+    set_local_dirs(monkeypatch, str(tmp_path))
+    data.get_year(1990, str(tmp_path / "out"), catalog=False, stream=True)
+    assert os.path.exists(data.get_output_filename(1990, str(tmp_path / "out")))
+    assert not os.path.exists(os.path.join(data.LOCAL_DATA_DECOMPRESS, "1990"))
+
+
+def test_failed_download_stops_decompressing(tmp_path, ftp_server, monkeypatch):
+    set_local_dirs(monkeypatch, str(tmp_path))
+    year = data.YearData(1990, out_dir=str(tmp_path / "out"), catalog=False)
+    list_pending_files = year.get_list_pending_files
+    calls = list()
+
+    def fail_after_download():
+        calls.append(None)
+        if len(calls) > 1:
+            raise ConnectionResetError("listing failed")
+        list_pending_files()
+
+    monkeypatch.setattr(year, "get_list_pending_files", fail_after_download)
+    with data.create_downloader() as year.downloader:
+        with pytest.raises(ConnectionResetError):
+            year.fetch()
+    assert not year.decompressing and year.decompress_executor is None
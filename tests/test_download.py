@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+from ftplib import all_errors
+
+import pytest
+
+from benchmarks.ftpserver import FaultInjection, FTPServer
+from benchmarks.synthetic import NOAA_BASE_DIR
+from pynoaa.download import PARTIAL_SUFFIX, DownloadError, DownloadManager, FTPSession
+
+YEAR_PATH = "/" + NOAA_BASE_DIR + "1990/"
+
+
+class DropFirst(FaultInjection):
+    """Drops the first transfer halfway, and no other one."""
+
+    def drop_point(self, size):
+        with self.lock:
+            self.drops += 1
+            if self.drops > 1:
+                return None
+        return int(size * self.drop_after)
+
+
+@pytest.fixture
+def server(ftp_root):
+    with FTPServer(ftp_root, faults=DropFirst(), block_size=1024) as server:
+        yield server
+
+
+@pytest.fixture
+def session(server):
+    session = FTPSession("127.0.0.1", server.port, "anonymous", "")
+    yield session
+    session.close()
+
+
+def get_remote(session, ftp_root):
+    session.connect()
+    filename, metadata = sorted(session.list_files(YEAR_PATH).items())[0]
+    with open(os.path.join(ftp_root, YEAR_PATH.strip("/"), filename), "rb") as f:
+        return filename, metadata, f.read()
+
+
+def test_dropped_transfer_resumes(tmp_path, ftp_root, server, session):
+    filename, metadata, content = get_remote(session, ftp_root)
+    local_file = str(tmp_path / filename)
+
+    with pytest.raises(all_errors):
+        session.retrieve(YEAR_PATH, filename, local_file, metadata)
+    session.close()
+    partial_size = os.path.getsize(local_file)
+    assert 0 < partial_size < len(content)
+    assert os.path.exists(local_file + PARTIAL_SUFFIX)
+
+    session.connect()
+    session.retrieve(YEAR_PATH, filename, local_file, metadata)
+    # only the missing bytes were sent again
+    assert server.bytes_sent == len(content) - partial_size
+    with open(local_file, "rb") as f:
+        assert f.read() == content
+    assert not os.path.exists(local_file + PARTIAL_SUFFIX)
+
+
+def test_manager_retries_dropped_transfer(tmp_path, ftp_root, server, session):
+    filename, metadata, content = get_remote(session, ftp_root)
+    local_file = str(tmp_path / filename)
+    with DownloadManager("127.0.0.1", server.port, "anonymous", "") as manager:
+        manager.retrieve(YEAR_PATH, filename, local_file, metadata).result()
+    assert server.faults.drops == 2
+    with open(local_file, "rb") as f:
+        assert f.read() == content
+
+
+@pytest.mark.parametrize("bad_size, checksum", [(True, None), (False, ("md5", "0" * 32))])
+def test_mismatch_removes_file(tmp_path, ftp_root, server, session, bad_size, checksum):
+    server.faults = None
+    filename, metadata, content = get_remote(session, ftp_root)
+    if bad_size:
+        metadata = dict(metadata, size=str(len(content) + 1))
+    local_file = str(tmp_path / filename)
+    with pytest.raises(DownloadError):
+        session.retrieve(YEAR_PATH, filename, local_file, metadata, checksum)
+    assert not os.path.exists(local_file)
+    assert not os.path.exists(local_file + PARTIAL_SUFFIX)
+
+
+def test_checksum_match(tmp_path, ftp_root, server, session):
+    server.faults = None
+    filename, metadata, content = get_remote(session, ftp_root)
+    local_file = str(tmp_path / filename)
+    session.retrieve(YEAR_PATH, filename, local_file, metadata, ("md5", hashlib.md5(content).hexdigest()))
+    with open(local_file, "rb") as f:
+        assert f.read() == content
+
+
+def test_changed_remote_file_restarts(tmp_path, ftp_root, server, session):
+    server.faults = None
+    filename, metadata, content = get_remote(session, ftp_root)
+    local_file = str(tmp_path / filename)
+    # partial download of a previous version of the remote file
+    with open(local_file, "wb") as f:
+        f.write(b"x" * 100)
+    with open(local_file + PARTIAL_SUFFIX, "w") as f:
+        json.dump(dict(size=int(metadata["size"]), modify="19700101000000"), f)
+
+    session.retrieve(YEAR_PATH, filename, local_file, metadata)
+    assert server.bytes_sent == len(content)
+    with open(local_file, "rb") as f:
+        assert f.read() == content
+    assert not os.path.exists(local_file + PARTIAL_SUFFIX)
+
+
+def test_manager_does_not_retry_mismatch(tmp_path, ftp_root, server, session):
+    server.faults = None
+    filename, metadata, content = get_remote(session, ftp_root)
+    local_file = str(tmp_path / filename)
+    with DownloadManager("127.0.0.1", server.port, "anonymous", "") as manager:
+        future = manager.retrieve(YEAR_PATH, filename, local_file, dict(metadata, size=str(len(content) + 1)))
+        with pytest.raises(DownloadError):
+            future.result()
+    # a corrupt download is not a connection error, it is not retried on a new connection
+    assert server.bytes_sent == len(content)
+    assert not os.path.exists(local_file)
+    assert not os.path.exists(local_file + PARTIAL_SUFFIX)
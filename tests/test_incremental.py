@@ -0,0 +1,106 @@
+import filecmp
+import gzip
+import os
+import random
+import time
+
+from benchmarks.synthetic import LineGenerator, NOAA_BASE_DIR, generate_station
+from pynoaa import data
+from pynoaa.index import build_ish_index, load_index, read_station
+from pynoaa.ish import convert
+from pynoaa.metrics import Metrics
+
+from .conftest import LINES_PER_STATION, set_local_dirs
+
+OUTPUTS = ("plain_format/1990", "plain_format/1990.index.json", "ish_format/1990_ish",
+           "ish_format/1990_ish.index.json", "plain_format/1991", "ish_format/1991_ish")
+
+
+def rewrite_station(ftp_root, year, num_lines, seed, keep=True):
+    """
+    Adds records to the first station file of a year, as NOAA does with the
+    files of the current year, or replaces them if keep is False.
+    """
+    year_dir = os.path.join(ftp_root, NOAA_BASE_DIR, str(year))
+    filename = os.path.join(year_dir, sorted(os.listdir(year_dir))[0])
+    usaf, wban = os.path.basename(filename).split("-")[:2]
+    lines = list()
+    if keep:
+        with gzip.open(filename, "rt") as f:
+            lines = f.readlines()
+    lines.extend(generate_station(LineGenerator(random.Random(seed)), year, usaf, wban, num_lines))
+    with gzip.open(filename, "wt") as f:
+        f.writelines(lines)
+    # the listing only has the modification time to the second
+    modify = time.time() + 60
+    os.utime(filename, (modify, modify))
+
+
+def update(work_dir, monkeypatch):
+    set_local_dirs(monkeypatch, work_dir)
+    metrics = Metrics()
+    data.get_interval(1990, 1991, os.path.join(work_dir, "out"), catalog=False, incremental=True, metrics=metrics)
+    report = metrics.report()["years"]["1990"]
+    assert "incremental" in report["stages"]
+    assert "merge" not in report["stages"] and "ish" not in report["stages"]
+    assert report["counters"]["stations_appended"] == 1
+
+
+def assert_same_stations(filename, expected_filename):
+    index = load_index(filename)
+    assert sorted(index) == sorted(load_index(expected_filename))
+    with open(filename) as f, open(expected_filename) as f_expected:
+        assert f.readline() == f_expected.readline()
+    for station in index:
+        assert read_station(filename, station) == read_station(expected_filename, station), station
+
+
+def test_incremental_appends_in_place(tmp_path, ftp_root, ftp_server, monkeypatch):
+    incremental_dir, full_dir = str(tmp_path / "incremental"), str(tmp_path / "full")
+    out_dir = os.path.join(incremental_dir, "out")
+    set_local_dirs(monkeypatch, incremental_dir)
+    data.get_interval(1990, 1991, out_dir, catalog=False, incremental=True)
+    merged, ish = os.path.join(out_dir, "plain_format/1990"), os.path.join(out_dir, "ish_format/1990_ish")
+    with open(merged, "rb") as f:
+        merged_data = f.read()
+    with open(ish, "rb") as f:
+        ish_data = f.read()
+
+    rewrite_station(ftp_root, 1990, 50, seed=1)
+    update(incremental_dir, monkeypatch)
+    with open(merged, "rb") as f:
+        assert f.read(len(merged_data)) == merged_data
+    with open(ish, "rb") as f:
+        assert f.read(len(ish_data)) == ish_data
+    rewrite_station(ftp_root, 1990, 50, seed=2)
+    update(incremental_dir, monkeypatch)
+
+    set_local_dirs(monkeypatch, full_dir)
+    data.get_interval(1990, 1991, os.path.join(full_dir, "out"), catalog=False)
+    for output in ("plain_format/1990", "ish_format/1990_ish"):
+        assert_same_stations(os.path.join(out_dir, output), os.path.join(full_dir, "out", output))
+    for output in ("plain_format/1991", "ish_format/1991_ish"):
+        assert filecmp.cmp(os.path.join(out_dir, output), os.path.join(full_dir, "out", output), shallow=False)
+
+    # the appended records are found again when the ish file is rebuilt
+    rebuilt = str(tmp_path / "1990_ish")
+    convert(merged, rebuilt)
+    build_ish_index(rebuilt, load_index(merged))
+    assert_same_stations(rebuilt, os.path.join(full_dir, "out", "ish_format/1990_ish"))
+
+
+def test_incremental_rewrites_changed_station(tmp_path, ftp_root, ftp_server, monkeypatch):
+    incremental_dir, full_dir = str(tmp_path / "incremental"), str(tmp_path / "full")
+    set_local_dirs(monkeypatch, incremental_dir)
+    data.get_interval(1990, 1991, os.path.join(incremental_dir, "out"), catalog=False, incremental=True)
+    rewrite_station(ftp_root, 1990, 50, seed=1)
+    update(incremental_dir, monkeypatch)
+
+    rewrite_station(ftp_root, 1990, LINES_PER_STATION, seed=3, keep=False)
+    update(incremental_dir, monkeypatch)
+
+    set_local_dirs(monkeypatch, full_dir)
+    data.get_interval(1990, 1991, os.path.join(full_dir, "out"), catalog=False)
+    for output in OUTPUTS:
+        assert filecmp.cmp(os.path.join(incremental_dir, "out", output), os.path.join(full_dir, "out", output),
+                           shallow=False), output
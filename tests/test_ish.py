@@ -0,0 +1,31 @@
+import pytest
+
+from benchmarks.synthetic import generate_lines
+from pynoaa import ish
+
+
+def test_tokenize_skips_solar_and_crn_elements():
+    # GH1 and CV1 values that look like element codes must be walked over
+    gh1 = "GH1" + "MA101" + "0" * 23
+    cv1 = "CV1" + "KA101" + "0" * 21
+    ka1 = "KA1" + "0240M+01231"
+    line = "0" * ish.ADD_IDX + ish.ADD_ID + gh1 + cv1 + ka1 + "\n"
+    index = ish.tokenize(line)
+    assert index == dict(GH1=ish.ADD_IDX + 3, CV1=ish.ADD_IDX + 34, KA1=ish.ADD_IDX + 63)
+
+
+@pytest.mark.parametrize("engine", ["python", "bytes"])
+def test_parallel_conversion_reads_carriage_returns(tmp_path, engine):
+    lines = [line.rstrip("\n") for line in generate_lines(300, seed=4)]
+    # old style and windows line endings, as the serial conversion reads them
+    text = "\r".join(lines[:100]) + "\r" + "\r\n".join(lines[100:200]) + "\r\n" + "\n".join(lines[200:]) + "\n"
+    input_filename = str(tmp_path / "data")
+    with open(input_filename, "w", newline="") as f:
+        f.write(text)
+    ish.convert(input_filename, str(tmp_path / "serial"), engine=engine)
+    ish.convert_parallel(input_filename, str(tmp_path / "parallel"), engine=engine, workers=1, chunk_size=4096)
+    with open(str(tmp_path / "serial"), "rb") as f:
+        serial = f.read()
+    assert serial.count(b"\n") == 301
+    with open(str(tmp_path / "parallel"), "rb") as f:
+        assert f.read() == serial
@@ -0,0 +1,40 @@
+import io
+import random
+from datetime import datetime
+
+import pytest
+
+from benchmarks.synthetic import LineGenerator, SECTION_SHARES, generate_station
+from pynoaa import ish, ish_bytes
+
+ALL_SECTIONS = dict((section, 1.) for section in SECTION_SHARES)
+
+
+def edge_lines():
+    """
+    Lines with the values the generator never writes: unsigned or malformed
+    numbers, every element of a repeated section, and lines that bytes and
+    text split differently.
+    """
+    generator = LineGenerator(random.Random(5), shares=dict((section, 0.) for section in SECTION_SHARES))
+    base = generator.line("010010", "99999", datetime(1990, 1, 1))[:ish.ADD_IDX]
+    elements = ["KA1120M01231", "KA1120N-01231", "KA1120N+9999", "KA1120Xabcde", "AW101AW202AW399AW404",
+                "MW1991MW2001", "AJ1999911999999", "AJ1ab1211999999", "OC1ab121", "OC199991",
+                "MA1ab1231099991", "GF1ab991991999999991991", "GF111991051999999909919", "AY191061",
+                "AA1019999", "AA124001021AA206000491AA312012391AA4240600T1"]
+    lines = [base + ish.ADD_ID + element + "\n" for element in elements]
+    lines.append(base[:70] + "-0010" + base[75:] + ish.ADD_ID + "".join(elements[:3]) + "\n")
+    lines.append(base + ish.ADD_ID + elements[0] + "REMSYN004BBB é\n")
+    lines.append(base + "\r" + base + ish.ADD_ID + elements[4] + "\n")
+    return lines
+
+
+@pytest.mark.parametrize("shares,sentinel_share", [(None, .1), (ALL_SECTIONS, .1), (ALL_SECTIONS, .5)])
+def test_bytes_engine_matches_python_engine(shares, sentinel_share):
+    generator = LineGenerator(random.Random(6), shares=shares, sentinel_share=sentinel_share)
+    lines = list(generate_station(generator, 1990, "010010", "99999", 500)) + edge_lines()
+    for line in lines:
+        expected = io.StringIO()
+        # as read from a file in text mode
+        ish.convert_lines(io.StringIO(line, newline=None), expected)
+        assert ish_bytes.convert_line(line.encode()).decode() == expected.getvalue(), line
@@ -0,0 +1,42 @@
+import random
+import re
+from datetime import datetime
+
+import pytest
+
+from benchmarks.synthetic import LineGenerator
+from pynoaa import columnar
+from pynoaa.aggregate import aggregate
+from pynoaa.records import RecordParser
+
+
+def ka1_line(code, temp):
+    """
+    Returns a record whose KA1 section has the given code ("M" for a
+    maximum, "N" for a minimum) and signed temperature in tenths of Celsius
+    degrees, e.g. "-0123".
+    """
+    line = LineGenerator(random.Random(0), shares=dict(KA1=1.0), sentinel_share=0).line(
+        "010000", "99999", datetime(1990, 1, 1))
+    return re.sub(r"KA1120[MN][+-]\d{4}", "KA1120" + code + temp, line)
+
+
+@pytest.mark.parametrize("code, temp, field, value", [("M", "+0123", "max", 54.0), ("N", "-0123", "min", 10.0),
+                                                      ("M", "-0200", "max", -4.0)])
+def test_ka1_temperatures_have_values(code, temp, field, value):
+    line = ka1_line(code, temp)
+    other = "min" if field == "max" else "max"
+    record = RecordParser(["max", "min"]).parse(line)
+    assert record == {field: value, other: None}
+    fields = columnar.get_fields(line)
+    assert float(fields[3 if field == "max" else 4]) == value
+
+
+def test_ka1_temperatures_are_aggregated(tmp_path):
+    filename = str(tmp_path / "1990")
+    with open(filename, "w") as f:
+        f.write(ka1_line("M", "+0123") + ka1_line("M", "+0200") + ka1_line("N", "-0123"))
+    result = aggregate([filename], ["max", "min"], group_by=(), workers=1)
+    assert result[()]["max"]["count"] == 2
+    assert result[()]["max"]["max"] == 68.0
+    assert result[()]["min"]["min"] == 10.0